@@ -0,0 +1,363 @@
+"""Async HTTP API over the extraction pipeline, for systems that can't drive the Streamlit UI.
+
+Examples::
+
+    python api_server.py --port 8080
+    CHAT_API_URL=http://127.0.0.1:8765/chats/ python api_server.py --threads
+    curl -F file=@ticket.pdf -F file=@invoice.pdf http://127.0.0.1:8080/v1/documents
+
+Endpoints:
+- ``POST /v1/documents`` takes one or more PDFs. Send them as
+  ``multipart/form-data`` under any field name, or as a raw
+  ``application/pdf`` body (``?filename=`` names it). It returns
+  ``{"documents": [...]}`` with one record per file. Each record has a
+  ``status`` (``ok``, ``no_text``, ``llm_error``, ``parse_error``, ``error``
+  or ``rejected``) and, when ok, the parsed ``flights`` JSON the UI formats.
+  ``?text=1`` adds the extracted text.
+- ``POST /v1/extract`` takes the same uploads and runs only the text
+  extraction, ``hybrid_process_pdf``.
+- ``GET /healthz`` and ``GET /metrics`` report health and metrics.
+
+Extraction runs in worker processes, or threads with ``--threads``. LLM calls
+are awaited through ``llm_client.AsyncChatClient``, and building the prompt
+and parsing the answer run on a small thread pool. The event loop only parses
+requests and awaits results, so one slow OCR doesn't hold up other requests.
+
+Limits:
+- At most ``API_MAX_CONCURRENT`` documents are processed at once.
+- Once ``API_MAX_QUEUED`` more are waiting, new requests get 503 with
+  ``Retry-After``.
+- Bodies over ``API_MAX_REQUEST_MB`` get 413 before they are read, as do
+  requests with more than ``API_MAX_FILES`` files.
+- Files over ``API_MAX_FILE_MB``, or files that aren't PDFs, get a
+  ``rejected`` record while the rest of the request is still processed.
+
+``benchmarks/stub_chat_server.py`` stands in for the chat endpoint, so
+everything can run locally.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import tornado.httpserver
+import tornado.httputil
+import tornado.netutil
+import tornado.web
+
+import pipeline
+import batch
+import llm_client
+import metrics
+import result_cache
+import singleflight
+
+API_HOST = os.environ.get('API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('API_PORT', '8080'))
+MAX_REQUEST_BYTES = int(float(os.environ.get('API_MAX_REQUEST_MB', '50')) * 1024 * 1024)
+MAX_FILE_BYTES = int(float(os.environ.get('API_MAX_FILE_MB', '20')) * 1024 * 1024)
+MAX_FILES = int(os.environ.get('API_MAX_FILES', '20'))
+MAX_CONCURRENT = int(os.environ.get('API_MAX_CONCURRENT', '4'))
+MAX_QUEUED = int(os.environ.get('API_MAX_QUEUED', '32'))
+EXTRACT_WORKERS = int(os.environ.get('API_EXTRACT_WORKERS',
+                                     str(max(1, (os.cpu_count() or 2) // 2))))
+LLM_WORKERS = int(os.environ.get('API_LLM_WORKERS', '4'))
+BUSY_RETRY_SECONDS = 2
+
+# A PDF header may be preceded by some junk, but must start within the first KB
+PDF_HEADER_WINDOW = 1024
+
+logger = logging.getLogger(__name__)
+
+API_REQUESTS = metrics.registry.counter(
+    'flightdoc_api_requests_total', 'API requests, by endpoint and HTTP status.')
+API_DOCUMENTS = metrics.registry.counter(
+    'flightdoc_api_documents_total', 'Documents handled by the API, by endpoint and status.')
+API_ADMITTED = metrics.registry.gauge(
+    'flightdoc_api_documents_admitted', 'Documents accepted by the API and not finished yet.')
+
+
+class Busy(Exception):
+    """Raised when a request would push the number of waiting documents over the cap."""
+
+
+def check_upload(content):
+    """Why an uploaded file can't be processed, or None if it can."""
+    if not content:
+        return 'Empty file'
+    if len(content) > MAX_FILE_BYTES:
+        return f"File is larger than {MAX_FILE_BYTES // (1024 * 1024)} MB"
+    if b'%PDF-' not in content[:PDF_HEADER_WINDOW]:
+        return 'Not a PDF file'
+    return None
+
+
+def extraction_record(extracted, include_text=True):
+    """Result of an extraction-only request, shaped like ``batch.analyze_text`` records."""
+    record = {key: extracted[key] for key in ('path', 'sha256', 'bytes', 'extract_seconds')}
+    if extracted['error']:
+        record.update(status='error', error=extracted['error'])
+    elif not extracted['text']:
+        record.update(status='no_text', error='Could not extract information from document')
+    else:
+        record['status'] = 'ok'
+    if include_text:
+        record['text'] = extracted['text']
+    return record
+
+
+class DocumentService:
+    """Runs documents through the pipeline off the event loop, a bounded number at a time.
+
+    Extraction goes to a process pool (or thread pool) and the LLM stage to a
+    thread pool, reusing the batch CLI's stages. Admission is counted on the
+    event loop thread, so no lock is needed.
+    """
+
+    def __init__(self, extract_workers=EXTRACT_WORKERS, llm_workers=LLM_WORKERS,
+                 max_concurrent=MAX_CONCURRENT, max_queued=MAX_QUEUED, use_processes=True):
+        if use_processes:
+            self.extract_pool = ProcessPoolExecutor(
+                max_workers=extract_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.extract_pool = ThreadPoolExecutor(max_workers=extract_workers,
+                                                   thread_name_prefix='api-extract')
+        self.llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix='api-llm')
+        # Size the shared chat client's connection pool and in-flight cap to the LLM workers
+        self.llm = llm_client.get_async_client(pipeline.url, pipeline.headers,
+                                               max_in_flight=llm_workers)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self.admitted = 0
+        self.flights = singleflight.AsyncSingleFlight('api')
+        self._slots = None
+
+    def admit(self, count):
+        """Reserve room for ``count`` documents; raises Busy when there is none."""
+        if self.admitted + count > self.max_concurrent + self.max_queued:
+            raise Busy()
+        self.admitted += count
+        API_ADMITTED.set(self.admitted)
+
+    def release(self, count):
+        self.admitted -= count
+        API_ADMITTED.set(self.admitted)
+
+    async def process(self, name, content, analyze=True, include_text=False):
+        """One uploaded file through extraction and, if ``analyze``, the LLM stage."""
+        start = time.perf_counter()
+        problem = check_upload(content)
+        if problem:
+            return {'filename': name, 'bytes': len(content), 'status': 'rejected',
+                    'error': problem}
+
+        # The same PDF uploaded twice, in one request or several, is processed once
+        key = (result_cache.document_hash(content), pipeline.RESULTS_VERSION, analyze, include_text)
+        record = dict(await self.flights.do(key, self._run, content, name, analyze, include_text))
+        del record['path']
+        record['filename'] = name
+        record['total_seconds'] = time.perf_counter() - start
+        return record
+
+    async def _run(self, content, name, analyze, include_text):
+        if self._slots is None:
+            # Created lazily so it binds to the loop that actually serves requests
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            try:
+                extracted = await loop.run_in_executor(
+                    self.extract_pool, batch.extract_content, content, name)
+                if not analyze:
+                    return extraction_record(extracted, include_text)
+                record = await self._analyze(extracted)
+                if include_text:
+                    record['text'] = extracted['text']
+                return record
+            except Exception as e:
+                # A worker died or the pool is shutting down; the other files still get answers
+                logger.exception("Error processing %s", name)
+                return {'path': name, 'bytes': len(content), 'status': 'error', 'error': str(e)}
+
+    async def _analyze(self, extracted):
+        """``batch.analyze_text``, with the chat request awaited through the async client."""
+        loop = asyncio.get_running_loop()
+        record, data = await loop.run_in_executor(self.llm_pool, batch.start_analysis, extracted)
+        if data is None:
+            return record
+        start = time.perf_counter()
+        try:
+            response = await self.llm.post(data)
+        except Exception as e:
+            record.update(status='llm_error', error=str(e))
+            return record
+        finally:
+            record['llm_seconds'] = time.perf_counter() - start
+        return await loop.run_in_executor(self.llm_pool, batch.finish_analysis, record,
+                                          extracted, response)
+
+    def shutdown(self):
+        self.extract_pool.shutdown(wait=False, cancel_futures=True)
+        self.llm_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class JSONErrorHandler(tornado.web.RequestHandler):
+    """Errors as ``{"error": ...}`` and a request counter per endpoint."""
+
+    endpoint = None
+
+    def write_error(self, status_code, **kwargs):
+        if status_code == 503:
+            self.set_header('Retry-After', str(BUSY_RETRY_SECONDS))
+        self.finish({'error': self._reason})
+
+    def on_finish(self):
+        API_REQUESTS.inc(endpoint=self.endpoint, status=self.get_status())
+
+
+@tornado.web.stream_request_body
+class UploadHandler(JSONErrorHandler):
+    """Accepts PDFs and answers with one record per file."""
+
+    endpoint = 'documents'
+    analyze = True
+    # ?text=1 adds the extracted text to each record
+    include_text = '0'
+
+    def initialize(self, service):
+        self.service = service
+        self._chunks = []
+
+    def prepare(self):
+        # Refuse oversized bodies from the header alone, before reading them
+        length = self.request.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > MAX_REQUEST_BYTES:
+            raise tornado.web.HTTPError(
+                413, reason=f"Request is larger than {MAX_REQUEST_BYTES // (1024 * 1024)} MB")
+        if self.request.connection is not None:
+            # Chunked bodies have no length up front; the connection cuts them off instead
+            self.request.connection.set_max_body_size(MAX_REQUEST_BYTES)
+
+    def data_received(self, chunk):
+        self._chunks.append(chunk)
+
+    def uploads(self):
+        """``[(filename, content)]`` from a multipart form or a raw PDF body."""
+        body = b''.join(self._chunks)
+        self._chunks = []
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            arguments, files = {}, {}
+            tornado.httputil.parse_body_arguments(content_type, body, arguments, files)
+            return [(upload['filename'] or 'document.pdf', upload['body'])
+                    for field in files.values() for upload in field]
+        if content_type.split(';')[0].strip() in ('application/pdf', 'application/octet-stream'):
+            return [(self.get_query_argument('filename', 'document.pdf'), body)] if body else []
+        raise tornado.web.HTTPError(
+            415, reason='Send PDFs as multipart/form-data or an application/pdf body')
+
+    async def post(self):
+        uploads = self.uploads()
+        if not uploads:
+            raise tornado.web.HTTPError(400, reason='No PDF in the request')
+        if len(uploads) > MAX_FILES:
+            raise tornado.web.HTTPError(413, reason=f"More than {MAX_FILES} files in one request")
+        include_text = self.get_query_argument('text', self.include_text) == '1'
+
+        try:
+            self.service.admit(len(uploads))
+        except Busy:
+            raise tornado.web.HTTPError(503, reason='Too many documents in progress, retry later')
+        try:
+            records = await asyncio.gather(*[
+                self.service.process(name, content, self.analyze, include_text)
+                for name, content in uploads])
+        finally:
+            self.service.release(len(uploads))
+
+        for record in records:
+            API_DOCUMENTS.inc(endpoint=self.endpoint, status=record['status'])
+        self.write({'documents': records})
+
+
+class ExtractHandler(UploadHandler):
+    """Text extraction only; the LLM is not called."""
+
+    endpoint = 'extract'
+    analyze = False
+    include_text = '1'
+
+
+class HealthHandler(JSONErrorHandler):
+    endpoint = 'healthz'
+
+    def initialize(self, service):
+        self.service = service
+
+    def get(self):
+        self.write({'status': 'ok', 'admitted': self.service.admitted,
+                    'max_concurrent': self.service.max_concurrent,
+                    'max_queued': self.service.max_queued})
+
+
+class MetricsHandler(JSONErrorHandler):
+    endpoint = 'metrics'
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render_prometheus())
+
+
+def make_app(service):
+    return tornado.web.Application([
+        (r'/v1/documents', UploadHandler, {'service': service}),
+        (r'/v1/extract', ExtractHandler, {'service': service}),
+        (r'/healthz', HealthHandler, {'service': service}),
+        (r'/metrics', MetricsHandler),
+    ])
+
+
+async def serve(service, host=API_HOST, port=API_PORT, started=None):
+    """Serve until cancelled. ``port=0`` picks a free port; ``started(port)`` is called once listening."""
+    sockets = tornado.netutil.bind_sockets(port, host)
+    port = sockets[0].getsockname()[1]
+    server = tornado.httpserver.HTTPServer(make_app(service), max_body_size=MAX_REQUEST_BYTES)
+    server.add_sockets(sockets)
+    logger.info("API listening on http://%s:%d/", host, port)
+    if started is not None:
+        started(port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        service.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the flight document pipeline over HTTP.')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS)
+    parser.add_argument('--llm-workers', type=int, default=LLM_WORKERS)
+    parser.add_argument('--max-concurrent', type=int, default=MAX_CONCURRENT,
+                        help='Documents processed at once')
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED,
+                        help='Documents allowed to wait before requests get 503')
+    parser.add_argument('--threads', action='store_true',
+                        help='Extract in threads instead of worker processes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = DocumentService(args.extract_workers, args.llm_workers, args.max_concurrent,
+                              args.max_queued, use_processes=not args.threads)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
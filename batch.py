@@ -0,0 +1,340 @@
+"""Headless batch processing of flight documents into JSONL.
+
+Examples::
+
+    python batch.py ./inbox -o results.jsonl
+    python batch.py "archive/2024-*/**/*.pdf" --extract-workers 8 --llm-workers 16 -o out.jsonl
+    python batch.py --manifest backlog.txt -o out.jsonl
+
+Each input PDF produces one JSON line. Re-running with the same output file
+skips documents whose content hash already has a successful line, so an
+interrupted run picks up where it stopped.
+"""
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pipeline
+import llm_client
+import metrics
+import result_cache
+
+
+def discover_inputs(paths, manifest=None):
+    """Expand folders, globs and an optional manifest into a sorted list of PDF paths.
+
+    Manifest entries that aren't files are reported on stderr and left out.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith('.pdf'))
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            found.extend(match for match in glob.glob(path, recursive=True)
+                         if os.path.isfile(match))
+
+    if manifest:
+        # One path per line, or JSON lines with a "path" field
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('{'):
+                    line = json.loads(line)['path']
+                if os.path.isfile(line):
+                    found.append(line)
+                else:
+                    print(f"Skipping {line}: not a file", file=sys.stderr)
+
+    # De-duplicate, and sort so runs over the same inputs go in the same order
+    return sorted(set(found))
+
+
+def load_completed(output_path):
+    """Hashes of documents that already have a successful line in the output file."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash; the document will be redone
+                continue
+            if record.get('status') == 'ok':
+                completed.add(record['sha256'])
+    return completed
+
+
+def extract_document(path):
+    """Read a PDF and run the hybrid extraction (runs in an extraction worker)."""
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        return {'path': path, 'sha256': None, 'bytes': 0, 'text': None, 'error': str(e),
+                'extract_seconds': 0.0}
+    return extract_content(content, path)
+
+
+def extract_content(content, path=None):
+    """Run the hybrid extraction on PDF bytes; ``path`` only labels the record."""
+    start = time.perf_counter()
+    doc_hash = result_cache.document_hash(content)
+    try:
+        text = pipeline.extract_document_text(content, doc_hash)
+        error = None
+    except Exception as e:
+        text, error = None, str(e)
+    return {
+        'path': path,
+        'sha256': doc_hash,
+        'bytes': len(content),
+        'text': text,
+        'error': error,
+        'extract_seconds': time.perf_counter() - start,
+    }
+
+
+def analyze_text(extracted):
+    """Ask the LLM about extracted text and parse its answer (runs in an LLM thread)."""
+    record, data = start_analysis(extracted)
+    if data is None:
+        return record
+    start = time.perf_counter()
+    try:
+        with metrics.span('llm_post'):
+            response = llm_client.get_client(pipeline.url, pipeline.headers).post(data)
+    except Exception as e:
+        record.update(status='llm_error', error=str(e))
+        return record
+    finally:
+        record['llm_seconds'] = time.perf_counter() - start
+    return finish_analysis(record, extracted, response)
+
+
+def start_analysis(extracted):
+    """``(record, request)``: the record so far and the chat request it needs.
+
+    ``request`` is None when the record is already final: extraction failed,
+    found no text, or the answer was cached.
+    """
+    record = {
+        'path': extracted['path'],
+        'sha256': extracted['sha256'],
+        'bytes': extracted['bytes'],
+        'extract_seconds': extracted['extract_seconds'],
+        'llm_seconds': 0.0,
+    }
+    if extracted['error']:
+        record.update(status='error', error=extracted['error'])
+        return record, None
+    if not extracted['text']:
+        record.update(status='no_text', error='Could not extract information from document')
+        return record, None
+
+    cache = result_cache.get_cache()
+    flight_data = cache.get('flights', extracted['sha256'], pipeline.RESULTS_VERSION)
+    if flight_data is not None:
+        record.update(status='ok', cached=True, flights=flight_data)
+        return record, None
+
+    prompt_stats = {}
+    try:
+        data = pipeline.build_chat_request(extracted['text'], prompt_stats)
+    except Exception as e:
+        record.update(status='llm_error', error=str(e))
+        return record, None
+    record['prompt'] = prompt_stats
+    return record, data
+
+
+def finish_analysis(record, extracted, response):
+    """Complete ``record`` from the chat endpoint's ``response``."""
+    if response.status_code not in [200, 201]:
+        record.update(status='llm_error', error=f"HTTP {response.status_code}")
+        return record
+    try:
+        json_output = pipeline.answer_from_response(response)
+    except Exception as e:
+        record.update(status='llm_error', error=str(e))
+        return record
+
+    try:
+        flight_data = pipeline.parse_flight_json(json_output)
+        pipeline.format_flight_data(flight_data)
+    except Exception as e:
+        record.update(status='parse_error', error=str(e), answer=json_output)
+        return record
+
+    pipeline.remember_flight_data(extracted['sha256'], json_output)
+    record.update(status='ok', cached=False, flights=flight_data)
+    return record
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(records, skipped, elapsed):
+    """Throughput and latency summary for a finished run."""
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+
+    lines = [
+        f"Processed {len(records)} documents in {elapsed:.1f}s "
+        f"({len(records) / elapsed if elapsed else 0.0:.2f} docs/s), skipped {skipped} already done",
+        "Status: " + ', '.join(f"{status}={count}" for status, count in sorted(statuses.items())),
+    ]
+    for label, key in [('extract', 'extract_seconds'), ('llm', 'llm_seconds'),
+                       ('total', 'total_seconds')]:
+        values = [record[key] for record in records if key in record]
+        if values:
+            lines.append(
+                f"{label:>8}: p50={percentile(values, 0.5):.2f}s p95={percentile(values, 0.95):.2f}s "
+                f"max={max(values):.2f}s mean={sum(values) / len(values):.2f}s")
+    return '\n'.join(lines)
+
+
+def make_extract_pool(extract_workers, use_processes):
+    if use_processes:
+        return ProcessPoolExecutor(max_workers=extract_workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers=extract_workers)
+
+
+def failed_record(path, error):
+    """The line written for a document whose extraction or LLM stage raised."""
+    return {'path': path, 'sha256': None, 'status': 'error',
+            'error': f"{type(error).__name__}: {error}"}
+
+
+def run_batch(inputs, output_path, extract_workers=2, llm_workers=4, use_processes=True):
+    """Process ``inputs`` and append one JSON line per document to ``output_path``.
+
+    A document that fails in any way gets a ``status='error'`` line; the run
+    carries on with the rest. If an extraction worker process dies, the pool
+    is replaced for the documents still to come.
+    """
+    completed = load_completed(output_path)
+    # Size the shared chat client's connection pool and in-flight cap to the LLM workers
+    llm_client.get_client(pipeline.url, pipeline.headers, max_in_flight=llm_workers)
+    records = []
+    skipped = 0
+    start = time.perf_counter()
+
+    extract_pool = make_extract_pool(extract_workers, use_processes)
+    llm_pool = ThreadPoolExecutor(max_workers=llm_workers)
+
+    with open(output_path, 'a') as out, llm_pool:
+        pending_inputs = iter(inputs)
+        in_flight = set()
+        submitted_at = {}
+        # Path and pool of each future, for error lines and replacing a broken pool
+        submitted = {}
+
+        def submit_next():
+            nonlocal skipped
+            # Keep a bounded window of documents in flight rather than queueing the whole backlog
+            while len(in_flight) < extract_workers * 2 + llm_workers:
+                path = next(pending_inputs, None)
+                if path is None:
+                    return
+                if completed:
+                    try:
+                        with open(path, 'rb') as f:
+                            if result_cache.document_hash(f.read()) in completed:
+                                skipped += 1
+                                continue
+                    except OSError:
+                        # extract_document reports it
+                        pass
+                future = extract_pool.submit(extract_document, path)
+                submitted_at[future] = time.perf_counter()
+                submitted[future] = (path, extract_pool)
+                in_flight.add(future)
+
+        try:
+            submit_next()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.discard(future)
+                    started = submitted_at.pop(future)
+                    path, pool = submitted.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = failed_record(path, e)
+                        if isinstance(e, BrokenProcessPool) and pool is extract_pool:
+                            # Every document still in the dead pool fails with this too
+                            extract_pool.shutdown(wait=False)
+                            extract_pool = make_extract_pool(extract_workers, use_processes)
+
+                    if 'status' in result:
+                        # An LLM stage finished (or a stage failed): the document is complete
+                        result['total_seconds'] = time.perf_counter() - started
+                        out.write(json.dumps(result) + '\n')
+                        out.flush()
+                        records.append(result)
+                        print(f"[{len(records)}] {result['status']:<11} {result['path']}",
+                              file=sys.stderr)
+                    else:
+                        llm_future = llm_pool.submit(analyze_text, result)
+                        submitted_at[llm_future] = started
+                        submitted[llm_future] = (path, None)
+                        in_flight.add(llm_future)
+                submit_next()
+        finally:
+            extract_pool.shutdown()
+
+    return records, skipped, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract flight information from PDFs into JSONL.')
+    parser.add_argument('inputs', nargs='*', help='PDF files, folders or glob patterns')
+    parser.add_argument('--manifest', help='File listing one PDF path per line (or JSONL with "path")')
+    parser.add_argument('-o', '--output', required=True, help='JSONL file to append results to')
+    parser.add_argument('--extract-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--llm-workers', type=int, default=4)
+    parser.add_argument('--threads', action='store_true',
+                        help='Extract in threads instead of worker processes')
+    args = parser.parse_args()
+
+    inputs = discover_inputs(args.inputs, args.manifest)
+    if not inputs:
+        parser.error('no PDF files found')
+
+    records, skipped, elapsed = run_batch(inputs, args.output, args.extract_workers,
+                                          args.llm_workers, use_processes=not args.threads)
+    print(summarize(records, skipped, elapsed), file=sys.stderr)
+    client_stats = llm_client.get_client(pipeline.url, pipeline.headers).snapshot()
+    print(f"     llm: attempts={client_stats['attempts']} retries={client_stats['retries']} "
+          f"failures={client_stats['failures']} sent={client_stats['bytes_sent']}B "
+          f"received={client_stats['bytes_received']}B", file=sys.stderr)
+    # Stage histograms of this process (extraction spans only when run with --threads)
+    metrics.write_metrics_file()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Measure how parallel OCR scales with page count and worker count.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_parallel_ocr --pages 1 4 16 32 --workers 1 2 4 8 16
+
+Each configuration OCRs a synthetic image-only PDF. Worker pools are started
+and warmed before timing, so the numbers show steady-state throughput rather
+than model load time (which is reported separately).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw
+
+import ocr_pipeline
+
+SAMPLE_LINES = [
+    "ELECTRONIC TICKET ITINERARY RECEIPT",
+    "Booking Reference (PNR): {pnr}",
+    "Passenger: {name}",
+    "Flight {flight}  Departure 08:55  Arrival 12:40",
+    "From DUBAI (DXB) Terminal 3 To LONDON (LHR) Terminal 5",
+    "Date of travel: 14 NOV 2024   Class: Economy   Baggage: 30K",
+    "Ticket number: 176 2400012345   Status: Confirmed",
+]
+
+
+def make_scanned_pdf(page_count, seed=0):
+    """Build an image-only PDF of ``page_count`` A4 pages at 150 dpi."""
+    rng = random.Random(seed)
+    pages = []
+    for page_num in range(page_count):
+        image = Image.new('RGB', (1240, 1754), 'white')
+        draw = ImageDraw.Draw(image)
+        values = {
+            'pnr': ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(6)),
+            'name': rng.choice(['SMITH JOHN', 'KUMAR PRIYA', 'CHEN WEI', 'GARCIA ANA']),
+            'flight': f"{rng.choice(['EK', 'BA', 'QR', 'MU'])} {rng.randint(1, 999)}",
+        }
+        y = 120
+        for _ in range(4):
+            for line in SAMPLE_LINES:
+                draw.text((100, y), line.format(**values), fill='black')
+                y += 40
+        pages.append(image)
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, 'PDF', resolution=150, save_all=True, append_images=pages[1:])
+    return buffer.getvalue()
+
+
+def time_sequential(pdf_content):
+    start = time.perf_counter()
+    pages = list(ocr_pipeline.iter_ocr_pages(pdf_content))
+    return time.perf_counter() - start, len(pages)
+
+
+def time_parallel(pdf_content, workers, threads):
+    start = time.perf_counter()
+    pages = list(ocr_pipeline.ocr_pages_parallel(pdf_content, workers=workers,
+                                                 threads_per_worker=threads))
+    return time.perf_counter() - start, len(pages)
+
+
+def warm_pool(workers, threads):
+    """Start a pool and push one page through every worker so models are loaded."""
+    start = time.perf_counter()
+    pdf_content = make_scanned_pdf(workers, seed=-1)
+    list(ocr_pipeline.ocr_pages_parallel(pdf_content, workers=workers, threads_per_worker=threads))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, os.cpu_count() or 1}))
+    parser.add_argument('--threads', type=int, default=1, help='OMP/MKL threads per worker')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    documents = {count: make_scanned_pdf(count) for count in args.pages}
+
+    # Warm the in-process engine so the sequential baseline excludes model load too
+    list(ocr_pipeline.iter_ocr_pages(make_scanned_pdf(1, seed=-1)))
+
+    for count, pdf_content in documents.items():
+        best = min(time_sequential(pdf_content)[0] for _ in range(args.repeat))
+        results.append({'mode': 'sequential', 'workers': 1, 'pages': count, 'seconds': best})
+
+    for workers in args.workers:
+        startup = warm_pool(workers, args.threads)
+        for count, pdf_content in documents.items():
+            best = min(time_parallel(pdf_content, workers, args.threads)[0]
+                       for _ in range(args.repeat))
+            results.append({'mode': 'parallel', 'workers': workers, 'pages': count,
+                            'seconds': best, 'pool_startup_seconds': startup})
+        ocr_pipeline.shutdown_parallel_pools()
+
+    baseline = {r['pages']: r['seconds'] for r in results if r['mode'] == 'sequential'}
+    print(f"{'mode':<11}{'workers':>8}{'pages':>7}{'seconds':>10}{'pages/s':>9}{'speedup':>9}")
+    for r in results:
+        r['pages_per_second'] = r['pages'] / r['seconds'] if r['seconds'] else 0.0
+        r['speedup'] = baseline[r['pages']] / r['seconds'] if r['seconds'] else 0.0
+        print(f"{r['mode']:<11}{r['workers']:>8}{r['pages']:>7}{r['seconds']:>10.2f}"
+              f"{r['pages_per_second']:>9.2f}{r['speedup']:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'threads_per_worker': args.threads, 'cpu_count': os.cpu_count(),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
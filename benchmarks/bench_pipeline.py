@@ -0,0 +1,181 @@
+"""Time every stage of the pipeline over the synthetic corpus, end to end.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_pipeline --json results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.bench_pipeline --spec scan:5:200 --repeat 5 --compare results/before.json
+
+Each document goes through ``hybrid_process_pdf``, the chat endpoint (a local
+stub, so only our side of the request is measured) and
+``format_for_frontend``, inside a metrics trace, so every span (extraction
+tiers, render, OCR, cleaning, prompt build, POST, formatting) is timed.
+Scanned and mixed documents are also run through ``process_with_paddleocr``
+on its own. Caches are bypassed and the OCR engine is warmed up before timing.
+
+The JSON output records the environment and pipeline versions next to the
+per-document medians, and ``--compare`` prints the change from an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import pipeline
+import metrics
+import ocr_engine
+from benchmarks import corpus
+from benchmarks.stub_chat_server import start_stub_server
+
+
+def load_corpus(directory):
+    """``(name, pdf_bytes)`` for every PDF in a corpus directory."""
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.pdf'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                yield name[:-len('.pdf')], f.read()
+
+
+def run_end_to_end(name, content):
+    """One pass of the full pipeline; returns the finished trace."""
+    with metrics.trace(name, bytes=len(content)) as doc_trace:
+        with metrics.span('hybrid_process_pdf'):
+            text = pipeline.hybrid_process_pdf(content)
+        if text is None:
+            doc_trace.annotate(outcome='no_text')
+            return doc_trace
+        response = pipeline.query_chat_endpoint(text)
+        json_output = pipeline.answer_from_response(response)
+        pipeline.format_for_frontend(json_output)
+        doc_trace.annotate(outcome='ok', text_chars=len(text))
+    return doc_trace
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_document(name, content, repeat, ocr_only):
+    """Median seconds per stage over ``repeat`` runs of one document."""
+    stage_runs = {}
+    totals = []
+    outcome = None
+    attributes = {}
+    for _ in range(repeat):
+        doc_trace = run_end_to_end(name, content)
+        totals.append(doc_trace.total_seconds())
+        outcome = doc_trace.attributes.get('outcome')
+        attributes = doc_trace.attributes
+        for row in doc_trace.rows():
+            stage_runs.setdefault(row['stage'], []).append(row['seconds'])
+
+    result = {
+        'name': name,
+        'bytes': len(content),
+        'pages': attributes.get('pages'),
+        'outcome': outcome,
+        'total_seconds': statistics.median(totals),
+        'stages': {stage: statistics.median(values) for stage, values in stage_runs.items()},
+    }
+
+    text = pipeline.hybrid_process_pdf(content)
+    if text:
+        result['stages']['enhanced_clean_and_preprocess_text'] = statistics.median(
+            time_call(pipeline.enhanced_clean_and_preprocess_text, text) for _ in range(repeat))
+    if ocr_only:
+        result['stages']['process_with_paddleocr'] = statistics.median(
+            time_call(pipeline.process_with_paddleocr, content) for _ in range(repeat))
+    if result['pages']:
+        result['seconds_per_page'] = result['total_seconds'] / result['pages']
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    before = {r['name']: r for r in (previous or {}).get('documents', [])}
+    header = f"{'document':<22}{'pages':>6}{'total s':>9}{'s/page':>8}  slowest stages"
+    if before:
+        header += "   (total vs before)"
+    print(header)
+    for r in results:
+        slowest = sorted(r['stages'].items(), key=lambda item: item[1], reverse=True)[:3]
+        stages = ', '.join(f"{stage}={seconds:.3f}" for stage, seconds in slowest)
+        line = (f"{r['name']:<22}{r['pages'] or 0:>6}{r['total_seconds']:>9.3f}"
+                f"{r.get('seconds_per_page', 0.0):>8.3f}  {stages}")
+        old = before.get(r['name'])
+        if old and old['total_seconds']:
+            line += f"   {r['total_seconds'] / old['total_seconds'] - 1:+.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='Directory of PDFs (default: generate the standard corpus)')
+    parser.add_argument('--spec', action='append', type=corpus.parse_spec,
+                        help='kind:pages[:dpi] to generate instead of the standard corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the stub chat endpoint waits before answering')
+    parser.add_argument('--ocr-all', action='store_true',
+                        help='Also time process_with_paddleocr on text-layer documents')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Earlier --json output to compare against')
+    args = parser.parse_args()
+
+    if args.corpus:
+        documents = list(load_corpus(args.corpus))
+    else:
+        documents = [(name, content) for name, content, _ in
+                     corpus.iter_corpus(args.spec or corpus.DEFAULT_SPECS, args.seed)]
+
+    server, url, _ = start_stub_server('127.0.0.1', latency=args.latency)
+    pipeline.url = url
+    try:
+        warm_up_seconds = time_call(lambda: ocr_engine.warm_up(instances=1))
+        results = []
+        for name, content in documents:
+            ocr_only = args.ocr_all or not name.startswith('text')
+            results.append(bench_document(name, content, args.repeat, ocr_only))
+    finally:
+        server.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'pipeline_version': pipeline.PIPELINE_VERSION,
+                'results_version': pipeline.RESULTS_VERSION,
+                'extraction_tiers': pipeline.EXTRACTION_TIERS,
+                'repeat': args.repeat,
+                'stub_latency': args.latency,
+                'ocr_warm_up_seconds': warm_up_seconds,
+                'peak_rss_bytes': metrics.peak_rss_bytes(),
+                'documents': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
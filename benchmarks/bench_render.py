@@ -0,0 +1,177 @@
+"""Compare render and OCR profiles: OCR time against OCR accuracy.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_render
+    python -m benchmarks.bench_render --profiles fixed balanced --font-sizes 6 10 --json render.json
+    python -m benchmarks.bench_render --profiles fixed --ocr-profiles accurate fast
+
+Single-page itinerary scans are generated at several scan resolutions and
+type sizes (small print to large headings). Each one is rasterized under every
+profile in ``ocr_pipeline.RENDER_PROFILES`` and OCR'd under each requested
+profile in ``ocr_pipeline.OCR_PROFILES``. The benchmark reports
+render and OCR time, pixels per page, and accuracy against the text that was
+printed: word recall, plus recall of the fields the LLM needs (PNR, flight
+numbers, IATA codes and times). Pages are rendered the way the pipeline
+renders them, into pooled buffers, and the bytes that pool allocated are
+reported against what rendering through PIL would have cost.
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+from collections import Counter
+
+import ocr_engine
+import ocr_pipeline
+from benchmarks import corpus
+
+
+def words(text):
+    return re.findall(r'[A-Z0-9]+', text.upper())
+
+
+def key_fields(itinerary):
+    """The strings the LLM can't do without, as they should appear in OCR output."""
+    fields = [itinerary['pnr']]
+    for flight in itinerary['flights']:
+        fields.extend([flight['number'].replace(' ', ''), flight['origin'][0],
+                       flight['destination'][0], flight['departure'], flight['arrival']])
+    return fields
+
+
+def score(text, lines, itinerary):
+    """``(word_recall, field_recall)`` of OCR output against what was printed."""
+    expected = Counter(word for line in lines for word in words(line))
+    found = Counter(words(text))
+    word_recall = sum(min(count, found[word]) for word, count in expected.items())
+    word_recall /= max(1, sum(expected.values()))
+
+    squashed = re.sub(r'\s+', '', text.upper())
+    fields = key_fields(itinerary)
+    field_recall = sum(1 for field in fields if field.replace(' ', '') in squashed) / len(fields)
+    return word_recall, field_recall
+
+
+def make_samples(dpis, font_sizes, samples, seed):
+    """``(dpi, font_size, pdf_bytes, lines, itinerary)`` for every combination."""
+    for dpi in dpis:
+        for font_size in font_sizes:
+            for index in range(samples):
+                rng = random.Random(f"{seed}:{dpi}:{font_size}:{index}")
+                itinerary = corpus.make_itinerary(rng)
+                lines = corpus.document_pages(rng, itinerary, 1)[0]
+                pdf_content = corpus.scanned_pdf([lines], dpi, rng, font_size)
+                yield dpi, font_size, pdf_content, lines, itinerary
+
+
+def run_profile(profile, ocr_profile, samples, pool):
+    rows = []
+    for dpi, font_size, pdf_content, lines, itinerary in samples:
+        start = time.perf_counter()
+        images = ocr_pipeline.iter_page_arrays(pdf_content, profile=profile, pool=pool)
+        try:
+            _, img_array = next(images)
+        finally:
+            images.close()
+        render_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ocr_engine.ocr_engine() as ocr:
+            result = ocr_pipeline.run_ocr(ocr, img_array, ocr_profile)
+        ocr_seconds = time.perf_counter() - start
+        pixels = img_array.shape[0] * img_array.shape[1]
+        del img_array
+
+        word_recall, field_recall = score(ocr_pipeline.extract_page_text(result), lines, itinerary)
+        rows.append({
+            'profile': profile,
+            'ocr_profile': ocr_profile,
+            'dpi': dpi,
+            'font_size': font_size,
+            'pixels': pixels,
+            'render_seconds': render_seconds,
+            'ocr_seconds': ocr_seconds,
+            'word_recall': word_recall,
+            'field_recall': field_recall,
+        })
+    return rows
+
+
+def summarize(rows, key):
+    """Mean of every measurement, grouped by ``key``."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    summary = []
+    for group, members in groups.items():
+        entry = {'group': group, 'pages': len(members)}
+        for field in ('pixels', 'render_seconds', 'ocr_seconds', 'word_recall', 'field_recall'):
+            entry[field] = statistics.mean(member[field] for member in members)
+        summary.append(entry)
+    return summary
+
+
+def print_summary(title, summary):
+    print(title)
+    print(f"{'':<22}{'pages':>6}{'MPix':>7}{'render ms':>11}{'ocr ms':>9}{'words':>8}{'fields':>8}")
+    for entry in summary:
+        print(f"{str(entry['group']):<22}{entry['pages']:>6}{entry['pixels'] / 1e6:>7.2f}"
+              f"{entry['render_seconds'] * 1000:>11.1f}{entry['ocr_seconds'] * 1000:>9.1f}"
+              f"{entry['word_recall']:>8.1%}{entry['field_recall']:>8.1%}")
+    print()
+
+
+def print_buffers(buffers):
+    print('Render buffers')
+    print(f"{'':<22}{'pages':>6}{'allocs':>8}{'reuses':>8}{'MB alloc':>10}{'MB via PIL':>12}{'saved':>8}")
+    for profile, stats in buffers.items():
+        saved = stats['bytes_saved'] / stats['legacy_bytes'] if stats['legacy_bytes'] else 0.0
+        print(f"{profile:<22}{stats['pages']:>6}{stats['allocations']:>8}{stats['reuses']:>8}"
+              f"{stats['bytes_allocated'] / 1e6:>10.1f}{stats['legacy_bytes'] / 1e6:>12.1f}"
+              f"{saved:>8.1%}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', default=list(ocr_pipeline.RENDER_PROFILES))
+    parser.add_argument('--ocr-profiles', nargs='+', default=[ocr_pipeline.OCR_PROFILE])
+    parser.add_argument('--dpis', type=int, nargs='+', default=[100, 150, 300])
+    parser.add_argument('--font-sizes', type=int, nargs='+', default=[6, 10, 18])
+    parser.add_argument('--samples', type=int, default=3, help='Pages per dpi/font size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write every measurement to this file')
+    args = parser.parse_args()
+
+    samples = list(make_samples(args.dpis, args.font_sizes, args.samples, args.seed))
+    ocr_engine.warm_up(instances=1)
+
+    rows = []
+    buffers = {}
+    for profile in args.profiles:
+        pool = ocr_pipeline.PageBufferPool()
+        for ocr_profile in args.ocr_profiles:
+            rows.extend(run_profile(profile, ocr_profile, samples, pool))
+        buffers[profile] = pool.snapshot()
+
+    print_summary('By profile', summarize(rows, lambda row: f"{row['profile']}/{row['ocr_profile']}"))
+    print_summary('By profile and font size',
+                  summarize(rows, lambda row: f"{row['profile']}/{row['ocr_profile']} "
+                                              f"{row['font_size']}pt"))
+    print_buffers(buffers)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'profiles': {name: ocr_pipeline.RENDER_PROFILES[name]
+                                    for name in args.profiles},
+                       'ocr_profiles': {name: ocr_pipeline.OCR_PROFILES[name]
+                                        for name in args.ocr_profiles},
+                       'buffers': buffers,
+                       'rows': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Golden-output check and profile for the text-cleaning engine.
+
+``benchmarks/cleaning_corpus`` holds input texts (``*.txt``) and the output
+the original, pass-by-pass ``enhanced_clean_and_preprocess_text`` produced
+for them (``*.expected``). This script checks that the rule engine in
+text_cleaning.py reproduces every golden file byte for byte, then
+cross-checks both implementations on randomly assembled adversarial text::
+
+    python -m benchmarks.check_cleaning                # verify
+    python -m benchmarks.check_cleaning --profile 200  # plus per-rule timings
+    python -m benchmarks.check_cleaning --regenerate   # rewrite *.expected from the reference
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import text_cleaning
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'cleaning_corpus')
+
+# Fragments chosen to hit rule boundaries: URLs next to each other, joins that
+# only appear after deletions, table rulings, unicode spaces, label casing
+FRAGMENTS = [
+    'http://x.io/a', 'https://', 'www.', 'www.http://y', 'about:bl', 'ank', 'about:blank',
+    'Page 1 of 2', 'Page ', '12/05/2024', '1-2-24', '| |', '|\t|', '---', '__', '_-_', '|',
+    'é', ' ', ' ', '—', '€', '\r', '\n', '\n\n', '\t', '\x1c', '\x0b',
+    ' ', '  ', 'BA123', 'EK 302', 'LHR(', 'LHR (', ')CDG', ') CDG', '10:15hrs', '10:15 PM',
+    '09:30am', '14NOV2024', '14 NOV 2024', 'Flight', 'flight:', 'FLIGHT ', 'Terminal',
+    'terminal:', 'FlighTerminal', 'Terminalflight', '#', '@', '*', '(', ')', '/', '.', ',',
+    'PNR: ABC123', 'Passenger', 'MR', 'SMITH', '2024', '7',
+]
+
+
+def reference_clean(text):
+    """The original implementation, kept verbatim as the reference."""
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r'www\.\S+', '', text)
+    text = re.sub(r'Page \d+ of \d+', '', text)
+    text = re.sub(r'about:blank', '', text)
+    text = re.sub(r'(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})', r'\1 \2 \3', text)
+    text = re.sub(r'\|\s+\|', ' ', text)
+    text = re.sub(r'[-_]{3,}', '', text)
+    text = re.sub(r'[^\x00-\x7F]+', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = text.replace('\r', '\n')
+    text = re.sub(r'([A-Z]{2})\s*(\d{1,4}(?:[A-Z])?)', r'\1 \2', text)
+    text = re.sub(r'([A-Z]{3})\s*\(', r'\1 (', text)
+    text = re.sub(r'\)\s*([A-Z]{3})', r') \1', text)
+    text = re.sub(r'(\d{2}):(\d{2})\s*(?:hrs?|AM|PM)?', r'\1:\2', text, flags=re.IGNORECASE)
+    text = re.sub(r'(\d{2})\s*(\w{3})\s*(\d{4})', r'\1 \2 \3', text)
+    text = re.sub(r'(Flight|Flight:)\s*', 'Flight: ', text, flags=re.IGNORECASE)
+    text = re.sub(r'(Terminal|Terminal:)\s*', 'Terminal: ', text, flags=re.IGNORECASE)
+    text = re.sub(r'[^a-zA-Z0-9\s\(\)\/\-:,\.]', ' ', text)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    return text.strip()
+
+
+def corpus_files():
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith('.txt'):
+            yield os.path.join(CORPUS_DIR, name)
+
+
+def read(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def check_golden():
+    failures = 0
+    for path in corpus_files():
+        expected = read(path[:-len('.txt')] + '.expected')
+        actual = text_cleaning.clean_text(read(path))
+        if actual != expected:
+            failures += 1
+            print(f"MISMATCH {os.path.basename(path)}", file=sys.stderr)
+    return failures
+
+
+def check_fuzz(cases, seed):
+    rng = random.Random(seed)
+    for _ in range(cases):
+        text = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 40)))
+        expected = reference_clean(text)
+        actual = text_cleaning.clean_text(text)
+        if actual != expected:
+            print(f"FUZZ MISMATCH for {text!r}:\n  reference {expected!r}\n  engine    {actual!r}",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+def profile(repeat):
+    texts = [read(path) for path in corpus_files()]
+    text_cleaning.engine.reset_stats()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            reference_clean(text)
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            text_cleaning.clean_text(text)
+    engine_seconds = time.perf_counter() - start
+
+    print(text_cleaning.engine.format_profile())
+    print(f"\nreference: {reference_seconds * 1000:.1f} ms, engine: {engine_seconds * 1000:.1f} ms "
+          f"over {repeat} x {len(texts)} documents")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify and profile the text-cleaning engine.')
+    parser.add_argument('--fuzz', type=int, default=20000, help='Random cases to cross-check')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', type=int, metavar='REPEAT', help='Profile over the corpus')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='Rewrite the *.expected files from the reference implementation')
+    args = parser.parse_args()
+
+    if args.regenerate:
+        for path in corpus_files():
+            with open(path[:-len('.txt')] + '.expected', 'w', encoding='utf-8', newline='') as f:
+                f.write(reference_clean(read(path)))
+
+    failures = check_golden() + check_fuzz(args.fuzz, args.seed)
+    if args.profile:
+        profile(args.profile)
+    if failures:
+        sys.exit(1)
+    print("Cleaning output matches the reference.")
+
+
+if __name__ == '__main__':
+    main()
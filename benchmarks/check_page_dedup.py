@@ -0,0 +1,120 @@
+"""Check that collapsing repeated pages never claims words a copy doesn't have.
+
+A page collapsed by ``page_dedup.collapse_repeated_pages`` must list every
+word it has that its representative lacks, and name in a "not on this page"
+note every word the representative has that it lacks. The check runs on:
+- an e-ticket whose copy drops the return flight (LH400 out, LH401 back);
+- corpus bundles, one page per passenger;
+- random edits of corpus itineraries: lines dropped, added or changed::
+
+    python -m benchmarks.check_page_dedup
+    python -m benchmarks.check_page_dedup --fuzz 2000 --seed 3
+"""
+import argparse
+import collections
+import random
+import re
+import sys
+
+import page_dedup
+from benchmarks import corpus
+
+# Notes hold the dropped words as they were, airport codes in parentheses included
+NOTE = re.compile(r'\(not on this page: ((?:[^()]|\([^()]*\))*)\)')
+
+
+def _missing(counts, other):
+    """Words ``counts`` has more often than ``other``."""
+    return collections.Counter({word: count - other[word] for word, count in counts.items()
+                                if count > other[word]})
+
+
+def check_pages(name, pages):
+    """Collapse ``pages`` (lists of lines) and check every collapsed one; returns failures."""
+    records = [{'page': index, 'text': '\n'.join(lines)} for index, lines in enumerate(pages)]
+    texts = page_dedup.collapse_repeated_pages(records)
+    failures = 0
+    for record, text in zip(records, texts):
+        if 'duplicate_of' not in record:
+            continue
+        words = collections.Counter(record['text'].split())
+        base = collections.Counter(records[record['duplicate_of']]['text'].split())
+        notes = collections.Counter(word for note in NOTE.findall(text) for word in note.split())
+        listed = collections.Counter(NOTE.sub(' ', text).split())
+        added = _missing(_missing(words, base), listed)
+        dropped = _missing(_missing(base, words), notes)
+        if added or dropped:
+            print(f"{name}: page {record['page'] + 1} collapsed to {text!r}\n"
+                  f"  unlisted: {sorted(added)}\n  claimed but not on the page: {sorted(dropped)}",
+                  file=sys.stderr)
+            failures += 1
+    return failures, sum('duplicate_of' in record for record in records)
+
+
+def dropped_return_flight(rng):
+    """Two tickets on one booking; the second passenger only flies the outbound leg.
+
+    Both pages carry the same fare conditions, so the second collapses.
+    """
+    itinerary = corpus.make_itinerary(rng, segments=2, passengers=1)
+    for flight, number in zip(itinerary['flights'], ('400', '401')):
+        flight['airline'] = 'LH'
+        flight['number'] = number
+    outbound = dict(itinerary, passengers=['MUELLER ANNA'], titles=['MS'],
+                    flights=[dict(itinerary['flights'][0], seat='31C')],
+                    ticket=f"{itinerary['ticket'][:3]} {rng.randint(10 ** 9, 10 ** 10 - 1)}")
+    conditions = [rng.choice(corpus.FARE_RULES) for _ in range(12)]
+    return [corpus.itinerary_lines(itinerary) + conditions,
+            corpus.itinerary_lines(outbound) + conditions]
+
+
+def edited_copies(rng):
+    """An itinerary page and copies of it with random lines dropped, added or changed."""
+    itinerary = corpus.make_itinerary(rng)
+    lines = corpus.itinerary_lines(itinerary)
+    pages = [lines]
+    for _ in range(rng.randint(1, 3)):
+        copy = list(lines)
+        for _ in range(rng.randint(1, 3)):
+            index = rng.randrange(len(copy))
+            edit = rng.choice(['drop', 'add', 'change'])
+            if edit == 'drop':
+                del copy[index]
+            elif edit == 'add':
+                copy.insert(index, rng.choice(corpus.FARE_RULES))
+            else:
+                words = copy[index].split()
+                if words:
+                    words[rng.randrange(len(words))] = str(rng.randint(0, 9999))
+                copy[index] = ' '.join(words)
+        pages.append(copy)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the collapsed text of repeated pages.')
+    parser.add_argument('--fuzz', type=int, default=500, help='Random edited documents to check')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures, collapsed = check_pages('dropped return flight', dropped_return_flight(rng))
+    if not collapsed:
+        print("dropped return flight: the copy wasn't collapsed, so nothing was checked",
+              file=sys.stderr)
+        failures += 1
+    cases = []
+    cases.extend((f"bundle {index}", corpus.ticket_pages(rng, corpus.make_itinerary(
+        rng, passengers=rng.randint(2, 4)))) for index in range(20))
+    cases.extend((f"edited {index}", edited_copies(rng)) for index in range(args.fuzz))
+    for name, pages in cases:
+        case_failures, case_collapsed = check_pages(name, pages)
+        failures += case_failures
+        collapsed += case_collapsed
+    if failures:
+        sys.exit(1)
+    print(f"{collapsed} collapsed pages in {len(cases) + 1} documents list every difference.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""Reproducible synthetic corpus of flight itinerary PDFs.
+
+Four kinds of document, all built offline from a seeded random generator:
+
+* ``text``: a real text layer, written directly as PDF operators
+* ``scan``: image-only pages rasterized at a given DPI, as from a scanner
+* ``mixed``: text-layer and scanned pages interleaved in one file
+* ``bundle``: one image-only e-ticket page per passenger, rendered cleanly
+  as from a booking site; the copies differ only in name and ticket number
+
+Each document gets realistic PNRs, flight numbers, IATA codes, times and
+passenger names on its itinerary pages, padded with fare rules up to the
+requested page count. Next to every ``<name>.pdf`` the generator writes
+``<name>.expected.json`` with the answer the LLM should give, in the
+layout ``benchmarks.prompt_regression`` reads::
+
+    python -m benchmarks.corpus -o /tmp/flight-corpus
+    python -m benchmarks.corpus -o /tmp/flight-corpus --spec scan:20:300 --spec mixed:50:150
+"""
+import argparse
+import io
+import json
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+AIRLINES = [
+    ('BA', 'British Airways'), ('EK', 'Emirates'), ('QR', 'Qatar Airways'),
+    ('LH', 'Lufthansa'), ('AF', 'Air France'), ('SQ', 'Singapore Airlines'),
+    ('AI', 'Air India'), ('TK', 'Turkish Airlines'), ('UA', 'United Airlines'),
+    ('6E', 'IndiGo'),
+]
+
+AIRPORTS = [
+    ('LHR', 'LONDON HEATHROW'), ('DXB', 'DUBAI'), ('DOH', 'DOHA'), ('FRA', 'FRANKFURT'),
+    ('CDG', 'PARIS CHARLES DE GAULLE'), ('SIN', 'SINGAPORE CHANGI'), ('DEL', 'DELHI'),
+    ('BOM', 'MUMBAI'), ('IST', 'ISTANBUL'), ('JFK', 'NEW YORK JFK'), ('SFO', 'SAN FRANCISCO'),
+    ('BLR', 'BENGALURU'), ('AMS', 'AMSTERDAM SCHIPHOL'), ('HKG', 'HONG KONG'),
+]
+
+SURNAMES = ['SMITH', 'KUMAR', 'CHEN', 'GARCIA', 'MUELLER', 'NGUYEN', 'OKAFOR', 'ROSSI',
+            'SHARMA', 'TANAKA', 'WILLIAMS', 'HASSAN']
+GIVEN_NAMES = ['JOHN', 'PRIYA', 'WEI', 'ANA', 'LUKAS', 'LINH', 'CHIDI', 'GIULIA',
+               'RAHUL', 'YUKI', 'EMMA', 'OMAR']
+TITLES = ['MR', 'MRS', 'MS', 'MSTR']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+FARE_RULES = [
+    "Fare rules: changes permitted up to 24 hours before departure subject to a fee.",
+    "Refunds are subject to the fare conditions of the ticket and applicable taxes.",
+    "Baggage allowance is shown per passenger and applies to each segment of the journey.",
+    "Check-in closes 60 minutes before departure for international flights.",
+    "Passengers must carry a valid passport and any visas required for the journey.",
+    "Carriage is subject to the conditions of contract of the operating carrier.",
+    "Dangerous goods must not be packed in checked or cabin baggage.",
+    "Seat assignments are not guaranteed and may change for operational reasons.",
+    "The carrier is not liable for delays caused by weather or air traffic control.",
+    "Please reconfirm your onward and return flights at least 72 hours in advance.",
+]
+
+# A4 in PDF points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+FONT_SIZE = 10
+LINE_HEIGHT = 14
+LINES_PER_PAGE = 52
+
+# (kind, pages, dpi) of the default corpus; dpi is ignored for text documents
+DEFAULT_SPECS = [
+    ('text', 1, None), ('text', 5, None), ('text', 20, None), ('text', 50, None),
+    ('scan', 1, 100), ('scan', 1, 150), ('scan', 1, 200), ('scan', 1, 300),
+    ('scan', 5, 150), ('scan', 20, 150),
+    ('mixed', 5, 150), ('mixed', 20, 150), ('mixed', 50, 150),
+]
+
+
+def _code(rng, length, alphabet='ABCDEFGHJKLMNPQRSTUVWXYZ23456789'):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def make_itinerary(rng, segments=None, passengers=None):
+    """Random booking with one PNR, 1-4 passengers and a connected route."""
+    segments = segments or rng.randint(1, 4)
+    passengers = passengers or rng.randint(1, 4)
+    names = []
+    for _ in range(passengers):
+        names.append(f"{rng.choice(SURNAMES)} {rng.choice(GIVEN_NAMES)}")
+
+    route = rng.sample(AIRPORTS, segments + 1)
+    day, month, year = rng.randint(1, 25), rng.randrange(12), rng.choice([2024, 2025])
+    flights = []
+    for index in range(segments):
+        code, airline = rng.choice(AIRLINES)
+        # Same-day flights only, so one date covers departure and arrival
+        departure = (rng.randint(0, 13), rng.choice([0, 5, 15, 20, 35, 45, 50]))
+        minutes = departure[0] * 60 + departure[1] + rng.randint(1, 9) * 60 + 25
+        arrival = (minutes // 60, minutes % 60)
+        date = f"{day + index:02d} {MONTHS[month]} {year}"
+        flights.append({
+            'code': code,
+            'airline': airline,
+            'number': f"{code} {rng.randint(1, 999)}",
+            'origin': route[index],
+            'destination': route[index + 1],
+            'date': date,
+            'departure': f"{departure[0]:02d}:{departure[1]:02d}",
+            'arrival': f"{arrival[0]:02d}:{arrival[1]:02d}",
+            'terminal': rng.randint(1, 5),
+            'seat': f"{rng.randint(1, 60)}{rng.choice('ABCDEF')}",
+        })
+
+    return {
+        'pnr': _code(rng, 6),
+        'ticket': f"{rng.randint(100, 999)} {rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        'passengers': names,
+        'titles': [rng.choice(TITLES) for _ in names],
+        'flights': flights,
+    }
+
+
+def itinerary_lines(itinerary):
+    """The itinerary page(s) as lines of text, as an airline e-ticket would print them."""
+    lines = [
+        "ELECTRONIC TICKET ITINERARY RECEIPT",
+        "",
+        f"Booking Reference (PNR): {itinerary['pnr']}",
+        f"Ticket Number: {itinerary['ticket']}",
+        "",
+        "Passenger Name",
+    ]
+    for title, name in zip(itinerary['titles'], itinerary['passengers']):
+        surname, given = name.split(' ', 1)
+        lines.append(f"  {surname}/{given} {title}")
+    lines.append("")
+    for index, flight in enumerate(itinerary['flights'], 1):
+        origin_code, origin_city = flight['origin']
+        destination_code, destination_city = flight['destination']
+        lines.extend([
+            f"Flight {index}: {flight['airline']} {flight['number']}",
+            f"  Departure: {origin_city} ({origin_code}) Terminal {flight['terminal']}"
+            f"  {flight['date']} {flight['departure']}",
+            f"  Arrival: {destination_city} ({destination_code})"
+            f"  {flight['date']} {flight['arrival']}",
+            f"  Class: Economy  Seat: {flight['seat']}  Baggage: 30K  Status: Confirmed",
+            "",
+        ])
+    return lines
+
+
+def expected_answer(itinerary):
+    """What the LLM should extract from the document, in the app's JSON format."""
+    flights = []
+    for flight in itinerary['flights']:
+        flights.append({
+            'passenger_names': itinerary['passengers'],
+            'flight_origin': flight['origin'][0],
+            'flight_destination': flight['destination'][0],
+            'travel_number': itinerary['pnr'],
+            'date_of_travel': f"{flight['date']} {flight['departure']} - "
+                              f"{flight['date']} {flight['arrival']}",
+            'flight_name': f"{flight['airline']} {flight['number']}",
+            'notes': '',
+        })
+    return {'passenger_names': itinerary['passengers'], 'flights': flights}
+
+
+def document_pages(rng, itinerary, page_count):
+    """Split the itinerary over the first page(s) and pad with fare rules to ``page_count``."""
+    lines = itinerary_lines(itinerary)
+    pages = [lines[start:start + LINES_PER_PAGE] for start in range(0, len(lines), LINES_PER_PAGE)]
+    while len(pages) < page_count:
+        pages.append([f"Conditions of carriage - page {len(pages) + 1}", ""] +
+                     [rng.choice(FARE_RULES) for _ in range(rng.randint(20, 40))])
+    return pages[:max(page_count, 1)]
+
+
+def ticket_pages(rng, itinerary):
+    """One e-ticket page per passenger, each with its own ticket number."""
+    pages = []
+    for title, name in zip(itinerary['titles'], itinerary['passengers']):
+        ticket = dict(itinerary, passengers=[name], titles=[title],
+                      ticket=f"{itinerary['ticket'][:3]} {rng.randint(10 ** 9, 10 ** 10 - 1)}")
+        pages.append(itinerary_lines(ticket))
+    return pages
+
+
+def _pdf_string(text):
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def _text_page(lines):
+    """Content stream that draws ``lines`` in Helvetica, one per ``'`` operator."""
+    operators = [f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL 50 {PAGE_HEIGHT - 50} Td"]
+    operators.extend(f"{_pdf_string(line)} '" for line in lines)
+    operators.append("ET")
+    return '\n'.join(operators).encode('latin-1')
+
+
+def _image_xobject(image):
+    """A grayscale page image as a JPEG (DCTDecode) image XObject."""
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    data = buffer.getvalue()
+    header = (f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+              f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode "
+              f"/Length {len(data)} >>\nstream\n").encode()
+    return header + data + b"\nendstream"
+
+
+def build_pdf(pages):
+    """Write a PDF from pages that are either lists of text lines or PIL images.
+
+    Written by hand rather than with PIL or PDFium, which both stamp the
+    current time into the file, so the same seed always gives the same bytes
+    (and the same document hash).
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for page in pages:
+        page_id = len(objects) + 1
+        kids.append(page_id)
+        if isinstance(page, Image.Image):
+            # Image stretched over the whole page, as a scanner would produce
+            resources = f"/XObject << /Im1 {page_id + 2} 0 R >>"
+            stream = f"q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im1 Do Q".encode()
+        else:
+            resources = "/Font << /F1 3 0 R >>"
+            stream = _text_page(page)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << {resources} >> /Contents {page_id + 1} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        if isinstance(page, Image.Image):
+            objects.append(_image_xobject(page))
+    objects[1] = (f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] "
+                  f"/Count {len(kids)} >>").encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render_page(lines, dpi, rng=None, font_size=FONT_SIZE):
+    """Rasterize one page of lines at ``dpi``, with slight skew and noise if ``rng`` is given."""
+    scale = dpi / 72
+    image = Image.new('L', (round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=round(font_size * scale))
+    except TypeError:
+        # Pillow without FreeType only has the fixed-size bitmap font
+        font = ImageFont.load_default()
+    y = 50 * scale
+    for line in lines:
+        draw.text((50 * scale, y), line, fill=0, font=font)
+        y += font_size * LINE_HEIGHT / FONT_SIZE * scale
+
+    if rng is not None:
+        # Scanner-ish: a small rotation and a sprinkling of dust
+        image = image.rotate(rng.uniform(-0.6, 0.6), fillcolor=255, resample=Image.BILINEAR)
+        pixels = image.load()
+        for _ in range(image.width * image.height // 4000):
+            pixels[rng.randrange(image.width), rng.randrange(image.height)] = rng.randint(0, 120)
+    return image
+
+
+def text_layer_pdf(pages):
+    """PDF whose pages carry a real text layer."""
+    return build_pdf(pages)
+
+
+def scanned_pdf(pages, dpi, rng=None, font_size=FONT_SIZE):
+    """Image-only PDF with every page rasterized at ``dpi``."""
+    return build_pdf([render_page(lines, dpi, rng, font_size) for lines in pages])
+
+
+def mixed_pdf(pages, dpi, rng):
+    """Interleave text-layer and scanned pages; the itinerary page is always scanned."""
+    mixed = []
+    for page_num, lines in enumerate(pages):
+        if page_num == 0 or rng.random() < 0.4:
+            mixed.append(render_page(lines, dpi, rng))
+        else:
+            mixed.append(lines)
+    return build_pdf(mixed)
+
+
+def document_name(kind, page_count, dpi):
+    return f"{kind}_{page_count:02d}p" + (f"_{dpi}dpi" if dpi and kind != 'text' else '')
+
+
+def make_document(kind, page_count, dpi=150, seed=0):
+    """Build one document; returns ``(name, pdf_bytes, expected_answer)``."""
+    name = document_name(kind, page_count, dpi)
+    rng = random.Random(f"{seed}:{name}")
+    if kind == 'bundle':
+        # One page per passenger
+        itinerary = make_itinerary(rng, passengers=max(page_count, 1))
+        return name, scanned_pdf(ticket_pages(rng, itinerary), dpi), expected_answer(itinerary)
+    itinerary = make_itinerary(rng)
+    pages = document_pages(rng, itinerary, page_count)
+    if kind == 'text':
+        content = text_layer_pdf(pages)
+    elif kind == 'scan':
+        content = scanned_pdf(pages, dpi, rng)
+    elif kind == 'mixed':
+        content = mixed_pdf(pages, dpi, rng)
+    else:
+        raise ValueError(f"Unknown document kind: {kind}")
+    return name, content, expected_answer(itinerary)
+
+
+def iter_corpus(specs=DEFAULT_SPECS, seed=0):
+    """Yield ``(name, pdf_bytes, expected_answer)`` for every spec."""
+    for kind, page_count, dpi in specs:
+        yield make_document(kind, page_count, dpi or 150, seed)
+
+
+def parse_spec(value):
+    """``kind:pages[:dpi]`` from the command line."""
+    parts = value.split(':')
+    if len(parts) not in (2, 3) or parts[0] not in ('text', 'scan', 'mixed', 'bundle'):
+        raise argparse.ArgumentTypeError(f"expected kind:pages[:dpi], got {value!r}")
+    return parts[0], int(parts[1]), int(parts[2]) if len(parts) == 3 else None
+
+
+def write_corpus(directory, specs=DEFAULT_SPECS, seed=0):
+    """Write every document and its expected answer into ``directory``."""
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for name, content, expected in iter_corpus(specs, seed):
+        with open(os.path.join(directory, name + '.pdf'), 'wb') as f:
+            f.write(content)
+        with open(os.path.join(directory, name + '.expected.json'), 'w') as f:
+            json.dump(expected, f, indent=2)
+        names.append(name)
+        print(f"{name:<22}{len(content) / 1024:>10.0f} KB")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the synthetic flight-document corpus.')
+    parser.add_argument('-o', '--output', required=True, help='Directory to write PDFs into')
+    parser.add_argument('--spec', action='append', type=parse_spec,
+                        help='kind:pages[:dpi], e.g. scan:20:300 (repeatable; default: full corpus)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_corpus(args.output, args.spec or DEFAULT_SPECS, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Import time and memory of the app's entry modules, from ``python -X importtime``.
+
+Run from the repository root::
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --json results/imports.json
+    python -m benchmarks.import_time --compare results/imports.json --tolerance 0.25
+
+Each module is imported in a fresh interpreter with ``-X importtime``; the
+best of ``--repeat`` runs is kept. The report gives the total import time,
+peak RSS right after the import, and the slowest packages it pulled in.
+
+The command exits non-zero when a regression shows up, so it can gate CI:
+- a module loads any of the ``--forbid`` packages. By default these are the
+  Paddle stack, which must load only when a page actually needs OCR.
+- with ``--compare``, a module's import time grows by more than
+  ``--tolerance`` over the earlier run.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULES = ['app', 'pipeline', 'batch', 'ocr_pipeline', 'ocr_engine', 'ocr_worker']
+DEFAULT_FORBID = ['paddle', 'paddleocr', 'cv2']
+
+# Printed on stdout by the child after the import: peak RSS and the forbidden packages it loaded
+PROBE = '''
+import json, resource, sys
+import {module}
+print(json.dumps({{
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'forbidden': sorted(name for name in {forbid!r} if name in sys.modules),
+}}))
+'''
+
+
+def parse_importtime(stderr):
+    """``[(name, depth, self_us, cumulative_us)]`` from ``-X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # The header line
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), depth, int(parts[0]), int(parts[1])))
+    return rows
+
+
+def measure(module, forbid):
+    """Import ``module`` once in a fresh interpreter."""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, forbid=forbid)],
+        capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    rows = parse_importtime(completed.stderr)
+    probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    top_level = [row for row in rows if row[1] == 0]
+    # Self time summed per distribution root, e.g. every ``streamlit.*`` module
+    by_package = {}
+    for name, _, self_us, _ in rows:
+        root = name.split('.')[0]
+        by_package[root] = by_package.get(root, 0) + self_us
+    return {
+        'module': module,
+        'seconds': sum(row[3] for row in top_level) / 1e6,
+        'modules_imported': len(rows),
+        # Linux reports kilobytes, macOS bytes
+        'peak_rss_mb': probe['peak_rss_kb'] / (1024 if sys.platform != 'darwin' else 1024 ** 2),
+        'forbidden': probe['forbidden'],
+        'slowest': [{'package': name, 'seconds': self_us / 1e6}
+                    for name, self_us in sorted(by_package.items(), key=lambda item: -item[1])],
+    }
+
+
+def best_of(module, forbid, repeat):
+    runs = [measure(module, forbid) for _ in range(repeat)]
+    return min(runs, key=lambda run: run['seconds'])
+
+
+def print_report(results, top, previous=None):
+    before = {r['module']: r for r in (previous or {}).get('modules', [])}
+    print(f"{'module':<16}{'import s':>10}{'modules':>9}{'RSS MB':>8}  slowest packages (self time)")
+    for r in results:
+        slowest = ', '.join(f"{entry['package']}={entry['seconds']:.2f}"
+                            for entry in r['slowest'][:top])
+        line = (f"{r['module']:<16}{r['seconds']:>10.3f}{r['modules_imported']:>9}"
+                f"{r['peak_rss_mb']:>8.0f}  {slowest}")
+        old = before.get(r['module'])
+        if old and old['seconds']:
+            line += f"   ({r['seconds'] / old['seconds'] - 1:+.0%} vs before)"
+        print(line)
+
+
+def regressions(results, previous, tolerance):
+    problems = []
+    before = {r['module']: r for r in (previous or {}).get('modules', [])}
+    for r in results:
+        if r['forbidden']:
+            problems.append(f"{r['module']} imports {', '.join(r['forbidden'])}")
+        old = before.get(r['module'])
+        if old and r['seconds'] > old['seconds'] * (1 + tolerance):
+            problems.append(f"{r['module']} import time {old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports listed per module')
+    parser.add_argument('--forbid', nargs='*', default=DEFAULT_FORBID,
+                        help='Packages that must not be loaded by importing the modules')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Earlier --json output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed import time growth over --compare before failing')
+    args = parser.parse_args()
+
+    results = [best_of(module, args.forbid, args.repeat) for module in args.modules]
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, args.top, previous)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'forbid': args.forbid,
+                       'modules': results}, f, indent=2)
+
+    problems = regressions(results, previous, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
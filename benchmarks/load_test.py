@@ -0,0 +1,236 @@
+"""Drive many documents through the pipeline at once; report latency percentiles, throughput and errors.
+
+Run from the repository root::
+
+    python -m benchmarks.load_test --concurrency 1 2 4 8 --documents 32
+    python -m benchmarks.load_test --spec scan:2 --ocr-profile fast --latency 1.5 --jitter 0.5
+    python -m benchmarks.load_test --distinct 4 --cache warm --error-rate 0.05 --json results/load.json
+    python -m benchmarks.load_test --target api --api-url http://127.0.0.1:8080
+
+Targets:
+- ``--target app`` (the default) runs ``pipeline.run_document_job`` on
+  ``concurrency`` threads. This is the body of the UI's jobs: result cache,
+  single-flight, extraction and the LLM call.
+- ``--target api`` posts each document to the API server's
+  ``/v1/documents``. The server is started here on a free port unless
+  ``--api-url`` points at a running one.
+Chat requests go to the local stub (``stub_chat_server``). It takes
+``--latency``, ``--jitter``, ``--error-rate`` and ``--stream``, so
+nothing leaves the machine.
+
+Each concurrency level processes ``--documents`` documents, closed-loop:
+a worker starts its next document as soon as its last one finishes. The
+documents cycle through ``--distinct`` different ones from the synthetic
+corpus, so repeats exercise the result cache and coalescing.
+- ``--cache cold`` generates new documents for every level, so nothing is
+  cached when a level starts.
+- ``--cache warm`` processes each distinct document once before measuring.
+
+The OCR profile, render profile and LLM streaming are read from the
+environment when the pipeline is imported. This module therefore sets them
+first and imports the pipeline lazily.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks import corpus
+from benchmarks.stub_chat_server import start_stub_server
+
+SUCCESS_STATUSES = ('ok', 'cached')
+
+
+def configure(args):
+    """Environment the pipeline reads at import, from the command line."""
+    if args.ocr_profile:
+        os.environ['OCR_PROFILE'] = args.ocr_profile
+    if args.render_profile:
+        os.environ['OCR_RENDER_PROFILE'] = args.render_profile
+    os.environ['LLM_STREAM'] = '1' if args.stream else '0'
+    # Keep the load test's results out of the app's on-disk cache
+    os.environ.setdefault('RESULT_CACHE_PATH', '')
+
+
+def make_documents(specs, distinct, seed):
+    """``distinct`` corpus documents cycling through ``specs``, unique per ``seed``."""
+    documents = []
+    for i in range(distinct):
+        kind, page_count, dpi = specs[i % len(specs)]
+        name, content, _ = corpus.make_document(kind, page_count, dpi or 150, seed=seed + i)
+        documents.append((f"{name}-{seed + i}", content))
+    return documents
+
+
+def run_app_document(name, content):
+    import pipeline
+    return pipeline.run_document_job(content, name)['outcome']
+
+
+class ApiTarget:
+    """Posts documents to an API server, one pooled connection per load-test worker."""
+
+    def __init__(self, base_url, concurrency):
+        self.url = base_url.rstrip('/') + '/v1/documents'
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+
+    def __call__(self, name, content):
+        response = self.session.post(self.url, files=[('file', (name + '.pdf', content,
+                                                                'application/pdf'))])
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return response.json()['documents'][0]['status']
+
+
+def start_api(use_processes):
+    """Serve the API from a background thread; returns its base URL."""
+    import api_server
+    service = api_server.DocumentService(use_processes=use_processes)
+    ports = []
+    started = threading.Event()
+
+    def listening(port):
+        ports.append(port)
+        started.set()
+
+    threading.Thread(target=lambda: asyncio.run(api_server.serve(service, '127.0.0.1', 0, listening)),
+                     name='load-test-api', daemon=True).start()
+    started.wait()
+    return f"http://127.0.0.1:{ports[0]}"
+
+
+def counters(group):
+    """Totals that each level reports as a difference: coalesced calls and LLM retries."""
+    import pipeline
+    import llm_client
+    import singleflight
+    return {
+        'coalesced': singleflight.SINGLEFLIGHT_CALLS.value(group=group, role='coalesced'),
+        'llm_retries': llm_client.get_client(pipeline.url, pipeline.headers).snapshot()['retries'],
+    }
+
+
+def run_level(target, documents, total, concurrency):
+    """Process ``total`` documents on ``concurrency`` workers; returns per-document records."""
+    def timed(index):
+        name, content = documents[index % len(documents)]
+        start = time.perf_counter()
+        try:
+            status = target(name, content)
+        except Exception as e:
+            status = f"exception: {type(e).__name__}"
+        return {'status': status, 'seconds': time.perf_counter() - start}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(timed, range(total)))
+
+
+def summarize(records, elapsed, concurrency):
+    from batch import percentile
+    latencies = [record['seconds'] for record in records]
+    errors = [record for record in records if record['status'] not in SUCCESS_STATUSES]
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+    return {
+        'concurrency': concurrency,
+        'documents': len(records),
+        'seconds': elapsed,
+        'throughput': len(records) / elapsed if elapsed else 0.0,
+        'error_rate': len(errors) / len(records) if records else 0.0,
+        'statuses': statuses,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies, default=0.0),
+    }
+
+
+def print_levels(levels):
+    print(f"{'conc':>5}{'docs':>6}{'docs/s':>8}{'err %':>7}{'p50 s':>8}{'p95 s':>8}"
+          f"{'p99 s':>8}{'max s':>8}{'llm':>6}{'coal':>6}{'retry':>6}")
+    for level in levels:
+        print(f"{level['concurrency']:>5}{level['documents']:>6}{level['throughput']:>8.2f}"
+              f"{level['error_rate'] * 100:>7.1f}{level['p50']:>8.2f}{level['p95']:>8.2f}"
+              f"{level['p99']:>8.2f}{level['max']:>8.2f}{level['llm_requests']:>6}"
+              f"{level.get('coalesced', '-'):>6}{level.get('llm_retries', '-'):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('app', 'api'), default='app')
+    parser.add_argument('--api-url', help='Running API server to load (default: start one here)')
+    parser.add_argument('--threads', action='store_true',
+                        help='Extract in threads instead of processes in the API server started here')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--documents', type=int, default=16, help='Documents per concurrency level')
+    parser.add_argument('--distinct', type=int, help='Different documents cycled (default: --documents)')
+    parser.add_argument('--cache', choices=('cold', 'warm'), default='cold')
+    parser.add_argument('--spec', action='append', type=corpus.parse_spec,
+                        help='kind:pages[:dpi] of the documents (default: text:2 and scan:2)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ocr-profile', help='OCR_PROFILE for this run')
+    parser.add_argument('--render-profile', help='OCR_RENDER_PROFILE for this run')
+    parser.add_argument('--latency', type=float, default=1.0, help='Stub chat endpoint latency')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra stub latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of chat requests the stub fails with 503')
+    parser.add_argument('--stream', action='store_true', help='Stream the LLM answers')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    configure(args)
+    server, stub_url, stub = start_stub_server(latency=args.latency, jitter=args.jitter,
+                                               error_rate=args.error_rate, seed=args.seed)
+    # The chat client reads the endpoint when the pipeline is imported
+    os.environ['CHAT_API_URL'] = stub_url
+
+    specs = args.spec or [('text', 2, None), ('scan', 2, None)]
+    distinct = args.distinct or args.documents
+    if args.target == 'api':
+        base_url = args.api_url or start_api(use_processes=not args.threads)
+        target = ApiTarget(base_url, max(args.concurrency))
+        group = None if args.api_url else 'api'
+    else:
+        target = run_app_document
+        group = 'document'
+
+    levels = []
+    documents = make_documents(specs, distinct, args.seed)
+    if args.cache == 'warm':
+        run_level(target, documents, len(documents), max(args.concurrency))
+    for level_index, concurrency in enumerate(args.concurrency):
+        if args.cache == 'cold' and level_index:
+            documents = make_documents(specs, distinct, args.seed + level_index * distinct)
+        before = counters(group) if group else {}
+        llm_before = stub.requests
+        start = time.perf_counter()
+        records = run_level(target, documents, args.documents, concurrency)
+        level = summarize(records, time.perf_counter() - start, concurrency)
+        level['llm_requests'] = stub.requests - llm_before
+        if group:
+            level.update({key: int(value - before[key]) for key, value in counters(group).items()})
+        levels.append(level)
+        print(f"concurrency {concurrency}: {level['throughput']:.2f} docs/s, "
+              f"p95 {level['p95']:.2f}s, statuses {level['statuses']}", file=sys.stderr)
+
+    print_levels(levels)
+    server.shutdown()
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'argv': sys.argv[1:], 'ocr_profile': os.environ.get('OCR_PROFILE'),
+                       'render_profile': os.environ.get('OCR_RENDER_PROFILE'),
+                       'levels': levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
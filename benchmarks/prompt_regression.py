@@ -0,0 +1,149 @@
+"""Check that a prompt change doesn't lower extraction quality.
+
+Each case is a document plus the answer it should produce::
+
+    cases/
+        emirates_eticket.pdf            (or emirates_eticket.txt with extracted text)
+        emirates_eticket.expected.json  ({"passenger_names": [...], "flights": [...]})
+
+Every prompt mode is run over every case against the configured chat endpoint
+(CHAT_API_URL), and field-level accuracy is compared with the first mode::
+
+    python -m benchmarks.prompt_regression cases/ --modes legacy compact
+
+Exits non-zero when a mode scores more than ``--tolerance`` below the baseline.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pipeline
+import llm_client
+import prompt_builder
+
+FLIGHT_FIELDS = ['flight_origin', 'flight_destination', 'travel_number',
+                 'date_of_travel', 'flight_name']
+
+
+def load_cases(directory):
+    """Yield ``(name, document_text, expected)`` for every case in ``directory``."""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.expected.json'):
+            continue
+        stem = name[:-len('.expected.json')]
+        with open(os.path.join(directory, name)) as f:
+            expected = json.load(f)
+
+        text_path = os.path.join(directory, stem + '.txt')
+        pdf_path = os.path.join(directory, stem + '.pdf')
+        if os.path.exists(text_path):
+            with open(text_path) as f:
+                text = f.read()
+        elif os.path.exists(pdf_path):
+            with open(pdf_path, 'rb') as f:
+                text = pipeline.extract_document_text(f.read())
+        else:
+            print(f"Skipping {stem}: no .txt or .pdf next to the expected answer", file=sys.stderr)
+            continue
+        yield stem, text, expected
+
+
+def normalize(value):
+    if isinstance(value, list):
+        return sorted(normalize(v) for v in value)
+    return ' '.join(str(value or '').upper().split())
+
+
+def score(answer, expected):
+    """Return ``(correct, total)`` field matches of an answer against the expectation."""
+    correct = total = 0
+
+    total += 1
+    correct += normalize(answer.get('passenger_names', [])) == normalize(expected.get('passenger_names', []))
+
+    expected_flights = expected.get('flights', [])
+    answer_flights = answer.get('flights', [])
+    for index, expected_flight in enumerate(expected_flights):
+        answer_flight = answer_flights[index] if index < len(answer_flights) else {}
+        for field in FLIGHT_FIELDS:
+            total += 1
+            correct += normalize(answer_flight.get(field)) == normalize(expected_flight.get(field))
+
+    # Extra segments the document doesn't have count against the answer
+    total += max(0, len(answer_flights) - len(expected_flights))
+    return correct, total
+
+
+def run_mode(mode, cases, client):
+    builder = prompt_builder.PromptBuilder(pipeline.PROMPT_TEMPLATE, mode)
+    result = {'mode': mode, 'version': builder.version, 'correct': 0, 'total': 0,
+              'errors': 0, 'prompt_tokens': 0, 'document_tokens': 0, 'request_bytes': 0,
+              'seconds': 0.0, 'cases': {}}
+
+    for name, text, expected in cases:
+        if not text:
+            result['errors'] += 1
+            continue
+        payload, stats = builder.build(text)
+        start = time.perf_counter()
+        try:
+            response = client.post(payload)
+            answer = pipeline.parse_flight_json(pipeline.answer_from_response(response))
+        except Exception as e:
+            print(f"{mode}: {name}: {e}", file=sys.stderr)
+            result['errors'] += 1
+            answer = {}
+        result['seconds'] += time.perf_counter() - start
+
+        correct, total = score(answer, expected)
+        result['correct'] += correct
+        result['total'] += total
+        result['prompt_tokens'] += stats['prompt_tokens']
+        result['document_tokens'] += stats['document_tokens']
+        result['request_bytes'] += len(json.dumps(payload))
+        result['cases'][name] = {'correct': correct, 'total': total}
+
+    result['accuracy'] = result['correct'] / result['total'] if result['total'] else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare extraction accuracy across prompt modes.')
+    parser.add_argument('cases', help='Directory of cases')
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'compact'],
+                        choices=prompt_builder.PROMPT_MODES)
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='Allowed accuracy drop against the first mode')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    cases = list(load_cases(args.cases))
+    if not cases:
+        parser.error('no cases found')
+    client = llm_client.get_client(pipeline.url, pipeline.headers)
+
+    results = [run_mode(mode, cases, client) for mode in args.modes]
+
+    print(f"{'mode':<9}{'version':<22}{'accuracy':>9}{'errors':>8}{'prompt tok':>12}"
+          f"{'doc tok':>9}{'req KB':>8}{'seconds':>9}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['version']:<22}{r['accuracy']:>9.3f}{r['errors']:>8}"
+              f"{r['prompt_tokens']:>12}{r['document_tokens']:>9}{r['request_bytes'] / 1024:>8.1f}"
+              f"{r['seconds']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline = results[0]['accuracy']
+    regressions = [r['mode'] for r in results[1:] if r['accuracy'] < baseline - args.tolerance]
+    if regressions:
+        print(f"Accuracy dropped below {results[0]['mode']} for: {', '.join(regressions)}",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
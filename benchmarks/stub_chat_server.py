@@ -0,0 +1,186 @@
+"""Local stand-in for the chat endpoint's ``/chats/`` API.
+
+Answers every POST with the same response shape as the real service,
+``{"messages": [{"answer": "<json string>"}]}``, so the app, the batch CLI
+and the benchmarks can run end to end without network access::
+
+    python -m benchmarks.stub_chat_server --port 8765 --latency 0.8
+    CHAT_API_URL=http://127.0.0.1:8765/chats/ streamlit run app.py
+
+Each answer waits ``--latency`` seconds plus a random ``--jitter``.
+Failures can be scripted with ``--fail-first N --fail-status 503``, or
+spread at random with ``--error-rate``, to exercise client retries. Requests that accept ``text/event-stream`` get the
+answer streamed as server-sent events, ``--chunk-chars`` at a time with
+``--chunk-delay`` seconds between them; ``--no-stream`` answers them with
+plain JSON instead, like an endpoint without streaming support.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANSWER = {
+    "passenger_names": ["SMITH JOHN"],
+    "flights": [
+        {
+            "passenger_names": ["SMITH JOHN"],
+            "flight_origin": "LHR",
+            "flight_destination": "CDG",
+            "travel_number": "ABC123",
+            "date_of_travel": "14 NOV 2024 10:15 - 14 NOV 2024 13:30",
+            "flight_name": "British Airways BA 123",
+            "notes": ""
+        }
+    ]
+}
+
+
+class StubState:
+    """Behaviour knobs and request counters shared by all handler threads."""
+
+    def __init__(self, answer=None, latency=0.0, fail_first=0, fail_status=503, stream=True,
+                 chunk_chars=24, chunk_delay=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.answer = CANNED_ANSWER if answer is None else answer
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.stream = stream
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_received = 0
+        self.failures = 0
+
+    def next_request(self, size):
+        """Register a request; returns ``(seconds to wait, fail?)`` for it."""
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += size
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = (self.requests <= self.fail_first or
+                    (self.error_rate and self.rng.random() < self.error_rate))
+            if fail:
+                self.failures += 1
+            return delay, fail
+
+
+def make_handler(state):
+    class StubChatHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            delay, fail = state.next_request(len(body))
+
+            if delay:
+                time.sleep(delay)
+
+            if fail:
+                self._send(state.fail_status, {"detail": "stub failure"})
+                return
+
+            try:
+                json.loads(body)
+            except json.JSONDecodeError:
+                self._send(400, {"detail": "invalid JSON body"})
+                return
+
+            answer = json.dumps(state.answer, indent=2)
+            if state.stream and 'text/event-stream' in self.headers.get('Accept', ''):
+                self._send_stream(answer)
+            else:
+                self._send(201, {"messages": [{"answer": answer}]})
+
+        def _send_stream(self, answer):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(answer), state.chunk_chars):
+                if start and state.chunk_delay:
+                    time.sleep(state.chunk_delay)
+                event = {"answer": answer[start:start + state.chunk_chars]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text):
+            data = text.encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubChatHandler
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """Start the stub on a background thread; returns ``(server, url, state)``.
+
+    ``port=0`` picks a free port. Call ``server.shutdown()`` when done.
+    """
+    state = StubState(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='stub-chat', daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/chats/"
+    return server, url, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stub of the chat endpoint.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many extra seconds, at random, per answer')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with --fail-status, at random')
+    parser.add_argument('--seed', type=int, help='Seed for jitter and random failures')
+    parser.add_argument('--fail-first', type=int, default=0, help='Fail this many requests first')
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--answer', help='JSON file with the answer to return')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='Answer streaming requests with plain JSON')
+    parser.add_argument('--chunk-chars', type=int, default=24,
+                        help='Characters of the answer per streamed event')
+    parser.add_argument('--chunk-delay', type=float, default=0.0,
+                        help='Seconds between streamed events')
+    args = parser.parse_args()
+
+    answer = None
+    if args.answer:
+        with open(args.answer) as f:
+            answer = json.load(f)
+
+    state = StubState(answer=answer, latency=args.latency, fail_first=args.fail_first,
+                      fail_status=args.fail_status, stream=not args.no_stream,
+                      chunk_chars=args.chunk_chars, chunk_delay=args.chunk_delay,
+                      jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Stub chat endpoint listening on http://{args.host}:{args.port}/chats/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Keeps only the parts of a long document that matter for flight extraction.
+
+Multi-page bundles carry terms and conditions, baggage policy, fare rules and
+advertising around the itinerary. After cleaning, the text is scanned for
+anchors (booking-reference labels, flight numbers, IATA codes, times, dates
+and passenger blocks). A window of text is kept around each anchor. Windows
+that overlap are merged, and if the result is still over the token budget,
+the windows with the strongest anchors are kept.
+"""
+import os
+import re
+
+from prompt_builder import estimate_tokens
+
+ENABLED = os.environ.get('CONTEXT_WINDOW', '1') == '1'
+
+# Documents shorter than this go to the LLM untouched
+MIN_CHARS = int(os.environ.get('CONTEXT_WINDOW_MIN_CHARS', '4000'))
+
+# Characters kept on each side of an anchor
+WINDOW_BEFORE = int(os.environ.get('CONTEXT_WINDOW_BEFORE', '250'))
+WINDOW_AFTER = int(os.environ.get('CONTEXT_WINDOW_AFTER', '350'))
+
+# Windows closer than this are merged into one span
+MERGE_GAP = 80
+
+# Upper bound on the estimated tokens of document text sent to the LLM
+TOKEN_BUDGET = int(os.environ.get('CONTEXT_WINDOW_TOKEN_BUDGET', '3000'))
+
+SEPARATOR = ' ... '
+
+MONTHS = r'(?:JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)[A-Z]*'
+
+# (name, pattern, weight): weight ranks windows when the budget forces a choice
+ANCHORS = [
+    ('reference_label', re.compile(
+        r'\b(?:Airline PNR|GDS PNR|PNR|Confirmation(?: Number| No| #)?|Reservation Code|'
+        r'Check-in Ref(?:erence)?|Booking Ref(?:erence)?)\b', re.IGNORECASE), 5),
+    ('flight_number', re.compile(r'\b[A-Z][A-Z0-9] \d{1,4}[A-Z]?\b'), 3),
+    ('iata_code', re.compile(r'\([A-Z]{3}\)'), 3),
+    ('time', re.compile(r'\b\d{2}:\d{2}\b'), 2),
+    ('date', re.compile(r'\b\d{1,2} ' + MONTHS + r' \d{2,4}\b|\b\d{1,2} \d{1,2} \d{2,4}\b',
+                        re.IGNORECASE), 2),
+    ('passenger', re.compile(
+        r'\b(?:Passengers?|Travell?ers?|Guest|Name of Passenger|Passenger Name)\b|'
+        r'\b(?:MR|MRS|MS|MSTR|MISS)\b', re.IGNORECASE), 3),
+]
+
+# Bump when the anchors or window settings change, since they shape the LLM input
+CONFIG_VERSION = f"ctx1-{int(ENABLED)}-{MIN_CHARS}-{WINDOW_BEFORE}-{WINDOW_AFTER}-{TOKEN_BUDGET}"
+
+
+def find_anchors(text):
+    """List ``(start, end, weight)`` for every anchor match, in text order."""
+    anchors = []
+    for _, pattern, weight in ANCHORS:
+        for match in pattern.finditer(text):
+            anchors.append((match.start(), match.end(), weight))
+    anchors.sort()
+    return anchors
+
+
+def _snap(text, position, forward):
+    """Move a window edge to the nearest space so words aren't cut in half."""
+    if forward:
+        space = text.find(' ', position)
+        return len(text) if space == -1 else space
+    space = text.rfind(' ', 0, position)
+    return 0 if space == -1 else space + 1
+
+
+def build_windows(text, anchors, before=WINDOW_BEFORE, after=WINDOW_AFTER, merge_gap=MERGE_GAP):
+    """Merge the windows around each anchor into ``[start, end, score]`` spans."""
+    windows = []
+    for start, end, weight in anchors:
+        window_start = _snap(text, max(0, start - before), forward=False)
+        window_end = _snap(text, min(len(text), end + after), forward=True)
+        if windows and window_start <= windows[-1][1] + merge_gap:
+            windows[-1][1] = max(windows[-1][1], window_end)
+            windows[-1][2] += weight
+        else:
+            windows.append([window_start, window_end, weight])
+    return windows
+
+
+def apply_budget(text, windows, token_budget=TOKEN_BUDGET):
+    """Keep the densest windows that fit the budget, in document order.
+
+    A window that doesn't fit in what is left of the budget is trimmed to fit
+    rather than dropped, so one long itinerary block can't crowd out everything.
+    """
+    ranked = sorted(windows, key=lambda w: w[2] / max(1, w[1] - w[0]), reverse=True)
+    kept = []
+    remaining = token_budget
+    for start, end, score in ranked:
+        if remaining <= 0:
+            break
+        tokens = estimate_tokens(text[start:end])
+        if tokens > remaining:
+            end = _snap(text, start + (end - start) * remaining // tokens, forward=False)
+            if end <= start:
+                continue
+            tokens = estimate_tokens(text[start:end])
+        kept.append([start, end, score])
+        remaining -= tokens
+    return sorted(kept)
+
+
+def select_context(text, min_chars=MIN_CHARS, token_budget=TOKEN_BUDGET):
+    """Return ``(text_for_llm, stats)`` with only the anchored spans of a long document."""
+    stats = {
+        'original_chars': len(text),
+        'kept_chars': len(text),
+        'dropped_chars': 0,
+        'windows': 0,
+        'anchors': 0,
+        'windowed': False,
+    }
+    if not ENABLED or len(text) < min_chars:
+        return text, stats
+
+    anchors = find_anchors(text)
+    stats['anchors'] = len(anchors)
+    if not anchors:
+        # Nothing recognisable; better to send everything than nothing
+        return text, stats
+
+    windows = apply_budget(text, build_windows(text, anchors), token_budget)
+    if not windows:
+        return text, stats
+
+    selected = SEPARATOR.join(text[start:end].strip() for start, end, _ in windows)
+    stats.update(
+        kept_chars=len(selected),
+        dropped_chars=max(0, len(text) - len(selected)),
+        windows=len(windows),
+        windowed=True,
+    )
+    return selected, stats
@@ -0,0 +1,462 @@
+"""Local background job queue: a worker pool with progress, cancellation and backpressure.
+
+Jobs are plain functions run by a fixed pool of worker threads or, with
+``mode='process'``, by worker processes (the function and its arguments must
+then be picklable, i.e. defined in an importable module). Code running inside
+a job reports progress with ``report_progress()``, publishes whatever part
+of its result is already known with ``report_partial()`` and stops early at
+``check_cancelled()``; all three do nothing outside a job, so the pipeline
+needs no job plumbing of its own. ``submit`` refuses new jobs once
+``max_pending`` are waiting, which is the cue to tell the user the server is
+busy.
+
+With a ``db_path`` (JOB_DB_PATH), job state and results are also kept in
+SQLite, so a finished job can still be looked up after a restart. Jobs that
+were queued or running when the process went away are marked as failed.
+"""
+import collections
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '8'))
+JOB_MODE = os.environ.get('JOB_MODE', 'thread')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', '')
+# Finished jobs kept in memory for status lookups
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', '200'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+JOBS = metrics.registry.counter('flightdoc_jobs_total', 'Jobs by final state.')
+JOBS_REJECTED = metrics.registry.counter('flightdoc_jobs_rejected_total',
+                                         'Jobs refused because the queue was full.')
+JOB_QUEUE_DEPTH = metrics.registry.gauge('flightdoc_job_queue_depth', 'Jobs waiting for a worker.')
+JOB_WAIT_SECONDS = metrics.registry.histogram('flightdoc_job_wait_seconds',
+                                              'Time jobs spent queued before a worker took them.')
+
+
+class QueueFull(Exception):
+    """Raised by ``submit`` when ``max_pending`` jobs are already waiting."""
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job by ``check_cancelled`` once its cancellation was requested.
+
+    A BaseException, like asyncio.CancelledError, so the pipeline's
+    ``except Exception`` handlers let it through.
+    """
+
+
+class Job:
+    """One submitted call and everything known about it so far."""
+
+    def __init__(self, job_id, name, func, args, kwargs):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.state = QUEUED
+        self.progress = {'stage': None, 'done': 0, 'total': None}
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        # Set in process mode: the same flag, shared with the worker process
+        self.remote_cancel = None
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'state': self.state,
+            'progress': dict(self.progress),
+            'partial': self.partial,
+            'result': self.result,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class _LocalHandle:
+    """What the report and cancel functions talk to for a job run in this process."""
+
+    def __init__(self, job, lock):
+        self.job = job
+        self.lock = lock
+
+    def report(self, fields):
+        with self.lock:
+            self.job.progress.update(fields)
+
+    def publish(self, partial):
+        with self.lock:
+            self.job.partial = partial
+
+    def cancelled(self):
+        return self.job.cancel_requested.is_set()
+
+
+class _RemoteHandle:
+    """The same, for a job run in a worker process: progress goes back over a queue."""
+
+    def __init__(self, job_id, progress_queue, cancel_event):
+        self.job_id = job_id
+        self.progress_queue = progress_queue
+        self.cancel_event = cancel_event
+
+    def report(self, fields):
+        self.progress_queue.put((self.job_id, 'progress', fields))
+
+    def publish(self, partial):
+        self.progress_queue.put((self.job_id, 'partial', partial))
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+_current_job = contextvars.ContextVar('flightdoc_job', default=None)
+
+
+def report_progress(stage=None, done=None, total=None):
+    """Update the running job's progress, e.g. ``report_progress('ocr', 3, 12)``."""
+    handle = _current_job.get()
+    if handle is None:
+        return
+    fields = {'done': done, 'total': total}
+    if stage is not None:
+        fields['stage'] = stage
+    handle.report(fields)
+
+
+def report_partial(partial):
+    """Publish the running job's result so far, for the UI to show before the job ends."""
+    handle = _current_job.get()
+    if handle is not None:
+        handle.publish(partial)
+
+
+def check_cancelled():
+    """Raise JobCancelled if the running job has been cancelled."""
+    handle = _current_job.get()
+    if handle is not None and handle.cancelled():
+        raise JobCancelled()
+
+
+def _run_with_handle(handle, func, args, kwargs):
+    token = _current_job.set(handle)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _current_job.reset(token)
+
+
+def _run_remote(job_id, func, args, kwargs, progress_queue, cancel_event):
+    """Entry point in a worker process."""
+    return _run_with_handle(_RemoteHandle(job_id, progress_queue, cancel_event),
+                            func, args, kwargs)
+
+
+class JobQueue:
+    """A bounded queue of jobs served by ``workers`` workers."""
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, mode=JOB_MODE,
+                 db_path=JOB_DB_PATH, history=JOB_HISTORY):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown job queue mode: {mode}")
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.mode = mode
+        self.history = history
+        self._jobs = collections.OrderedDict()
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            DONE: 0,
+            FAILED: 0,
+            CANCELLED: 0,
+            'wait_seconds_total': 0.0,
+            'run_seconds_total': 0.0,
+        }
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db(db_path)
+
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        if mode == 'process':
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            self._manager = context.Manager()
+            self._progress_queue = self._manager.Queue()
+            threading.Thread(target=self._drain_progress, name='job-progress',
+                             daemon=True).start()
+
+        self._threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _open_db(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                state TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                submitted REAL NOT NULL,
+                started REAL,
+                finished REAL
+            )''')
+        # Nothing is left to run the jobs an earlier process didn't finish
+        self._db.execute("UPDATE jobs SET state = ?, error = 'interrupted', finished = ? "
+                         "WHERE state IN (?, ?)", (FAILED, time.time(), QUEUED, RUNNING))
+
+    def _persist(self, job):
+        if self._db is None:
+            return
+        with self._cond:
+            row = job.snapshot()
+        try:
+            result = json.dumps(row['result'])
+        except (TypeError, ValueError):
+            result = None
+        with self._db_lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO jobs (id, name, state, progress, result, error, '
+                'submitted, started, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (row['id'], row['name'], row['state'], json.dumps(row['progress']), result,
+                 row['error'], row['submitted'], row['started'], row['finished']))
+
+    def _load(self, job_id):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT id, name, state, progress, result, error, submitted, started, finished '
+                'FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'name', 'state', 'progress', 'result', 'error', 'submitted', 'started',
+                'finished')
+        job = dict(zip(keys, row))
+        job['progress'] = json.loads(job['progress']) if job['progress'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def submit(self, func, args=(), kwargs=None, name=None, block=False, timeout=None):
+        """Queue ``func(*args, **kwargs)`` and return the job id.
+
+        Raises QueueFull if ``max_pending`` jobs are already waiting; with
+        ``block=True`` it first waits up to ``timeout`` seconds for room.
+        """
+        job = Job(uuid.uuid4().hex, name or getattr(func, '__name__', 'job'), func, tuple(args),
+                  dict(kwargs or {}))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    self.stats['rejected'] += 1
+                    JOBS_REJECTED.inc()
+                    raise QueueFull(f"{len(self._pending)} jobs are already waiting")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise RuntimeError("Job queue is shut down")
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self.stats['submitted'] += 1
+            JOB_QUEUE_DEPTH.set(len(self._pending))
+            self._cond.notify_all()
+        self._persist(job)
+        return job.id
+
+    def get(self, job_id):
+        """Snapshot of a job (state, progress, result, error), or None if it's unknown."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.snapshot()
+        return self._load(job_id)
+
+    def position(self, job_id):
+        """1-based place of a queued job in line, or None once it has started."""
+        with self._cond:
+            for index, job in enumerate(self._pending):
+                if job.id == job_id:
+                    return index + 1
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once, or ask a running one to stop; False if it's finished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            job.cancel_requested.set()
+            if job.remote_cancel is not None:
+                job.remote_cancel.set()
+            if job.state != QUEUED:
+                return True
+            self._pending.remove(job)
+            JOB_QUEUE_DEPTH.set(len(self._pending))
+            self._cond.notify_all()
+        self._finish(job, CANCELLED)
+        return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+                job.state = RUNNING
+                job.started = time.time()
+                JOB_QUEUE_DEPTH.set(len(self._pending))
+                # Room for a submitter blocked on a full queue
+                self._cond.notify_all()
+            JOB_WAIT_SECONDS.observe(job.started - job.submitted)
+            self._persist(job)
+
+            try:
+                result = self._run(job)
+            except JobCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job.id, job.name)
+                self._finish(job, FAILED, error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job, DONE, result=result)
+
+    def _run(self, job):
+        if self.mode == 'thread':
+            return _run_with_handle(_LocalHandle(job, self._cond), job.func, job.args, job.kwargs)
+
+        remote_cancel = self._manager.Event()
+        with self._cond:
+            job.remote_cancel = remote_cancel
+            if job.cancel_requested.is_set():
+                remote_cancel.set()
+        future = self._executor.submit(_run_remote, job.id, job.func, job.args, job.kwargs,
+                                       self._progress_queue, remote_cancel)
+        return future.result()
+
+    def _drain_progress(self):
+        while True:
+            try:
+                item = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, kind, payload = item
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None or job.state != RUNNING:
+                    continue
+                if kind == 'partial':
+                    job.partial = payload
+                else:
+                    job.progress.update(payload)
+
+    def _finish(self, job, state, result=None, error=None):
+        with self._cond:
+            job.state = state
+            job.result = result
+            job.partial = None
+            job.error = error
+            job.finished = time.time()
+            # The call and its arguments (e.g. the PDF bytes) aren't needed any more
+            job.func = job.args = job.kwargs = None
+            job.remote_cancel = None
+            self.stats[state] += 1
+            if job.started is not None:
+                self.stats['wait_seconds_total'] += job.started - job.submitted
+                self.stats['run_seconds_total'] += job.finished - job.started
+            self._trim_history()
+        JOBS.inc(state=state)
+        self._persist(job)
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def snapshot(self):
+        """Counters plus the current number of queued and running jobs."""
+        with self._cond:
+            stats = dict(self.stats)
+            stats['queued'] = len(self._pending)
+            stats['running'] = sum(1 for job in self._jobs.values() if job.state == RUNNING)
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        stats['mode'] = self.mode
+        return stats
+
+    def shutdown(self, cancel_pending=True, wait=True):
+        """Stop taking jobs; queued jobs are cancelled (or left to finish) and workers exit."""
+        with self._cond:
+            self._closed = True
+            pending = list(self._pending) if cancel_pending else []
+            for job in pending:
+                self._pending.remove(job)
+            self._cond.notify_all()
+        for job in pending:
+            self._finish(job, CANCELLED)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._progress_queue.put(None)
+            self._manager.shutdown()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Process-wide job queue, kept here so it outlives Streamlit reruns of app.py."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,124 @@
+"""Incremental JSON parsing for answers that arrive in pieces.
+
+``IncrementalJSONParser`` is fed text chunks as they stream in and hands back
+every value at a watched path as soon as that value closes, e.g. the
+``passenger_names`` array or each finished object in ``flights``, long before
+the whole document has arrived. It only tracks structure (brackets, strings,
+keys), scanning each character once, and decodes just the finished values
+with ``json.loads``. Anything before the first ``{`` or ``[`` (such as a
+markdown fence) is skipped.
+"""
+import json
+
+# Matches any key or index at its position in a watched path
+ANY = '*'
+
+
+class _Frame:
+    """An open object or array: where it started, its path and its current key/index."""
+
+    def __init__(self, is_object, path, start):
+        self.is_object = is_object
+        self.path = path
+        self.start = start
+        self.key = None if is_object else 0
+        self.expecting_key = is_object
+
+
+class IncrementalJSONParser:
+    """Emit ``(path, value)`` for values at watched paths as soon as they are complete.
+
+    Paths are tuples of object keys and array indexes; ``ANY`` matches either,
+    so ``[('passenger_names',), ('flights', ANY)]`` watches the passenger list
+    and each flight.
+    """
+
+    def __init__(self, paths):
+        self.paths = [tuple(path) for path in paths]
+        self.text = ''
+        self.done = False
+        self._pos = 0
+        self._root_start = None
+        self._root_end = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+
+    def _watched(self, path):
+        return any(len(pattern) == len(path) and
+                   all(part == ANY or part == step for part, step in zip(pattern, path))
+                   for pattern in self.paths)
+
+    def _value_path(self):
+        frame = self._stack[-1]
+        return frame.path + (frame.key,)
+
+    def _decode(self, start, end, emitted):
+        path = self._value_path() if self._stack else ()
+        if self._watched(path):
+            try:
+                emitted.append((path, json.loads(self.text[start:end])))
+            except ValueError:
+                # Malformed piece: leave it to whoever parses the complete answer
+                pass
+
+    def feed(self, chunk):
+        """Add the next piece of text; returns the ``(path, value)`` pairs it completed."""
+        emitted = []
+        if self.done:
+            return emitted
+        self.text += chunk
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._root_start is None:
+                if c in '{[':
+                    self._root_start = i
+                    self._stack.append(_Frame(c == '{', (), i))
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame.is_object and frame.expecting_key:
+                        frame.key = json.loads(text[self._string_start:i + 1])
+                    else:
+                        self._decode(self._string_start, i + 1, emitted)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                self._stack.append(_Frame(c == '{', self._value_path(), i))
+            elif c in '}]':
+                frame = self._stack.pop()
+                if not self._stack:
+                    self._root_end = i + 1
+                    self.done = True
+                    break
+                self._decode(frame.start, i + 1, emitted)
+            elif c == ':':
+                self._stack[-1].expecting_key = False
+            elif c == ',':
+                frame = self._stack[-1]
+                if frame.is_object:
+                    frame.expecting_key = True
+                else:
+                    frame.key += 1
+
+        self._pos = len(text) if not self.done else self._root_end
+        return emitted
+
+    def result(self):
+        """The whole document once it has closed, else None."""
+        if not self.done:
+            return None
+        return json.loads(self.text[self._root_start:self._root_end])
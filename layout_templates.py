@@ -0,0 +1,732 @@
+"""Extraction rules learned per document layout, so repeat itineraries skip the LLM.
+
+Most documents come from a few dozen airline and agency layouts that repeat
+exactly. A document's layout is read from its text layer with pdfplumber, as
+lines of words with their vertical position. After the LLM has answered for a
+document, every string in the answer is located among those words.
+
+Documents are samples of the same layout when two things hold:
+- their lines align (same count and positions on the pages holding the values);
+- they share most of their words.
+Once ``LAYOUT_TEMPLATE_SAMPLES`` samples are collected, a template is learned
+from them. It keeps:
+- the label words common to every sample on each line. These split the line
+  into segments.
+- for each answer field, the segment its words sit in and how they are cut
+  from it: the whole segment, a fixed number of words at one end, or the
+  segment minus fixed words at either end.
+The template is kept only if it reproduces every sample's answer.
+
+A document matches an active template only if its lines align and every label
+is found, and the answer is then read off in milliseconds. ``LAYOUT_TEMPLATES``
+picks the mode:
+- ``off`` (the default): no templates at all.
+- ``shadow``: templates are learned, and their answers are compared with
+  every LLM answer, but the LLM's answer is always the one shown. The
+  counters give the hit rate and agreement before anything is served.
+- ``on``: matching documents are answered from the template.
+  ``LAYOUT_TEMPLATE_AUDIT_RATE`` of them still go to the LLM for comparison,
+  and a disagreement sends the template back to learning.
+Reading the layout runs pdfplumber over the first MAX_PAGES pages of every
+uncached document, before extraction. In ``shadow`` that cost is paid
+without saving a single LLM call, so use it to measure, then switch.
+"""
+import atexit
+import io
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+import pdfplumber
+
+import metrics
+
+MODE = os.environ.get('LAYOUT_TEMPLATES', 'off')
+TEMPLATES_PATH = os.environ.get('LAYOUT_TEMPLATES_PATH',
+                                os.path.join('.cache', 'layout_templates.json'))
+MIN_SAMPLES = int(os.environ.get('LAYOUT_TEMPLATE_SAMPLES', '3'))
+AUDIT_RATE = float(os.environ.get('LAYOUT_TEMPLATE_AUDIT_RATE', '0.05'))
+MAX_TEMPLATES = int(os.environ.get('LAYOUT_TEMPLATE_MAX', '500'))
+
+# Itineraries put their details up front; later pages (fare rules...) are not read
+MAX_PAGES = 4
+# Words this close vertically (fraction of the page height) are on one line
+LINE_TOLERANCE = 0.004
+# Share of words two documents must have in common, line by line, to be samples of one layout
+SAMPLE_SIMILARITY = 0.5
+# Most combinations of cuts tried for one field before giving up on it
+MAX_CUT_COMBINATIONS = 256
+# Seconds changes are gathered for before the templates file is rewritten
+SAVE_DELAY = 2.0
+
+EDGE_PUNCTUATION = ',;:.()[]{}"\''
+
+TEMPLATE_LOOKUPS = metrics.registry.counter(
+    'flightdoc_template_lookups_total',
+    'Layout template lookups, by result: hit, miss or no_layout (no text layer).')
+TEMPLATE_CHECKS = metrics.registry.counter(
+    'flightdoc_template_checks_total',
+    'Template answers compared with the LLM answer for the same document, by result.')
+TEMPLATE_LEARNING = metrics.registry.counter(
+    'flightdoc_template_learning_total',
+    'LLM answers learned from, by result: new, sample, activated, refined, rejected or unlearnable.')
+
+
+class _Mismatch(Exception):
+    """A template or field rule doesn't fit a document."""
+
+
+def _norm(token):
+    return token.strip(EDGE_PUNCTUATION).casefold()
+
+
+def _is_joiner(token):
+    return not any(c.isalnum() for c in token)
+
+
+def _split(text):
+    # SURNAME/GIVEN is how airlines print names; the LLM answers "SURNAME GIVEN"
+    return [token for token in re.split(r'[\s/]+', text) if token]
+
+
+def _normalized_text(text):
+    return ' '.join(_norm(token) for token in _split(text))
+
+
+def same_answer(a, b):
+    """Whether two answers agree, ignoring case, spacing and edge punctuation."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_answer(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_answer(x, y) for x, y in zip(a, b))
+    if isinstance(a, str) and isinstance(b, str):
+        return _normalized_text(a) == _normalized_text(b)
+    return a == b
+
+
+def read_layout(pdf_content, max_pages=MAX_PAGES):
+    """The text layer as ``{'lines': [{'page', 'top', 'tokens'}]}``, or None without one."""
+    lines = []
+    try:
+        with io.BytesIO(pdf_content) as pdf_file:
+            with pdfplumber.open(pdf_file) as pdf:
+                for page_num, page in enumerate(pdf.pages[:max_pages]):
+                    current = None
+                    for word in sorted(page.extract_words(), key=lambda w: (w['top'], w['x0'])):
+                        top = word['top'] / page.height
+                        if current is None or top - current['top'] > LINE_TOLERANCE:
+                            current = {'page': page_num, 'top': round(top, 4), 'words': []}
+                            lines.append(current)
+                        current['words'].append((word['x0'], word['text']))
+    except Exception:
+        return None
+    for line in lines:
+        line['tokens'] = [token for _, text in sorted(line.pop('words')) for token in _split(text)]
+    if not any(line['tokens'] for line in lines):
+        return None
+    return _prepared({'lines': lines})
+
+
+def _prepared(layout):
+    """Adds the normalized tokens every lookup compares against."""
+    if 'norms' not in layout:
+        layout['norms'] = [[_norm(token) for token in line['tokens']] for line in layout['lines']]
+    return layout
+
+
+def _leaves(value, path=()):
+    """``(path, text)`` for every string in an answer that has something to locate."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _leaves(item, path + (key,))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _leaves(item, path + (index,))
+    elif isinstance(value, str) and not _is_joiner(value):
+        yield path, value
+
+
+def locate(layout, text):
+    """Where ``text``'s words are: a list of ``[line, start, end]`` runs and literal joiners.
+
+    Each run is the longest stretch of consecutive words on one line matching
+    the next words of ``text`` (first in reading order on ties). Tokens like
+    ``-`` that the LLM put between pieces stay literal. None if a word isn't found.
+    """
+    tokens = _split(text)
+    parts = []
+    i = 0
+    while i < len(tokens):
+        if _is_joiner(tokens[i]):
+            parts.append(tokens[i])
+            i += 1
+            continue
+        wanted = [_norm(token) for token in tokens[i:]]
+        best = None
+        for line_index, norms in enumerate(layout['norms']):
+            for start, token in enumerate(norms):
+                if token != wanted[0]:
+                    continue
+                length = 1
+                while (length < len(wanted) and start + length < len(norms) and
+                       norms[start + length] == wanted[length]):
+                    length += 1
+                if best is None or length > best[2]:
+                    best = (line_index, start, length)
+        if best is None:
+            return None
+        line_index, start, length = best
+        parts.append([line_index, start, start + length])
+        i += length
+    return parts
+
+
+def _page_lines(layout, pages):
+    return [i for i, line in enumerate(layout['lines']) if line['page'] in pages]
+
+
+def align(reference, layout, pages):
+    """Indexes of ``layout``'s lines matching ``reference``'s on ``pages`` one to one, or None."""
+    expected = _page_lines(reference, pages)
+    found = _page_lines(layout, pages)
+    if len(expected) != len(found):
+        return None
+    for i, j in zip(expected, found):
+        a, b = reference['lines'][i], layout['lines'][j]
+        if a['page'] != b['page'] or abs(a['top'] - b['top']) > LINE_TOLERANCE:
+            return None
+    return found
+
+
+def _lcs(a, b):
+    """Longest common subsequence of two token lists."""
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            lengths[i + 1][j + 1] = lengths[i][j] + 1 if x == y else max(lengths[i][j + 1],
+                                                                         lengths[i + 1][j])
+    common = []
+    i, j = len(a), len(b)
+    while i and j:
+        if a[i - 1] == b[j - 1]:
+            common.append(a[i - 1])
+            i, j = i - 1, j - 1
+        elif lengths[i - 1][j] >= lengths[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    return common[::-1]
+
+
+def similarity(reference, layout, pages):
+    """Share of words ``layout`` has in common with ``reference``, line by line on ``pages``."""
+    found = align(reference, layout, pages)
+    if found is None:
+        return 0.0
+    common = total = 0
+    for i, j in zip(_page_lines(reference, pages), found):
+        common += len(_lcs(reference['norms'][i], layout['norms'][j]))
+        total += max(len(reference['norms'][i]), len(layout['norms'][j]))
+    return common / total if total else 0.0
+
+
+def label_share(template, layout):
+    """Share of ``template``'s labels ``layout`` has, line by line on its pages."""
+    lines = align(template, layout, set(template['pages']))
+    if lines is None:
+        return 0.0
+    found = total = 0
+    for template_line, line in zip(template['lines'], lines):
+        found += len(_lcs(template_line['labels'], layout['norms'][line]))
+        total += len(template_line['labels'])
+    return found / total if total else 0.0
+
+
+def _find_labels(labels, norms):
+    """Positions of ``labels``, in order, among a line's words; None if one is missing."""
+    positions = []
+    start = 0
+    for label in labels:
+        try:
+            index = norms.index(label, start)
+        except ValueError:
+            return None
+        positions.append(index)
+        start = index + 1
+    return positions
+
+
+def _segment(positions, length, index):
+    """Word range of the ``index``-th segment of a line split at its label ``positions``."""
+    start = positions[index - 1] + 1 if index else 0
+    end = positions[index] if index < len(positions) else length
+    return start, end
+
+
+def _segment_length(positions, length, index):
+    start, end = _segment(positions, length, index)
+    return end - start
+
+
+def _cut(part, start, end):
+    cut = part['cut']
+    if cut == 'all':
+        return start, end
+    if cut == 'start':
+        return start + part['skip'], start + part['skip'] + part['count']
+    if cut == 'end':
+        return end - part['skip'] - part['count'], end - part['skip']
+    return start + part['skip'], end - part['trim']
+
+
+def _cuts(start, end, a, b):
+    """Ways to cut words ``a:b`` out of segment ``start:end``, most general first."""
+    cuts = []
+    if (a, b) == (start, end):
+        cuts.append({'cut': 'all'})
+    # A field touching a label keeps its distance to it; its length may vary or not
+    if b == end:
+        cuts.append({'cut': 'end', 'skip': 0, 'count': b - a})
+    if a == start:
+        cuts.append({'cut': 'start', 'skip': 0, 'count': b - a})
+    cuts.append({'cut': 'trim', 'skip': a - start, 'trim': end - b})
+    if b != end:
+        cuts.append({'cut': 'end', 'skip': end - b, 'count': b - a})
+    if a != start:
+        cuts.append({'cut': 'start', 'skip': a - start, 'count': b - a})
+    return cuts
+
+
+def _read_field(parts, layout, lines, positions):
+    """A field's text from its parts; raises _Mismatch if a cut falls outside its segment."""
+    words = []
+    for part in parts:
+        if isinstance(part, str):
+            words.append(part)
+            continue
+        tokens = layout['lines'][lines[part['line']]]['tokens']
+        start, end = _segment(positions[part['line']], len(tokens), part['segment'])
+        if 'lengths' in part and end - start not in part['lengths']:
+            # Only whole segments stretch; other cuts are trusted on segment shapes seen in samples
+            raise _Mismatch()
+        a, b = _cut(part, start, end)
+        if not start <= a < b <= end:
+            raise _Mismatch()
+        words.extend(token.strip(EDGE_PUNCTUATION) or token for token in tokens[a:b])
+    return ' '.join(words)
+
+
+def _apply(rule, layout, lines, positions):
+    if 'dict' in rule:
+        return {key: _apply(item, layout, lines, positions) for key, item in rule['dict'].items()}
+    if 'list' in rule:
+        return [_apply(item, layout, lines, positions) for item in rule['list']]
+    if 'parts' in rule:
+        return _read_field(rule['parts'], layout, lines, positions)
+    return rule['constant']
+
+
+def _label_positions(template_lines, layout, lines):
+    positions = []
+    for template_line, line in zip(template_lines, lines):
+        found = _find_labels(template_line['labels'], layout['norms'][line])
+        if found is None:
+            raise _Mismatch()
+        positions.append(found)
+    return positions
+
+
+def extract(template, layout):
+    """The answer ``template`` reads from ``layout``, or None if the layout doesn't match."""
+    lines = align(template, layout, set(template['pages']))
+    if lines is None:
+        return None
+    try:
+        return _apply(template['rules'], layout, lines,
+                      _label_positions(template['lines'], layout, lines))
+    except _Mismatch:
+        return None
+
+
+def learn(samples):
+    """A template that reads every sample's answer from its layout, or None.
+
+    ``samples`` are ``{'lines', 'norms', 'data'}``: a layout and its validated answer.
+    """
+    located = []
+    for sample in samples:
+        parts = {}
+        for path, text in _leaves(sample['data']):
+            found = locate(sample, text)
+            if found is None:
+                return None
+            parts[path] = found
+        located.append(parts)
+    if any(parts.keys() != located[0].keys() for parts in located):
+        return None
+
+    first = samples[0]
+    pages = sorted({first['lines'][part[0]]['page'] for field in located[0].values()
+                    for part in field if not isinstance(part, str)})
+    if not pages:
+        return None
+    sample_lines = [align(first, sample, set(pages)) for sample in samples]
+    if any(lines is None for lines in sample_lines):
+        return None
+
+    # Labels: the words every sample has on a line, other than the answer's own words
+    template_lines = []
+    for i, first_line in enumerate(sample_lines[0]):
+        labels = None
+        for sample, lines, parts in zip(samples, sample_lines, located):
+            line = lines[i]
+            used = {k for field in parts.values() for part in field
+                    if not isinstance(part, str) and part[0] == line
+                    for k in range(part[1], part[2])}
+            words = [token for k, token in enumerate(sample['norms'][line]) if k not in used]
+            labels = words if labels is None else _lcs(labels, words)
+        template_lines.append({'page': first['lines'][first_line]['page'],
+                               'top': first['lines'][first_line]['top'], 'labels': labels})
+
+    try:
+        positions = [_label_positions(template_lines, sample, lines)
+                     for sample, lines in zip(samples, sample_lines)]
+    except _Mismatch:
+        return None
+    line_index = {line: i for i, line in enumerate(sample_lines[0])}
+
+    def field_rule(path):
+        options = []
+        for part in located[0][path]:
+            if isinstance(part, str):
+                options.append([part])
+                continue
+            line, a, b = part
+            index = line_index[line]
+            segment = sum(1 for position in positions[0][index] if position < a)
+            start, end = _segment(positions[0][index], len(first['norms'][line]), segment)
+            if b > end:
+                raise _Mismatch()
+            lengths = sorted({_segment_length(sample_positions[index],
+                                              len(sample['norms'][lines[index]]), segment)
+                              for sample, lines, sample_positions in zip(samples, sample_lines,
+                                                                         positions)})
+            options.append([dict(cut, line=index, segment=segment,
+                                 **({} if cut['cut'] == 'all' else {'lengths': lengths}))
+                            for cut in _cuts(start, end, a, b)])
+        # The first combination of cuts that reads this field right in every sample
+        for parts in itertools.islice(itertools.product(*options), MAX_CUT_COMBINATIONS):
+            try:
+                if all(same_answer(_read_field(parts, sample, lines, sample_positions),
+                                   _value_at(sample['data'], path))
+                       for sample, lines, sample_positions in zip(samples, sample_lines,
+                                                                  positions)):
+                    return {'parts': list(parts)}
+            except _Mismatch:
+                continue
+        raise _Mismatch()
+
+    try:
+        rules = _rules(first['data'], (), field_rule)
+    except _Mismatch:
+        return None
+    template = {'pages': pages, 'lines': template_lines, 'rules': rules}
+    if not all(same_answer(extract(template, sample), sample['data']) for sample in samples):
+        return None
+    return template
+
+
+def _value_at(data, path):
+    for step in path:
+        data = data[step]
+    return data
+
+
+def _rules(value, path, field_rule):
+    if isinstance(value, dict):
+        return {'dict': {key: _rules(item, path + (key,), field_rule)
+                         for key, item in value.items()}}
+    if isinstance(value, list):
+        return {'list': [_rules(item, path + (index,), field_rule)
+                         for index, item in enumerate(value)]}
+    if isinstance(value, str) and not _is_joiner(value):
+        return field_rule(path)
+    return {'constant': value}
+
+
+def should_serve():
+    """Whether a template hit is answered from the template, or (shadow, audit) by the LLM."""
+    return MODE == 'on' and random.random() >= AUDIT_RATE
+
+
+class TemplateStore:
+    """Active templates and layouts still being learned.
+
+    Entries are dicts. ``status`` is ``learning`` while samples are being
+    collected and ``active`` once a template has been learned from them.
+    Active templates keep their newest samples, and relearn from them plus
+    a document they missed that still has most of their labels: a value all
+    of the first samples happened to share (a title, a city) no longer
+    counts as a label once a sample without it comes along. An
+    entry other threads can see is replaced, never changed, apart from its
+    counters. Learning runs outside the store's lock, so lookups never wait
+    for it.
+
+    Only active templates are written to ``path``, as JSON, from a
+    background thread SAVE_DELAY seconds after a change. Samples hold the
+    LLM's answers, passenger names included, so they stay in memory, and
+    layouts being learned start over after a restart. A template's labels
+    are the words all of its samples shared, normally field captions.
+    Setting the path to an empty string keeps everything in memory.
+    """
+
+    def __init__(self, path=TEMPLATES_PATH, min_samples=MIN_SAMPLES, max_templates=MAX_TEMPLATES):
+        self.path = path
+        # One sample can't tell labels from values that happen to be unused
+        self.min_samples = max(2, min_samples)
+        # Samples an active template keeps to relearn from
+        self.kept_samples = 2 * self.min_samples
+        self.max_templates = max_templates
+        self.version = None
+        self._templates = []
+        self._lock = threading.Lock()
+        # Pending save, and writes of the file one at a time
+        self._save_timer = None
+        self._save_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            self.version = stored.get('version')
+            # Files written before samples were kept out of them may still hold some
+            self._templates = [{key: value for key, value in entry.items() if key != 'samples'}
+                               for entry in stored.get('templates', [])
+                               if entry['status'] == 'active']
+
+    def ensure_version(self, version):
+        """Forget everything learned from answers of another prompt version."""
+        with self._lock:
+            if self.version == version:
+                return
+            self.version = version
+            self._templates = []
+        self._save_soon()
+
+    def match(self, layout):
+        """``(template_id, answer)`` from the active template matching ``layout``, or None."""
+        if layout is None:
+            TEMPLATE_LOOKUPS.inc(result='no_layout')
+            return None
+        # Copies taken under the lock: observe() may send an entry back to learning meanwhile
+        with self._lock:
+            active = [{key: entry[key] for key in ('id', 'pages', 'lines', 'rules')}
+                      for entry in self._templates if entry['status'] == 'active']
+        for template in active:
+            data = extract(template, layout)
+            if data is not None:
+                with self._lock:
+                    entry = self._find(template['id'])
+                    if entry is not None:
+                        entry['hits'] += 1
+                        entry['last_used'] = time.time()
+                TEMPLATE_LOOKUPS.inc(result='hit')
+                return template['id'], data
+        TEMPLATE_LOOKUPS.inc(result='miss')
+        return None
+
+    def observe(self, layout, data, matched=None):
+        """Learn from a validated LLM answer for ``layout``.
+
+        ``matched`` is what ``match`` returned for the same document; its
+        answer is checked against the LLM's first.
+        """
+        sample = dict(layout, data=data)
+        if matched is not None:
+            self._check(matched, sample)
+            return
+
+        with self._lock:
+            active = [{key: entry[key] for key in ('id', 'pages', 'lines')}
+                      for entry in self._templates if entry['status'] == 'active']
+            learning = [(entry['id'], entry['samples'][0], set(entry['pages']))
+                        for entry in self._templates if entry['status'] == 'learning']
+        for template in active:
+            if (label_share(template, sample) >= SAMPLE_SIMILARITY and
+                    self._refine(template['id'], sample)):
+                return
+        for entry_id, reference, pages in learning:
+            if similarity(reference, sample, pages) < SAMPLE_SIMILARITY:
+                continue
+            with self._lock:
+                entry = self._find(entry_id)
+                if entry is None or entry['status'] != 'learning':
+                    continue
+                entry = self._replace(entry, samples=entry['samples'] + [sample],
+                                      last_used=time.time())
+                samples = entry['samples']
+            if len(samples) < self.min_samples:
+                TEMPLATE_LEARNING.inc(result='sample')
+            else:
+                self._learn(entry_id, samples)
+            return
+        self._start(sample)
+
+    def _find(self, entry_id):
+        return next((entry for entry in self._templates if entry['id'] == entry_id), None)
+
+    def _replace(self, entry, **changes):
+        """Swap ``entry`` for a copy with ``changes``; call with the lock held."""
+        new = {key: value for key, value in entry.items() if key not in changes}
+        new.update({key: value for key, value in changes.items() if value is not None})
+        self._templates[self._templates.index(entry)] = new
+        return new
+
+    def _start(self, sample):
+        """A new learning entry with ``sample`` as its first sample."""
+        template = learn([sample])
+        if template is None:
+            TEMPLATE_LEARNING.inc(result='unlearnable')
+            return
+        with self._lock:
+            self._templates.append({
+                'id': uuid.uuid4().hex[:12], 'status': 'learning', 'pages': template['pages'],
+                'samples': [sample], 'hits': 0, 'checks': 0, 'disagreements': 0,
+                'created': time.time(), 'last_used': time.time(),
+            })
+            evicted = None
+            if len(self._templates) > self.max_templates:
+                evicted = min(self._templates, key=lambda e: e['last_used'])
+                self._templates.remove(evicted)
+        TEMPLATE_LEARNING.inc(result='new')
+        if evicted is not None and evicted['status'] == 'active':
+            self._save_soon()
+
+    def _learn(self, entry_id, samples):
+        """Learn a learning entry's template from ``samples`` and activate it if it holds."""
+        template = learn(samples)
+        with self._lock:
+            entry = self._find(entry_id)
+            if entry is None or entry['status'] != 'learning':
+                return
+            if template is None:
+                # Keep the newest samples; an odd one out ages away
+                self._replace(entry, samples=entry['samples'][-(self.min_samples - 1):])
+            else:
+                self._replace(entry, status='active', activated=time.time(),
+                              samples=entry['samples'][-self.kept_samples:], **template)
+        TEMPLATE_LEARNING.inc(result='rejected' if template is None else 'activated')
+        if template is not None:
+            self._save_soon()
+
+    def _refine(self, entry_id, sample):
+        """Relearn an active template with a sample it missed; False if the two don't fit."""
+        with self._lock:
+            entry = self._find(entry_id)
+            if entry is None or entry['status'] != 'active':
+                return False
+            # Loaded templates collect samples from agreeing checks first
+            samples = entry.get('samples', [])
+            if len(samples) < self.min_samples - 1:
+                return False
+        template = learn(samples + [sample])
+        if template is None:
+            return False
+        with self._lock:
+            entry = self._find(entry_id)
+            if entry is None or entry['status'] != 'active':
+                return False
+            self._replace(entry, samples=(entry['samples'] + [sample])[-self.kept_samples:],
+                          last_used=time.time(), **template)
+        TEMPLATE_LEARNING.inc(result='refined')
+        self._save_soon()
+        return True
+
+    def _check(self, matched, sample):
+        """Compare a template's answer with the LLM's; a disagreement sends it back to learning."""
+        agree = same_answer(matched[1], sample['data'])
+        TEMPLATE_CHECKS.inc(result='agree' if agree else 'disagree')
+        with self._lock:
+            entry = self._find(matched[0])
+            if entry is None:
+                return
+            entry['checks'] += 1
+            if agree:
+                if entry['status'] == 'active':
+                    self._replace(entry, samples=(entry.get('samples', []) +
+                                                  [sample])[-self.kept_samples:])
+                return
+            entry['disagreements'] += 1
+        template = learn([sample])
+        with self._lock:
+            entry = self._find(matched[0])
+            if entry is None:
+                return
+            if template is None:
+                self._templates.remove(entry)
+            else:
+                # A new dict rather than changing this one, which a lookup may still be reading
+                learning = {key: value for key, value in entry.items()
+                            if key not in ('lines', 'rules', 'activated')}
+                learning.update(status='learning', pages=template['pages'], samples=[sample])
+                self._templates[self._templates.index(entry)] = learning
+        self._save_soon()
+
+    def _save_soon(self):
+        """Save SAVE_DELAY seconds from now, once for all the changes made until then."""
+        if not self.path:
+            return
+        with self._save_lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write the active templates to ``path`` now."""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        if not self.path:
+            return
+        with self._write_lock:
+            with self._lock:
+                version = self.version
+                stored = [{key: value for key, value in entry.items() if key != 'samples'}
+                          for entry in self._templates if entry['status'] == 'active']
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': version, 'templates': stored}, f)
+            os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        with self._lock:
+            entries = list(self._templates)
+        return {
+            'active': sum(1 for e in entries if e['status'] == 'active'),
+            'learning': sum(1 for e in entries if e['status'] == 'learning'),
+            'hits': sum(e['hits'] for e in entries),
+            'checks': sum(e['checks'] for e in entries),
+            'disagreements': sum(e['disagreements'] for e in entries),
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide template store (survives Streamlit reruns, like ``result_cache.get_cache``)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TemplateStore()
+            # A save still pending when the process exits
+            atexit.register(_store.flush)
+        return _store
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds for one attempt
+DEFAULT_TIMEOUT = (
+    float(os.environ.get('LLM_CONNECT_TIMEOUT', '5')),
+    float(os.environ.get('LLM_READ_TIMEOUT', '120')),
+)
+DEFAULT_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', '8'))
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 8.0
+
+# Statuses worth retrying: rate limiting and transient server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# How many recent calls the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+# Streamed answers arrive as server-sent events: ``data: {"answer": "<next piece>"}``
+# lines, ended by ``data: [DONE]``
+STREAM_CONTENT_TYPE = 'text/event-stream'
+STREAM_DONE = '[DONE]'
+
+
+class ChatClient:
+    """Client for the chat endpoint with keep-alive connections and bounded retries.
+
+    All calls share one ``requests.Session`` so documents reuse pooled TCP/TLS
+    connections. A semaphore caps the number of requests in flight, every
+    attempt has a timeout, and 429/5xx responses or connection failures are
+    retried with exponential backoff and jitter (honouring ``Retry-After``).
+    """
+
+    def __init__(self, url, headers, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        self.url = url
+        self.headers = dict(headers)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_in_flight = max(1, max_in_flight)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(self.headers)
+
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'in_flight': 0,
+        }
+
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt."""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    def post(self, data, stream=False):
+        """POST a JSON body, retrying transient failures; returns the final response.
+
+        Raises the last ``requests`` exception if every attempt failed without
+        getting a response at all. With ``stream=True`` an event stream is
+        asked for and a successful response's body is left unread: read it
+        with :meth:`iter_answer`, and the latency recorded is the time to
+        the response headers. The request keeps its in-flight slot until the
+        response is closed, which ``iter_answer`` does when it finishes.
+        """
+        body = json.dumps(data).encode('utf-8')
+        extra_headers = {'Accept': f'{STREAM_CONTENT_TYPE}, application/json'} if stream else None
+        start = time.perf_counter()
+        response = None
+
+        self._slots.acquire()
+        held = True
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['in_flight'] += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                with self._lock:
+                    self.stats['attempts'] += 1
+                    self.stats['bytes_sent'] += len(body)
+                try:
+                    response = self.session.post(self.url, data=body, timeout=self.timeout,
+                                                 headers=extra_headers, stream=stream)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    with self._lock:
+                        if isinstance(e, requests.Timeout):
+                            self.stats['timeouts'] += 1
+                    if attempt == self.max_retries:
+                        with self._lock:
+                            self.stats['failures'] += 1
+                        raise
+                    response = None
+                else:
+                    if not stream or response.status_code not in [200, 201]:
+                        with self._lock:
+                            self.stats['bytes_received'] += len(response.content)
+                    if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                        break
+
+                with self._lock:
+                    self.stats['retries'] += 1
+                time.sleep(self._retry_delay(attempt, response))
+            if stream and response.status_code in [200, 201]:
+                # The body is still to be read, so the slot is held until the response closes
+                self._hold_until_closed(response)
+                held = False
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._latencies.append(elapsed)
+            if held:
+                self._release()
+
+        if response.status_code not in [200, 201]:
+            with self._lock:
+                self.stats['failures'] += 1
+        return response
+
+    def _release(self):
+        with self._lock:
+            self.stats['in_flight'] -= 1
+        self._slots.release()
+
+    def _hold_until_closed(self, response):
+        """Release the in-flight slot when ``response`` is closed (once, however often it is)."""
+        close = response.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release()
+
+        response.close = close_and_release
+
+    def iter_answer(self, response):
+        """Yield the answer text of a ``post(..., stream=True)`` response as it arrives.
+
+        Endpoints that ignore the request for a stream answer with the usual
+        JSON body; its whole answer is then yielded at once.
+        """
+        try:
+            if not response.headers.get('Content-Type', '').startswith(STREAM_CONTENT_TYPE):
+                with self._lock:
+                    self.stats['bytes_received'] += len(response.content)
+                yield json.loads(response.text)["messages"][0]["answer"]
+                return
+
+            for line in response.iter_lines():
+                with self._lock:
+                    self.stats['bytes_received'] += len(line) + 1
+                line = line.decode('utf-8')
+                if not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == STREAM_DONE:
+                    return
+                piece = json.loads(payload).get('answer')
+                if piece:
+                    yield piece
+        finally:
+            response.close()
+
+    def ask(self, question):
+        """Send a question to the chat endpoint."""
+        return self.post({"question": question})
+
+    def snapshot(self):
+        """Counters plus latency percentiles over the recent calls."""
+        with self._lock:
+            stats = dict(self.stats)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats['latency_p50'] = latencies[int(0.50 * (len(latencies) - 1))]
+            stats['latency_p95'] = latencies[int(0.95 * (len(latencies) - 1))]
+            stats['latency_max'] = latencies[-1]
+        if stats['attempts']:
+            stats['avg_request_bytes'] = stats['bytes_sent'] / stats['attempts']
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncChatClient:
+    """asyncio front for a ``ChatClient``, for callers that run an event loop.
+
+    Requests go through the wrapped client, so they share its pooled session,
+    retries, in-flight cap and stats. Each blocking call runs on a thread
+    pool sized to that cap, and a stream is read one piece at a time there,
+    so the event loop never waits on the network.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=client.max_in_flight,
+                                            thread_name_prefix='llm-async')
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def post(self, data, stream=False):
+        """``ChatClient.post``, awaited."""
+        return await self._call(lambda: self.client.post(data, stream=stream))
+
+    async def iter_answer(self, response):
+        """``ChatClient.iter_answer``, as an async iterator."""
+        pieces = self.client.iter_answer(response)
+        done = object()
+        try:
+            while True:
+                piece = await self._call(next, pieces, done)
+                if piece is done:
+                    return
+                yield piece
+        finally:
+            # Closes the response (and frees its slot) if the caller stopped early
+            await self._call(pieces.close)
+
+    async def ask(self, question):
+        return await self.post({"question": question})
+
+    def snapshot(self):
+        return self.client.snapshot()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url, headers, **kwargs):
+    """Process-wide client per endpoint, so connections survive Streamlit reruns."""
+    key = (url, tuple(sorted(headers.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = ChatClient(url, headers, **kwargs)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(url, headers, **kwargs):
+    """Process-wide ``AsyncChatClient`` over ``get_client(url, headers, **kwargs)``."""
+    client = get_client(url, headers, **kwargs)
+    key = (url, tuple(sorted(headers.items())))
+    with _clients_lock:
+        async_client = _async_clients.get(key)
+        if async_client is None:
+            async_client = AsyncChatClient(client)
+            _async_clients[key] = async_client
+        return async_client
@@ -0,0 +1,395 @@
+"""Lightweight stage tracing and process-wide metrics.
+
+``span(stage)`` times one pipeline stage. Every finished span is added to the
+``flightdoc_stage_seconds`` histogram and, when a document ``trace`` is
+active, to that document's per-stage totals (which the app shows in its
+sidebar). Everything recorded here can be rendered in the Prometheus text
+format, served over HTTP when ``METRICS_PORT`` is set, or written to
+``METRICS_FILE`` after each document.
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_FILE = os.environ.get('METRICS_FILE', '')
+
+# Seconds; spans range from sub-millisecond text extraction to long LLM calls
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    pairs = []
+    for name, value in key:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, per label set."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count, per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        self.observe_many([value], **labels)
+
+    def observe_many(self, values, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets),
+                                              'sum': 0.0, 'count': 0}
+            for value in values:
+                for i, bound in enumerate(self.buckets):
+                    if value <= bound:
+                        series['buckets'][i] += 1
+                        break
+                series['sum'] += value
+                series['count'] += 1
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    rows.append((self.name + '_bucket', key + (('le', _format_value(bound)),),
+                                 cumulative))
+                rows.append((self.name + '_bucket', key + (('le', '+Inf'),), series['count']))
+                rows.append((self.name + '_sum', key, series['sum']))
+                rows.append((self.name + '_count', key, series['count']))
+        return rows
+
+
+class MetricsRegistry:
+    """Named metrics for the whole process, rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        update_process_gauges()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram('flightdoc_stage_seconds', 'Time spent per pipeline stage.')
+STAGE_ERRORS = registry.counter('flightdoc_stage_errors_total', 'Stages that raised, per stage.')
+DOCUMENTS = registry.counter('flightdoc_documents_total', 'Documents processed, per outcome.')
+DOCUMENT_SECONDS = registry.histogram('flightdoc_document_seconds', 'End-to-end time per document.')
+DOCUMENT_BYTES = registry.counter('flightdoc_document_bytes_total', 'Bytes of PDF processed.')
+PAGES = registry.counter('flightdoc_pages_total', 'Pages extracted, per extractor.')
+OCR_CONFIDENCE = registry.histogram('flightdoc_ocr_confidence',
+                                    'Recognition confidence of OCR lines.', CONFIDENCE_BUCKETS)
+OCR_LINES = registry.counter('flightdoc_ocr_lines_total',
+                             'OCR lines, by whether they passed the confidence filter.')
+PEAK_RSS = registry.gauge('process_peak_rss_bytes', 'Peak resident set size of this process.')
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def update_process_gauges():
+    peak = peak_rss_bytes()
+    if peak is not None:
+        PEAK_RSS.set(peak)
+
+
+class Trace:
+    """Per-document timings: total seconds and calls for each stage, plus attributes."""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, seconds, failed=False):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'errors': 0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['errors'] += int(failed)
+
+    def annotate(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def total_seconds(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def rows(self):
+        """Stages in the order they first ran, as dicts."""
+        with self._lock:
+            return [dict(stage=stage, **entry) for stage, entry in self.stages.items()]
+
+    def summary(self):
+        """Plain-dict copy of the trace, e.g. to hand back as part of a job result."""
+        with self._lock:
+            attributes = dict(self.attributes)
+        return {'name': self.name, 'attributes': attributes, 'rows': self.rows(),
+                'total_seconds': self.total_seconds()}
+
+
+_current_trace = contextvars.ContextVar('flightdoc_trace', default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace(name, **attributes):
+    """Collect the spans of one document; the trace is also returned as the context value."""
+    doc_trace = Trace(name, **attributes)
+    token = _current_trace.set(doc_trace)
+    # An outcome annotated before an exception (e.g. 'cancelled') is kept
+    outcome = None
+    try:
+        yield doc_trace
+        outcome = doc_trace.attributes.get('outcome', 'ok')
+    finally:
+        if outcome is None:
+            outcome = doc_trace.attributes.get('outcome', 'error')
+        _current_trace.reset(token)
+        doc_trace.finished = time.perf_counter()
+        update_process_gauges()
+        doc_trace.annotate(peak_rss_bytes=peak_rss_bytes())
+        DOCUMENTS.inc(outcome=outcome)
+        DOCUMENT_SECONDS.observe(doc_trace.total_seconds())
+        if 'bytes' in doc_trace.attributes:
+            DOCUMENT_BYTES.inc(doc_trace.attributes['bytes'])
+        # Raising here would replace the document's own result or error
+        try:
+            write_metrics_file()
+        except OSError:
+            logger.exception("Error writing the metrics file")
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Time a stage; failures are counted and re-raised."""
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if failed:
+            STAGE_ERRORS.inc(stage=stage)
+        doc_trace = _current_trace.get()
+        if doc_trace is not None:
+            doc_trace.add_span(stage, seconds, failed)
+
+
+def annotate(**attributes):
+    """Attach attributes to the current document trace, if there is one."""
+    doc_trace = _current_trace.get()
+    if doc_trace is not None:
+        doc_trace.annotate(**attributes)
+
+
+def accumulate(attribute, **amounts):
+    """Add ``amounts`` into a dict attribute of the current document trace, if there is one."""
+    doc_trace = _current_trace.get()
+    if doc_trace is not None:
+        with doc_trace._lock:
+            totals = doc_trace.attributes.setdefault(attribute, {})
+            for key, amount in amounts.items():
+                totals[key] = totals.get(key, 0) + amount
+
+
+def record_pages(pages):
+    """Count extracted pages by the extractor that produced them."""
+    for page in pages:
+        PAGES.inc(extractor=page['extractor'] or 'none')
+
+
+def record_ocr_confidences(confidences, min_confidence):
+    """Feed one page's OCR line confidences into the histogram and the current trace."""
+    if not confidences:
+        return
+    kept = sum(1 for confidence in confidences if confidence > min_confidence)
+    OCR_CONFIDENCE.observe_many(confidences)
+    OCR_LINES.inc(kept, kept='yes')
+    OCR_LINES.inc(len(confidences) - kept, kept='no')
+
+    doc_trace = _current_trace.get()
+    if doc_trace is not None:
+        with doc_trace._lock:
+            summary = doc_trace.attributes.setdefault(
+                'ocr_confidence', {'lines': 0, 'dropped': 0, 'sum': 0.0, 'min': 1.0})
+            summary['lines'] += len(confidences)
+            summary['dropped'] += len(confidences) - kept
+            summary['sum'] += sum(confidences)
+            summary['min'] = min(summary['min'], min(confidences))
+
+
+def render_prometheus():
+    return registry.render()
+
+
+def write_metrics_file(path=None):
+    """Write the metrics to ``path`` (default METRICS_FILE), replacing it atomically.
+
+    Each write goes through its own temporary file, since documents finish
+    concurrently in job threads and worker processes.
+    """
+    path = path or METRICS_FILE
+    if not path:
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(render_prometheus())
+        # mkstemp creates it owner-only; scrapers often run as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port=None, host=None):
+    """Serve ``/metrics`` from a daemon thread; only the first call starts a server."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    host = host or METRICS_HOST
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='metrics-http',
+                             daemon=True).start()
+        return _server
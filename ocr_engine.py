@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+# Settings the app has always built PaddleOCR with
+DEFAULT_OCR_CONFIG = {
+    'use_angle_cls': True,
+    'lang': 'en',
+    'use_gpu': False,
+    'show_log': False,
+}
+
+# Number of engine instances lent out per configuration
+DEFAULT_POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE', '1'))
+
+
+_paddle_lock = threading.Lock()
+_paddle_class = None
+
+# Seconds the first `import paddleocr` took in this process (None until then)
+import_seconds = None
+
+
+def load_paddleocr():
+    """Import the Paddle stack on first use and return the PaddleOCR class.
+
+    paddleocr pulls in paddlepaddle, OpenCV and friends: seconds of import
+    time and hundreds of MB of memory that text-layer documents never need,
+    so nothing imports it until an engine is actually built (or preload() runs).
+    """
+    global _paddle_class, import_seconds
+    with _paddle_lock:
+        if _paddle_class is None:
+            start = time.perf_counter()
+            from paddleocr import PaddleOCR
+            import_seconds = time.perf_counter() - start
+            _paddle_class = PaddleOCR
+        return _paddle_class
+
+
+def paddle_loaded():
+    return _paddle_class is not None
+
+
+def _config_key(config):
+    """Hashable key for an OCR configuration dict."""
+    return tuple(sorted(config.items()))
+
+
+class OCREnginePool:
+    """A bounded pool of initialized PaddleOCR instances sharing one configuration.
+
+    Engines are created lazily up to ``size`` and then handed out to callers one
+    at a time, so concurrent sessions never run the same instance at once.
+    Callers wait on a condition for an engine to come back or for a slot to
+    free up, which happens when another caller fails to load its engine.
+    """
+
+    def __init__(self, config, size=DEFAULT_POOL_SIZE):
+        self.config = dict(config)
+        self.size = max(1, int(size))
+        # Most recently returned last, so the warmest engine is reused first
+        self._idle = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        self._warmed = False
+        self._warmup_error = None
+        self.stats = {
+            'engines_loaded': 0,
+            'load_seconds_total': 0.0,
+            'load_seconds_last': 0.0,
+            'acquisitions': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'warmup_seconds': 0.0,
+        }
+
+    def _load_engine(self):
+        """Build one PaddleOCR instance and record how long the model load took."""
+        PaddleOCR = load_paddleocr()
+        start = time.perf_counter()
+        engine = PaddleOCR(**self.config)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.stats['engines_loaded'] += 1
+            self.stats['load_seconds_total'] += elapsed
+            self.stats['load_seconds_last'] = elapsed
+        return engine
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow an engine for the duration of the ``with`` block."""
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + timeout
+        engine = None
+        with self._available:
+            while True:
+                if self._idle:
+                    engine = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    # Slot reserved; the engine is built outside the lock
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No OCR engine became available within {timeout}s")
+                self._available.wait(remaining)
+        if engine is None:
+            try:
+                engine = self._load_engine()
+            except Exception:
+                with self._available:
+                    self._created -= 1
+                    # A waiter can take the freed slot and try for itself
+                    self._available.notify()
+                raise
+        waited = time.perf_counter() - start
+
+        with self._lock:
+            self.stats['acquisitions'] += 1
+            self.stats['wait_seconds_total'] += waited
+            self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], waited)
+
+        try:
+            yield engine
+        finally:
+            with self._available:
+                self._idle.append(engine)
+                self._available.notify()
+
+    def warm_up(self, instances=None):
+        """Load up to ``instances`` engines and run each once on a blank image."""
+        instances = self.size if instances is None else min(int(instances), self.size)
+        start = time.perf_counter()
+        dummy = np.full((64, 256, 3), 255, dtype=np.uint8)
+
+        # Hold every engine at once so each instance gets exercised, not the same one N times
+        try:
+            with ExitStack() as stack:
+                for _ in range(instances):
+                    engine = stack.enter_context(self.acquire())
+                    engine.ocr(dummy)
+        except Exception as e:
+            # Kept so warm_up() doesn't retry on every rerun; documents still load their own
+            with self._lock:
+                self._warmup_error = f"{type(e).__name__}: {e}"
+            raise
+
+        with self._lock:
+            self.stats['warmup_seconds'] += time.perf_counter() - start
+            self._warmed = True
+
+    @property
+    def warmed(self):
+        return self._warmed
+
+    @property
+    def warmup_error(self):
+        return self._warmup_error
+
+    def snapshot(self):
+        """Copy of the pool statistics, including current occupancy."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = self.size
+            stats['created'] = self._created
+            stats['idle'] = len(self._idle)
+            stats['warmup_error'] = self._warmup_error
+        stats['in_use'] = stats['created'] - stats['idle']
+        if stats['acquisitions']:
+            stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['acquisitions']
+        else:
+            stats['wait_seconds_avg'] = 0.0
+        return stats
+
+
+class OCREngineRegistry:
+    """Process-wide registry holding one engine pool per OCR configuration."""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, config=None, size=None):
+        config = DEFAULT_OCR_CONFIG if config is None else config
+        key = _config_key(config)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = OCREnginePool(config, DEFAULT_POOL_SIZE if size is None else size)
+                self._pools[key] = pool
+            return pool
+
+    def stats(self):
+        """Statistics for every configuration loaded so far."""
+        with self._lock:
+            pools = list(self._pools.values())
+        return [dict(config=pool.config, import_seconds=import_seconds, **pool.snapshot())
+                for pool in pools]
+
+
+registry = OCREngineRegistry()
+
+
+def ocr_engine(config=None, timeout=None):
+    """Borrow a PaddleOCR instance from the shared registry.
+
+    Usage::
+
+        with ocr_engine() as ocr:
+            result = ocr.ocr(img_array)
+    """
+    return registry.get_pool(config).acquire(timeout=timeout)
+
+
+_warmup_threads = {}
+_warmup_lock = threading.Lock()
+
+
+def warm_up(config=None, instances=None, background=False):
+    """Preload and exercise OCR engines so the first document doesn't pay for it.
+
+    Safe to call on every Streamlit rerun: a pool that is already warm, is
+    warming in the background, or failed to warm up is left alone.
+    """
+    pool = registry.get_pool(config)
+    if pool.warmed or pool.warmup_error is not None:
+        return None
+
+    if not background:
+        pool.warm_up(instances)
+        return None
+
+    key = _config_key(pool.config)
+    with _warmup_lock:
+        thread = _warmup_threads.get(key)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=pool.warm_up, args=(instances,),
+                                      name='ocr-warmup', daemon=True)
+            _warmup_threads[key] = thread
+            thread.start()
+    return thread
+
+
+_preload_thread = None
+
+
+def preload():
+    """Import the Paddle stack on a background thread, without building an engine.
+
+    Tried once per process; a failed import is left to the first OCR call.
+    """
+    global _preload_thread
+    with _warmup_lock:
+        if _paddle_class is None and _preload_thread is None:
+            _preload_thread = threading.Thread(target=load_paddleocr, name='ocr-preload',
+                                               daemon=True)
+            _preload_thread.start()
+        return _preload_thread
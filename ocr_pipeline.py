@@ -0,0 +1,728 @@
+import atexit
+import contextvars
+import ctypes
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+import metrics
+import ocr_worker
+import page_dedup
+from ocr_engine import DEFAULT_OCR_CONFIG, ocr_engine
+
+# Render scale used for OCR input (scale=2 gives better quality, similar to dpi=200)
+DEFAULT_RENDER_SCALE = 2.0
+
+# Confidence below which recognized text is dropped
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+# Pages rendered ahead of the one currently being OCR'd
+DEFAULT_PREFETCH = 1
+
+# PDFium is not thread-safe, so every call into it is serialized on this lock
+PDFIUM_LOCK = threading.RLock()
+
+# How pages are rasterized for OCR. 'fixed' is the original full-colour render
+# at the caller's scale. The adaptive profiles measure each page on a cheap
+# preview first: the scale is chosen so a text line comes out about
+# ``target_line_px`` pixels tall, blank margins are cropped off and the page
+# is capped at ``max_pixels``. See benchmarks/bench_render.py for how they
+# trade OCR time against accuracy.
+RENDER_PROFILES = {
+    'fixed': {'adaptive': False, 'grayscale': False, 'trim_margins': False, 'max_pixels': None},
+    'fast': {'adaptive': True, 'target_line_px': 12, 'min_scale': 0.75, 'max_scale': 2.0,
+             'grayscale': True, 'trim_margins': True, 'max_pixels': 2_000_000},
+    'balanced': {'adaptive': True, 'target_line_px': 16, 'min_scale': 1.0, 'max_scale': 3.0,
+                 'grayscale': True, 'trim_margins': True, 'max_pixels': 4_000_000},
+    'accurate': {'adaptive': True, 'target_line_px': 24, 'min_scale': 1.5, 'max_scale': 4.0,
+                 'grayscale': False, 'trim_margins': True, 'max_pixels': 9_000_000},
+}
+RENDER_PROFILE = os.environ.get('OCR_RENDER_PROFILE', 'fixed')
+
+# Page measurement: preview scale, gray level below which a pixel counts as
+# ink, and the padding (in points) left around the inked area when trimming
+PREVIEW_SCALE = 1.0
+INK_THRESHOLD = 200
+MARGIN_PADDING = 12
+
+# Gaps between inked columns narrower than this (preview pixels) are bridged
+COLUMN_GAP = 4
+
+RENDER_SCALE = metrics.registry.histogram(
+    'flightdoc_render_scale', 'Render scale chosen per page.',
+    (0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0))
+RENDER_PIXELS = metrics.registry.counter(
+    'flightdoc_render_pixels_total', 'Pixels rasterized for OCR.')
+RENDER_BYTES_ALLOCATED = metrics.registry.counter(
+    'flightdoc_render_bytes_allocated_total', 'Bytes of new page buffers allocated for rendering.')
+RENDER_BYTES_SAVED = metrics.registry.counter(
+    'flightdoc_render_bytes_saved_total',
+    'Bytes not allocated compared with rendering through PIL and np.array.')
+
+# How PaddleOCR is run on a rendered page. 'accurate' is the original single
+# call, which runs the angle classifier on every text box. The other profiles
+# run detection alone, drop boxes too small to be text (relative to the
+# page's median box height) and, in 'fast', large squat boxes that are
+# almost always logos. They then check the page's orientation once on a few
+# of the largest boxes (per page, or only on the first page for
+# ``orientation: 'document'``). An upright page has all its boxes recognized
+# in batches without the classifier; any other page falls back to the full call.
+OCR_PROFILES = {
+    'accurate': {'orientation': 'box', 'min_box_height_ratio': 0.0, 'drop_logos': False},
+    'balanced': {'orientation': 'page', 'min_box_height_ratio': 0.35, 'drop_logos': False},
+    'fast': {'orientation': 'document', 'min_box_height_ratio': 0.5, 'drop_logos': True},
+}
+OCR_PROFILE = os.environ.get('OCR_PROFILE', 'accurate')
+
+# Boxes sampled by the orientation check, and the classifier score a box
+# needs to count as upside down
+ORIENTATION_SAMPLE_BOXES = 5
+ORIENTATION_MIN_SCORE = 0.9
+
+# A box at least this many median box heights tall and narrower than
+# LOGO_MAX_ASPECT times its height is treated as a logo
+LOGO_HEIGHT_RATIO = 2.5
+LOGO_MAX_ASPECT = 1.5
+
+OCR_BOXES = metrics.registry.counter(
+    'flightdoc_ocr_boxes_total', 'Detected text boxes, by whether they were recognized.')
+OCR_PAGE_PATHS = metrics.registry.counter(
+    'flightdoc_ocr_page_paths_total',
+    'OCR\'d pages by profile and path (batched without the classifier, or the full call).')
+
+# Idle render buffers kept for reuse, across all page sizes
+DEFAULT_IDLE_BUFFER_BYTES = 256 * 2 ** 20
+
+# Documents with at least this many pages render into memory-mapped temporary
+# files under OCR_SPILL_DIR (default: the system temp dir); 0 turns it off
+SPILL_PAGES = int(os.environ.get('OCR_SPILL_PAGES', '0'))
+SPILL_DIR = os.environ.get('OCR_SPILL_DIR') or None
+
+_DONE = object()
+
+
+class _RenderFailure:
+    """Carries an exception from the render thread over to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _runs(mask):
+    """``(starts, ends)`` of the runs of True in a 1-D boolean array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges[::2], edges[1::2]
+
+
+def _inked_span(counts, min_count, min_run):
+    """First and last index of runs of at least ``min_run`` entries with ``min_count`` ink.
+
+    Text lines and columns are several pixels thick while specks of scanner
+    dust are isolated, so short runs are ignored.
+    """
+    starts, ends = _runs(counts >= min_count)
+    keep = (ends - starts) >= min_run
+    if not keep.any():
+        return None
+    return starts[keep][0], ends[keep][-1]
+
+
+def measure_page(page):
+    """Inked area and typical text-line height of a page, in points, from a low-res preview.
+
+    Returns None for a blank page. The line height is the median height of
+    runs of inked rows, taken in four vertical bands so slightly skewed scans
+    don't smear neighbouring lines together.
+    """
+    preview = page.render(scale=PREVIEW_SCALE, grayscale=True,
+                          force_bitmap_format=pdfium_c.FPDFBitmap_Gray).to_numpy()
+    ink = preview.reshape(preview.shape[0], preview.shape[1]) < INK_THRESHOLD
+    rows = _inked_span(ink.sum(axis=1), 3, 3)
+    if rows is None:
+        return None
+    top, bottom = rows
+    # Columns are sparse where a line of small type ends, so bridge the gaps
+    # between letters (dilating by a few points) before looking for runs
+    column_ink = ink[top:bottom].sum(axis=0) >= 2
+    dilated = np.convolve(column_ink, np.ones(2 * COLUMN_GAP + 1), mode='same')
+    cols = _inked_span(dilated, 1, 2 * COLUMN_GAP + 3)
+    if cols is None:
+        return None
+    left, right = cols[0] + COLUMN_GAP, cols[1] - COLUMN_GAP
+
+    runs = []
+    bands = np.linspace(left, right, 5).astype(int)
+    for band_left, band_right in zip(bands[:-1], bands[1:]):
+        starts, ends = _runs(ink[top:bottom, band_left:band_right].sum(axis=1) >= 2)
+        runs.extend(run for run in ends - starts if run >= 2)
+
+    return {
+        'bbox': tuple(float(v) / PREVIEW_SCALE for v in (left, top, right, bottom)),
+        'line_height': float(np.median(runs)) / PREVIEW_SCALE if runs else None,
+    }
+
+
+def plan_render(page, profile, scale=DEFAULT_RENDER_SCALE):
+    """Pick ``(scale, crop)`` for one page under a render profile.
+
+    ``crop`` is the (left, bottom, right, top) margin in points to cut off,
+    as ``PdfPage.render`` takes it.
+    """
+    crop = (0, 0, 0, 0)
+    if not profile['adaptive'] and not profile['trim_margins']:
+        return scale, crop
+
+    width, height = page.get_size()
+    measured = measure_page(page)
+    if measured is None:
+        # Blank page: nothing to read, so spend as few pixels as possible on it
+        scale = profile.get('min_scale', scale)
+    else:
+        if profile['adaptive'] and measured['line_height']:
+            scale = profile['target_line_px'] / measured['line_height']
+            scale = min(max(scale, profile['min_scale']), profile['max_scale'])
+        if profile['trim_margins']:
+            left, top, right, bottom = measured['bbox']
+            crop = (max(0.0, left - MARGIN_PADDING), max(0.0, height - bottom - MARGIN_PADDING),
+                    max(0.0, width - right - MARGIN_PADDING), max(0.0, top - MARGIN_PADDING))
+
+    if profile['max_pixels']:
+        area = (width - crop[0] - crop[2]) * (height - crop[1] - crop[3])
+        if area * scale * scale > profile['max_pixels']:
+            scale = (profile['max_pixels'] / area) ** 0.5
+    return scale, crop
+
+
+def render_page_bitmap(page, profile, scale=DEFAULT_RENDER_SCALE,
+                       bitmap_maker=pdfium.PdfBitmap.new_native):
+    """Rasterize one page for OCR under a render profile; returns the PDFium bitmap."""
+    scale, crop = plan_render(page, profile, scale)
+    if profile['grayscale']:
+        bitmap = page.render(scale=scale, rotation=0, crop=crop, grayscale=True,
+                             force_bitmap_format=pdfium_c.FPDFBitmap_Gray,
+                             bitmap_maker=bitmap_maker)
+    else:
+        # Rendered in RGB byte order: the same pixels to_pil() used to produce
+        bitmap = page.render(scale=scale, rotation=0, crop=crop, rev_byteorder=True,
+                             bitmap_maker=bitmap_maker)
+    RENDER_SCALE.observe(scale)
+    RENDER_PIXELS.inc(bitmap.width * bitmap.height)
+    return bitmap
+
+
+def render_page_image(page, profile, scale=DEFAULT_RENDER_SCALE):
+    """Rasterize one page for OCR under a render profile; returns a PIL image."""
+    return render_page_bitmap(page, profile, scale).to_pil()
+
+
+class PageBufferPool:
+    """Render buffers that are reused across pages of the same size.
+
+    PDFium renders straight into a buffer from the pool, and OCR gets a numpy
+    view of that buffer. No PIL image is made and nothing is copied. The
+    buffer goes back to the pool once the last reference to the array is
+    gone, so a page of a size seen before allocates nothing. With
+    ``spill_dir``, buffers are memory-mapped temporary files that the OS can
+    page out while rendered pages wait for OCR.
+    """
+
+    def __init__(self, spill_dir=None, max_idle_bytes=DEFAULT_IDLE_BUFFER_BYTES):
+        self.spill_dir = spill_dir
+        self.max_idle_bytes = max_idle_bytes
+        self._idle = {}
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'pages': 0,
+            'allocations': 0,
+            'reuses': 0,
+            'bytes_allocated': 0,
+            'bytes_reused': 0,
+            # What the same pages cost before: PDFium bitmap, PIL image and np.array copy
+            'legacy_bytes': 0,
+        }
+
+    def _allocate(self, size):
+        if self.spill_dir is None:
+            return (ctypes.c_ubyte * size)()
+        # The temporary file is already unlinked; its space is freed with the mapping
+        with tempfile.TemporaryFile(dir=self.spill_dir) as backing_file:
+            backing = np.memmap(backing_file, dtype=np.uint8, mode='w+', shape=(size,))
+        return (ctypes.c_ubyte * size).from_buffer(backing)
+
+    def _take(self, size):
+        with self._lock:
+            self.stats['pages'] += 1
+            self.stats['legacy_bytes'] += 3 * size
+            idle = self._idle.get(size)
+            if idle:
+                self._idle_bytes -= size
+                self.stats['reuses'] += 1
+                self.stats['bytes_reused'] += size
+                RENDER_BYTES_SAVED.inc(3 * size)
+                return idle.pop()
+            self.stats['allocations'] += 1
+            self.stats['bytes_allocated'] += size
+        RENDER_BYTES_ALLOCATED.inc(size)
+        RENDER_BYTES_SAVED.inc(2 * size)
+        return self._allocate(size)
+
+    def _give_back(self, buffer):
+        size = ctypes.sizeof(buffer)
+        with self._lock:
+            if self._idle_bytes + size <= self.max_idle_bytes:
+                self._idle.setdefault(size, []).append(buffer)
+                self._idle_bytes += size
+
+    def bitmap_maker(self, width, height, format, rev_byteorder=False):
+        """``bitmap_maker`` for ``PdfPage.render`` that renders into a pooled buffer."""
+        size = width * height * _CHANNELS[format]
+        return pdfium.PdfBitmap.new_native(width, height, format, rev_byteorder,
+                                           buffer=self._take(size))
+
+    def as_array(self, bitmap):
+        """Numpy view of a bitmap rendered by :meth:`bitmap_maker`, returned to the pool on release."""
+        array = bitmap.to_numpy()
+        if array.shape[2] == 1:
+            array = array.reshape(array.shape[:2])
+        weakref.finalize(array, self._give_back, bitmap.buffer)
+        return array
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, idle_bytes=self._idle_bytes)
+        stats['bytes_saved'] = stats['legacy_bytes'] - stats['bytes_allocated']
+        return stats
+
+
+_CHANNELS = {pdfium_c.FPDFBitmap_Gray: 1, pdfium_c.FPDFBitmap_BGR: 3,
+             pdfium_c.FPDFBitmap_BGRx: 4, pdfium_c.FPDFBitmap_BGRA: 4}
+
+# Shared by every in-process render; spilling renders get a pool of their own
+buffer_pool = PageBufferPool()
+
+
+def get_render_profile(profile=None):
+    """Resolve a profile name (default OCR_RENDER_PROFILE) or pass a profile dict through."""
+    if isinstance(profile, dict):
+        return profile
+    name = profile or RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {name}")
+    return RENDER_PROFILES[name]
+
+
+def iter_page_arrays(pdf_content, scale=DEFAULT_RENDER_SCALE, pages=None, profile=None,
+                     pool=None):
+    """Yield ``(page_num, numpy array)`` rendered without intermediate copies.
+
+    Arrays are views of pooled buffers, RGB (or 2-D grayscale) like
+    ``np.array(image)`` was. Drop each array when done with it so its buffer
+    can be reused for the next page.
+    """
+    profile = get_render_profile(profile)
+    pool = buffer_pool if pool is None else pool
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_content)
+        page_numbers = list(range(len(pdf)) if pages is None else pages)
+
+    try:
+        for page_num in page_numbers:
+            with metrics.span('render'), PDFIUM_LOCK:
+                page = pdf[page_num]
+                bitmap = render_page_bitmap(page, profile, scale, pool.bitmap_maker)
+                array = pool.as_array(bitmap)
+                # The buffer belongs to the pool, so the bitmap handle can go now
+                bitmap.close()
+                page.close()
+            yield page_num, array
+            del array
+    finally:
+        with PDFIUM_LOCK:
+            pdf.close()
+
+
+def iter_pdf_images(pdf_content, scale=DEFAULT_RENDER_SCALE, pages=None, profile=None):
+    """Yield ``(page_num, PIL image)`` one page at a time instead of rendering the whole PDF."""
+    profile = get_render_profile(profile)
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_content)
+        page_numbers = list(range(len(pdf)) if pages is None else pages)
+
+    try:
+        for page_num in page_numbers:
+            with metrics.span('render'), PDFIUM_LOCK:
+                page = pdf[page_num]
+                pil_image = render_page_image(page, profile, scale)
+                page.close()
+            yield page_num, pil_image
+    finally:
+        with PDFIUM_LOCK:
+            pdf.close()
+
+
+def iter_pdf_text(pdf_content, pages=None):
+    """Yield ``(page_num, text)`` from PDFium's text layer, without any layout analysis."""
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_content)
+        page_numbers = list(range(len(pdf)) if pages is None else pages)
+
+    try:
+        for page_num in page_numbers:
+            with PDFIUM_LOCK:
+                page = pdf[page_num]
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                textpage.close()
+                page.close()
+            yield page_num, text
+    finally:
+        with PDFIUM_LOCK:
+            pdf.close()
+
+
+def extract_page_text(result, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """Turn a PaddleOCR result for one image into the page's text."""
+    page_text = []
+    confidences = []
+    # Blank pages come back as [None]
+    for line in result or []:
+        for word_info in line or []:
+            if isinstance(word_info, list) and len(word_info) >= 2:
+                text = word_info[1][0]  # Extract text
+                confidence = word_info[1][1]  # Extract confidence
+                confidences.append(confidence)
+                if confidence > min_confidence:  # Filter low confidence results
+                    page_text.append(text)
+    metrics.record_ocr_confidences(confidences, min_confidence)
+
+    # Join text with proper spacing
+    return ' '.join(page_text)
+
+
+def get_ocr_profile(profile=None):
+    """Resolve an OCR profile name, defaulting to OCR_PROFILE."""
+    name = profile or OCR_PROFILE
+    if name not in OCR_PROFILES:
+        raise ValueError(f"Unknown OCR profile: {name}")
+    return name
+
+
+def _box_bounds(boxes):
+    """``(x0, y0, x1, y1)`` rows for PaddleOCR's four-point boxes."""
+    points = np.asarray(boxes, dtype=np.float32)
+    return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+
+
+def filter_boxes(boxes, settings):
+    """Drop detected boxes unlikely to hold useful text; returns the boxes kept."""
+    if not boxes:
+        return []
+    bounds = _box_bounds(boxes)
+    widths = bounds[:, 2] - bounds[:, 0]
+    heights = bounds[:, 3] - bounds[:, 1]
+    median_height = float(np.median(heights))
+
+    keep = heights >= settings['min_box_height_ratio'] * median_height
+    if settings['drop_logos']:
+        keep &= ~((heights >= LOGO_HEIGHT_RATIO * median_height)
+                  & (widths < LOGO_MAX_ASPECT * heights))
+    return [box for box, kept in zip(boxes, keep) if kept]
+
+
+def _reading_order(boxes):
+    """Sort boxes top to bottom, then left to right within a text line."""
+    if not boxes:
+        return []
+    bounds = _box_bounds(boxes)
+    tolerance = float(np.median(bounds[:, 3] - bounds[:, 1])) / 2
+    order = sorted(range(len(boxes)), key=lambda i: (bounds[i, 1], bounds[i, 0]))
+    lines = []
+    for i in order:
+        if lines and bounds[i, 1] - bounds[lines[-1][0], 1] <= tolerance:
+            lines[-1].append(i)
+        else:
+            lines.append([i])
+    return [boxes[i] for line in lines for i in sorted(line, key=lambda i: bounds[i, 0])]
+
+
+def _crop_boxes(img_array, boxes):
+    """Axis-aligned crops of each box, as the 3-channel images recognition expects."""
+    height, width = img_array.shape[:2]
+    crops = []
+    for x0, y0, x1, y1 in _box_bounds(boxes):
+        x0, y0 = min(max(0, int(x0)), width - 1), min(max(0, int(y0)), height - 1)
+        x1, y1 = min(width, int(np.ceil(x1))), min(height, int(np.ceil(y1)))
+        crop = img_array[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+        if crop.ndim == 2:
+            crop = np.repeat(crop[:, :, None], 3, axis=2)
+        crops.append(crop)
+    return crops
+
+
+def page_is_upright(ocr, img_array, boxes):
+    """Check a page's orientation once, from its largest boxes instead of every box."""
+    if not boxes:
+        return True
+    bounds = _box_bounds(boxes)
+    widths = bounds[:, 2] - bounds[:, 0]
+    heights = bounds[:, 3] - bounds[:, 1]
+    # Text lines run across the page; mostly tall boxes mean it's turned sideways
+    if np.count_nonzero(heights > widths) * 2 > len(boxes):
+        return False
+
+    largest = np.argsort(widths * heights)[-ORIENTATION_SAMPLE_BOXES:]
+    labels = ocr.ocr(_crop_boxes(img_array, [boxes[i] for i in largest]),
+                     det=False, rec=False, cls=True)[0]
+    flipped = sum(1 for label, score in labels
+                  if label == '180' and score >= ORIENTATION_MIN_SCORE)
+    return flipped * 2 <= len(labels)
+
+
+def run_ocr(ocr, img_array, profile=None, state=None):
+    """OCR one page under an OCR profile; returns a result in PaddleOCR's ``ocr()`` format.
+
+    ``state`` carries the orientation found on earlier pages of the same
+    document, for profiles that check it once per document.
+    """
+    name = get_ocr_profile(profile)
+    settings = OCR_PROFILES[name]
+    state = {} if state is None else state
+    if settings['orientation'] == 'box':
+        OCR_PAGE_PATHS.inc(profile=name, path='full')
+        return ocr.ocr(img_array)
+
+    with metrics.span('ocr_detect'):
+        boxes = ocr.ocr(img_array, det=True, rec=False)[0] or []
+
+    if settings['orientation'] == 'document' and 'upright' in state:
+        upright = state['upright']
+    else:
+        with metrics.span('ocr_orientation'):
+            upright = page_is_upright(ocr, img_array, boxes)
+        state['upright'] = upright
+
+    if not upright:
+        # Let PaddleOCR classify and rotate every box, as the accurate profile does
+        OCR_PAGE_PATHS.inc(profile=name, path='full')
+        return ocr.ocr(img_array)
+
+    kept = _reading_order(filter_boxes(boxes, settings))
+    OCR_BOXES.inc(len(kept), recognized='yes')
+    OCR_BOXES.inc(len(boxes) - len(kept), recognized='no')
+    OCR_PAGE_PATHS.inc(profile=name, path='batched')
+    if not kept:
+        return [None]
+
+    # One call over every crop: the recognizer batches them itself
+    with metrics.span('ocr_recognize'):
+        recognized = ocr.ocr(_crop_boxes(img_array, kept), det=False, rec=True, cls=False)[0]
+    return [[[box, tuple(text_score)] for box, text_score in zip(kept, recognized)]]
+
+
+def render_buffer_pool(pdf_content, pages=None):
+    """The buffer pool to render a document with: memory-mapped if it's long enough to spill."""
+    if not SPILL_PAGES:
+        return buffer_pool
+    page_count = count_pages(pdf_content) if pages is None else len(pages)
+    if page_count < SPILL_PAGES:
+        return buffer_pool
+    return PageBufferPool(spill_dir=SPILL_DIR or tempfile.gettempdir())
+
+
+def iter_ocr_pages(pdf_content, scale=DEFAULT_RENDER_SCALE, prefetch=DEFAULT_PREFETCH,
+                   min_confidence=DEFAULT_MIN_CONFIDENCE, pages=None, render_profile=None,
+                   ocr_profile=None, dedup=None):
+    """Stream ``(page_num, page_text)`` while the next pages render in the background.
+
+    A render thread fills a bounded queue and the caller's thread runs OCR on
+    whatever is at its head, so rendering of page N+1 overlaps OCR of page N.
+    At most ``prefetch + 1`` page bitmaps are alive at any moment, however long
+    the document is. Pages are rendered into reused buffers (see
+    ``PageBufferPool``); documents of ``OCR_SPILL_PAGES`` pages or more
+    render into memory-mapped temporary files instead. Each page is OCR'd
+    under ``ocr_profile`` (default OCR_PROFILE), see ``run_ocr``. With
+    ``dedup`` (default: PAGE_DEDUP allows it), a page that repeats an
+    earlier one has only its differing regions OCR'd, see
+    ``page_dedup.RasterDedup``.
+    """
+    ocr_profile = get_ocr_profile(ocr_profile)
+    metrics.annotate(ocr_profile=ocr_profile)
+    orientation = {}
+    dedup = page_dedup.ocr_enabled() if dedup is None else dedup
+    repeats = page_dedup.RasterDedup() if dedup else None
+    render_profile = get_render_profile(render_profile)
+    pool = render_buffer_pool(pdf_content, pages)
+    # Each rendered page holds a slot until its OCR is done, which bounds the queue
+    slots = threading.Semaphore(prefetch + 1)
+    rendered = queue.Queue()
+    stop = threading.Event()
+
+    def render_pages():
+        images = iter_page_arrays(pdf_content, scale=scale, pages=pages,
+                                  profile=render_profile, pool=pool)
+        try:
+            while True:
+                # Wait for a free slot before rendering the next page
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                item = next(images, None)
+                if item is None:
+                    return
+                rendered.put(item)
+        except Exception as e:
+            rendered.put(_RenderFailure(e))
+        finally:
+            images.close()
+            rendered.put(_DONE)
+
+    # Run the producer in a copy of this context so its render spans land in the caller's trace
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(render_pages,),
+                                name='pdf-render', daemon=True)
+    producer.start()
+
+    try:
+        with ocr_engine() as ocr:
+            while True:
+                item = rendered.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _RenderFailure):
+                    raise item.error
+
+                page_num, img_array = item
+                del item
+
+                with metrics.span('ocr'):
+                    if repeats is None:
+                        result = run_ocr(ocr, img_array, ocr_profile, orientation)
+                    else:
+                        result = repeats.ocr(img_array, lambda image: run_ocr(
+                            ocr, image, ocr_profile, orientation))
+                # Dropping the array hands its buffer back for the next page
+                del img_array
+                slots.release()
+
+                yield page_num, extract_page_text(result, min_confidence)
+    finally:
+        stop.set()
+        producer.join()
+
+
+# Opt-in parallel OCR: number of worker processes (0 or 1 keeps OCR in-process)
+PARALLEL_OCR_WORKERS = int(os.environ.get('OCR_PARALLEL_WORKERS', '0'))
+
+# OMP/MKL threads each worker process may use
+OCR_THREADS_PER_WORKER = int(os.environ.get('OCR_THREADS_PER_WORKER', '1'))
+
+_parallel_pools = {}
+_parallel_lock = threading.Lock()
+
+
+def get_parallel_pool(workers=None, threads_per_worker=None, config=None):
+    """Return a long-lived process pool whose workers each hold their own PaddleOCR.
+
+    Pools are kept for the life of the process since every worker pays the
+    model load once, when it starts.
+    """
+    workers = workers or PARALLEL_OCR_WORKERS or os.cpu_count() or 1
+    threads_per_worker = threads_per_worker or OCR_THREADS_PER_WORKER
+    config = DEFAULT_OCR_CONFIG if config is None else config
+    key = (workers, threads_per_worker, tuple(sorted(config.items())))
+
+    with _parallel_lock:
+        pool = _parallel_pools.get(key)
+        if pool is None:
+            # spawn so workers never inherit a half-initialized Paddle runtime from a fork
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=ocr_worker.init_worker,
+                initargs=(config, threads_per_worker),
+            )
+            _parallel_pools[key] = pool
+        return pool
+
+
+def _discard_parallel_pool(pool):
+    with _parallel_lock:
+        for key, candidate in list(_parallel_pools.items()):
+            if candidate is pool:
+                del _parallel_pools[key]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parallel_pools():
+    """Stop every OCR worker process started by this process."""
+    with _parallel_lock:
+        pools = list(_parallel_pools.values())
+        _parallel_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_parallel_pools)
+
+
+def ocr_pages_parallel(pdf_content, workers=None, threads_per_worker=None,
+                       scale=DEFAULT_RENDER_SCALE, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                       pages=None, config=None, render_profile=None, ocr_profile=None):
+    """OCR pages across a process pool, yielding ``(page_num, page_text)`` in page order.
+
+    The PDF is written to a temporary file once so that workers open it by path
+    instead of receiving a pickled copy of the bytes for every page. Each
+    worker sees single pages, so repeated pages are OCR'd in full here.
+    """
+    pages = list(range(count_pages(pdf_content)) if pages is None else pages)
+    if not pages:
+        return
+
+    pool = get_parallel_pool(workers, threads_per_worker, config)
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+        pdf_file.write(pdf_content)
+        pdf_path = pdf_file.name
+
+    futures = []
+    try:
+        # Resolved here so workers use the parent's profile, not their own environment
+        profile = get_render_profile(render_profile)
+        ocr_profile = get_ocr_profile(ocr_profile)
+        metrics.annotate(ocr_profile=ocr_profile)
+        futures = [pool.submit(ocr_worker.ocr_page, pdf_path, page_num, scale, min_confidence,
+                               profile, ocr_profile)
+                   for page_num in pages]
+        # Futures were submitted in page order, so waiting on them in turn reassembles it
+        for future in futures:
+            yield future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool on the next call
+        _discard_parallel_pool(pool)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        os.unlink(pdf_path)
+
+
+def count_pages(pdf_content):
+    """Number of pages in the PDF."""
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_content)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
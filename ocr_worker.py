@@ -0,0 +1,43 @@
+"""Entry points for OCR worker processes.
+
+Kept free of Paddle imports at module level: the thread limits below only take
+effect if they are in the environment before paddle is first imported, so the
+initializer sets them and only then pulls in the OCR stack.
+"""
+import os
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+_engine_config = None
+
+
+def init_worker(config, threads):
+    """Pin the worker's math-library threads and load its own PaddleOCR instance."""
+    global _engine_config
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    _engine_config = dict(config, cpu_threads=threads)
+
+    import ocr_engine
+    ocr_engine.registry.get_pool(_engine_config, size=1)
+    ocr_engine.warm_up(_engine_config, instances=1)
+
+
+def ocr_page(pdf_path, page_num, scale, min_confidence, render_profile=None, ocr_profile=None):
+    """Render and OCR a single page inside the worker process."""
+    import ocr_engine
+    import ocr_pipeline
+
+    # The page lands in this worker's buffer pool, so same-size pages reuse it
+    images = ocr_pipeline.iter_page_arrays(pdf_path, scale=scale, pages=[page_num],
+                                           profile=render_profile)
+    try:
+        _, img_array = next(images)
+    finally:
+        images.close()
+
+    with ocr_engine.ocr_engine(_engine_config) as ocr:
+        # Pages are spread over workers, so orientation is checked per page here
+        result = ocr_pipeline.run_ocr(ocr, img_array, ocr_profile)
+    del img_array
+    return page_num, ocr_pipeline.extract_page_text(result, min_confidence)
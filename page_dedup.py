@@ -0,0 +1,338 @@
+"""Near-duplicate pages: OCR and prompt each repeated page only once.
+
+Multi-passenger bundles often repeat the same e-ticket page once per
+passenger, and the copies differ only in the name and ticket number. Two
+stages take advantage of that:
+- ``RasterDedup`` sits in front of OCR. It OCRs one representative of each
+  cluster of near-identical page renders. Every other page in the cluster
+  reuses the representative's OCR lines, and only the regions where its
+  pixels differ are OCR'd.
+- ``collapse_repeated_pages`` works on page texts before they go into the
+  prompt, with ``PAGE_DEDUP=on`` only. A page whose text repeats an earlier page is cut down to the words
+  that differ, with a little context, under a note naming the page it repeats.
+  Words of the earlier page it doesn't have are named as not on this page.
+
+Both stages compare pages cheaply first and diff only the candidates in full.
+Renders are compared by a difference hash, and texts by MinHash signatures
+over word shingles. Anything that doesn't line up falls back to the normal
+path: pages of different sizes, or copies that differ in too large an area
+or too many words.
+"""
+import difflib
+import os
+import zlib
+
+import numpy as np
+
+import metrics
+
+# 'on' dedups both OCR and prompt text, 'ocr' only OCR, 'off' neither. Prompt
+# text is left whole by default: the prompt doesn't explain the "repeats page"
+# notes, and no prompt regression run has covered them yet
+PAGE_DEDUP = os.environ.get('PAGE_DEDUP', 'ocr')
+
+# Renders are diffed after averaging DIFF_SCALE x DIFF_SCALE pixel blocks;
+# a block that changes by more than DIFF_THRESHOLD gray levels has changed.
+# Single specks of dust average out below the threshold, changed text doesn't.
+DIFF_SCALE = 4
+DIFF_THRESHOLD = 48
+# Difference hash: HASH_SIZE x HASH_SIZE bits, and the bits two pages may
+# differ in and still be diffed
+HASH_SIZE = 16
+HASH_MAX_DISTANCE = int(os.environ.get('PAGE_DEDUP_HASH_DISTANCE', '24'))
+# Changed blocks closer than this (in blocks) are OCR'd as one region, and
+# regions get this much padding (in render pixels)
+REGION_GAP = 8
+REGION_PADDING = 8
+# Copies that differ in more of the page than this, or in more regions, are OCR'd whole
+MAX_CHANGED_FRACTION = 0.25
+MAX_REGIONS = 12
+# Representatives kept per document; the oldest is dropped beyond this
+MAX_REPRESENTATIVES = 8
+
+# Text: word shingle length, MinHash signature length, and the estimated
+# Jaccard similarity from which a page is diffed against an earlier one
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+TEXT_SIMILARITY = float(os.environ.get('PAGE_DEDUP_TEXT_SIMILARITY', '0.6'))
+# Pages shorter than this many words are always kept whole
+MIN_PAGE_WORDS = 20
+# Words kept before each changed span, so e.g. a name keeps its label
+CONTEXT_WORDS = 3
+# Pages whose words differ in more than this fraction are kept whole
+MAX_CHANGED_WORDS = 0.5
+
+_MINHASH_PRIME = (1 << 31) - 1
+_permutations = np.random.default_rng(20240601).integers(
+    1, _MINHASH_PRIME, size=(2, MINHASH_PERMUTATIONS), dtype=np.int64)
+
+DEDUP_PAGES = metrics.registry.counter(
+    'flightdoc_page_dedup_pages_total',
+    'Pages seen by near-duplicate detection, by stage (ocr, text) and what was done with them.')
+DEDUP_CHARS_REMOVED = metrics.registry.counter(
+    'flightdoc_page_dedup_chars_removed_total',
+    'Characters of repeated page text left out of prompts.')
+
+
+def ocr_enabled():
+    return PAGE_DEDUP in ('on', 'ocr')
+
+
+def text_enabled():
+    return PAGE_DEDUP == 'on'
+
+
+def _block_gray(img_array):
+    """Mean gray level of each DIFF_SCALE x DIFF_SCALE block of a render, as float32."""
+    height = img_array.shape[0] // DIFF_SCALE * DIFF_SCALE
+    width = img_array.shape[1] // DIFF_SCALE * DIFF_SCALE
+    blocks = img_array[:height, :width].reshape(
+        height // DIFF_SCALE, DIFF_SCALE, width // DIFF_SCALE, DIFF_SCALE, -1)
+    return blocks.mean(axis=(1, 3, 4), dtype=np.float32)
+
+
+def difference_hash(gray):
+    """HASH_SIZE**2 booleans: is each cell of a coarse grid brighter than its right neighbour."""
+    rows = np.linspace(0, gray.shape[0], HASH_SIZE + 1).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], HASH_SIZE + 2).astype(int)[:-1]
+    cells = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    sizes = np.outer(np.diff(np.append(rows, gray.shape[0])),
+                     np.diff(np.append(cols, gray.shape[1])))
+    cells = cells / np.maximum(sizes, 1)
+    return (cells[:, :-1] > cells[:, 1:]).ravel()
+
+
+def _spans(indices, gap):
+    """``(first, last)`` of the runs in sorted ``indices``, bridging gaps up to ``gap``."""
+    spans = []
+    for index in indices:
+        if spans and index - spans[-1][1] <= gap:
+            spans[-1][1] = index
+        else:
+            spans.append([index, index])
+    return spans
+
+
+def changed_regions(mask):
+    """``[x0, y0, x1, y1]`` blocks around the changed cells of a block mask, line by line."""
+    regions = []
+    for top, bottom in _spans(np.flatnonzero(mask.any(axis=1)), REGION_GAP):
+        band = mask[top:bottom + 1]
+        for left, right in _spans(np.flatnonzero(band.any(axis=0)), REGION_GAP):
+            regions.append([left, top, right + 1, bottom + 1])
+    return regions
+
+
+def _bounds(box):
+    points = np.asarray(box, dtype=np.float32)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _grow(regions, line_bounds, width, height):
+    """Pad the regions and widen them over every OCR line they touch, merging overlaps.
+
+    A representative's line that touches a region is dropped, so the region
+    must cover all of it for its words to be read again.
+    """
+    regions = [[max(0, x0 - REGION_PADDING), max(0, y0 - REGION_PADDING),
+                min(width, x1 + REGION_PADDING), min(height, y1 + REGION_PADDING)]
+               for x0, y0, x1, y1 in regions]
+    changed = True
+    while changed:
+        changed = False
+        for region in regions:
+            for bounds in line_bounds:
+                if _overlaps(region, bounds) and not (
+                        region[0] <= bounds[0] and region[1] <= bounds[1]
+                        and region[2] >= bounds[2] and region[3] >= bounds[3]):
+                    region[:] = [min(region[0], int(bounds[0])), min(region[1], int(bounds[1])),
+                                 max(region[2], int(np.ceil(bounds[2]))),
+                                 max(region[3], int(np.ceil(bounds[3])))]
+                    changed = True
+        merged = []
+        for region in regions:
+            for other in merged:
+                if _overlaps(region, other):
+                    other[:] = [min(region[0], other[0]), min(region[1], other[1]),
+                                max(region[2], other[2]), max(region[3], other[3])]
+                    changed = True
+                    break
+            else:
+                merged.append(region)
+        regions = merged
+    return regions
+
+
+def _reading_order(lines):
+    """Sort OCR lines top to bottom, then left to right within a text line."""
+    if not lines:
+        return []
+    bounds = [_bounds(line[0]) for line in lines]
+    tolerance = float(np.median([b[3] - b[1] for b in bounds])) / 2
+    order = sorted(range(len(lines)), key=lambda i: (bounds[i][1], bounds[i][0]))
+    rows = []
+    for i in order:
+        if rows and bounds[i][1] - bounds[rows[-1][0]][1] <= tolerance:
+            rows[-1].append(i)
+        else:
+            rows.append([i])
+    return [lines[i] for row in rows for i in sorted(row, key=lambda i: bounds[i][0])]
+
+
+def _offset(line, x0, y0):
+    box, text = line
+    return [[[x + x0, y + y0] for x, y in box], text]
+
+
+class _Representative:
+
+    def __init__(self, shape, gray, lines):
+        self.shape = shape
+        self.gray = gray
+        self.hash = difference_hash(gray)
+        self.lines = lines
+        self.line_bounds = [_bounds(line[0]) for line in lines]
+
+
+class RasterDedup:
+    """OCR for the pages of one document that skips what an earlier page already read.
+
+    ``ocr(img_array, recognize)`` returns a result in PaddleOCR's ``ocr()``
+    format, like ``recognize(image)`` would for the whole page. ``counts``
+    records what was done per page:
+    - ``full``: OCR'd whole; the page becomes a representative
+    - ``reused``: pixel-identical to a representative, so no OCR at all
+    - ``regions``: only the regions that differ were OCR'd
+    """
+
+    def __init__(self, max_representatives=MAX_REPRESENTATIVES):
+        self.max_representatives = max_representatives
+        self.representatives = []
+        self.counts = {'full': 0, 'reused': 0, 'regions': 0}
+
+    def ocr(self, img_array, recognize):
+        gray = _block_gray(img_array)
+        page_hash = difference_hash(gray)
+        for representative in self.representatives:
+            if (representative.shape == img_array.shape
+                    and np.count_nonzero(representative.hash != page_hash) <= HASH_MAX_DISTANCE):
+                result = self._ocr_changes(representative, gray, img_array, recognize)
+                if result is not None:
+                    return result
+
+        result = recognize(img_array)
+        self._count('full')
+        self.representatives.append(_Representative(img_array.shape, gray,
+                                                     [line for line in result[0] or []]))
+        del self.representatives[:-self.max_representatives]
+        return result
+
+    def _ocr_changes(self, representative, gray, img_array, recognize):
+        """The page read as the representative's lines plus its changed regions, or None."""
+        mask = np.abs(gray - representative.gray) > DIFF_THRESHOLD
+        height, width = img_array.shape[:2]
+        regions = _grow([[x0 * DIFF_SCALE, y0 * DIFF_SCALE, x1 * DIFF_SCALE, y1 * DIFF_SCALE]
+                         for x0, y0, x1, y1 in changed_regions(mask)],
+                        representative.line_bounds, width, height)
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        if len(regions) > MAX_REGIONS or area > MAX_CHANGED_FRACTION * width * height:
+            return None
+
+        lines = [line for line, bounds in zip(representative.lines, representative.line_bounds)
+                 if not any(_overlaps(region, bounds) for region in regions)]
+        for x0, y0, x1, y1 in regions:
+            region_result = recognize(np.ascontiguousarray(img_array[y0:y1, x0:x1]))
+            lines.extend(_offset(line, x0, y0) for line in region_result[0] or [])
+        self._count('regions' if regions else 'reused')
+        return [_reading_order(lines) or None]
+
+    def _count(self, result):
+        self.counts[result] += 1
+        DEDUP_PAGES.inc(stage='ocr', result=result)
+        metrics.accumulate('page_dedup', **{f'ocr_{result}': 1})
+
+
+def _words(text):
+    return text.split()
+
+
+def minhash(words):
+    """MinHash signature of the word shingles of a page."""
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE])
+                for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.array([zlib.crc32(shingle.encode()) & _MINHASH_PRIME for shingle in shingles],
+                      dtype=np.int64)
+    a, b = _permutations
+    return ((np.outer(a, hashes) + b[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+
+def changed_words(base, words):
+    """Spans of ``words`` that differ from ``base``, each with CONTEXT_WORDS before it.
+
+    Words of ``base`` that ``words`` dropped or replaced follow, where they
+    were, in a "(not on this page: ...)" note, so the copy isn't read as
+    having them. Returns ``(spans, changed)``, with ``changed`` the number
+    of words that differ on either side.
+    """
+    matcher = difflib.SequenceMatcher(None, base, words, autojunk=False)
+    spans = []
+    changed = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        changed += max(i2 - i1, j2 - j1)
+        start = max(0, j1 - CONTEXT_WORDS)
+        if not spans or start > spans[-1][1]:
+            spans.append([start, start, []])
+        span = spans[-1]
+        span[2].extend(words[span[1]:j2])
+        span[1] = max(span[1], j2)
+        if i2 > i1:
+            span[2].append(f"(not on this page: {' '.join(base[i1:i2])})")
+    return [' '.join(pieces) for _, _, pieces in spans], changed
+
+
+def collapse_repeated_pages(pages):
+    """Page texts for the prompt, with pages that repeat an earlier one cut to what differs.
+
+    ``pages`` are the extraction's page records. A collapsed page gets a
+    ``duplicate_of`` entry with the page it repeats. Returns the texts, one
+    per page.
+    """
+    texts = [page['text'].strip() for page in pages]
+    representatives = []
+    collapsed = removed = 0
+    for index, (page, text) in enumerate(zip(pages, texts)):
+        words = _words(text)
+        if len(words) < MIN_PAGE_WORDS:
+            continue
+        signature = minhash(words)
+        best = None
+        for rep_index, rep_words, rep_signature in representatives:
+            similarity = float(np.mean(rep_signature == signature))
+            if similarity >= TEXT_SIMILARITY and (best is None or similarity > best[0]):
+                best = similarity, rep_index, rep_words
+        if best is not None:
+            _, rep_index, rep_words = best
+            spans, changed = changed_words(rep_words, words)
+            rep_page = pages[rep_index]['page']
+            short = '\n'.join([f"(Page {page['page'] + 1} repeats page {rep_page + 1}"
+                               f" except for:)"] + spans)
+            if changed <= MAX_CHANGED_WORDS * len(words) and len(short) < len(text):
+                texts[index] = short
+                page['duplicate_of'] = rep_page
+                collapsed += 1
+                removed += len(text) - len(short)
+                DEDUP_PAGES.inc(stage='text', result='collapsed')
+                continue
+        representatives.append((index, words, signature))
+        DEDUP_PAGES.inc(stage='text', result='kept')
+
+    if collapsed:
+        DEDUP_CHARS_REMOVED.inc(removed)
+        metrics.accumulate('page_dedup', text_collapsed=collapsed, chars_removed=removed)
+    return texts
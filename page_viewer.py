@@ -0,0 +1,125 @@
+"""Page images for the document viewer, rendered on demand and cached per document.
+
+Thumbnails are small JPEGs, rendered the first time a page is shown. A
+full-size page is rendered only once the user opens it. Everything is kept in one LRU bounded by bytes, keyed by
+document hash, so Streamlit reruns and repeat uploads hit the cache.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import pypdfium2 as pdfium
+
+import metrics
+import ocr_pipeline
+
+THUMBNAIL_WIDTH = int(os.environ.get('VIEWER_THUMBNAIL_WIDTH', '160'))
+PAGE_WIDTH = int(os.environ.get('VIEWER_PAGE_WIDTH', '1000'))
+JPEG_QUALITY = 80
+DEFAULT_CACHE_BYTES = int(float(os.environ.get('VIEWER_CACHE_MB', '64')) * 1024 * 1024)
+
+VIEWER_IMAGES = metrics.registry.counter(
+    'flightdoc_viewer_images_total',
+    'Viewer images served, by kind and source (cache or render).')
+
+
+class ImageCache:
+    """In-memory LRU of encoded images, bounded by their total size."""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._page_counts = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            data = self._images.get(key)
+            if data is None:
+                self.stats['misses'] += 1
+                return None
+            self._images.move_to_end(key)
+            self.stats['hits'] += 1
+            return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def set(self, key, data):
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._images[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def page_count(self, doc_hash, pdf_content):
+        with self._lock:
+            count = self._page_counts.get(doc_hash)
+        if count is None:
+            count = ocr_pipeline.count_pages(pdf_content)
+            with self._lock:
+                self._page_counts[doc_hash] = count
+        return count
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, images=len(self._images), bytes=self._bytes)
+        return stats
+
+
+cache = ImageCache()
+
+
+def encode_jpeg(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def render_page(pdf_content, page_num, width):
+    """Render one page ``width`` pixels wide; returns a PIL image."""
+    with ocr_pipeline.PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_content)
+        try:
+            page = pdf[page_num]
+            image = page.render(scale=width / page.get_width()).to_pil()
+            page.close()
+        finally:
+            pdf.close()
+    return image
+
+
+def _cached_render(kind, pdf_content, doc_hash, page_num, width):
+    key = (doc_hash, kind, page_num)
+    data = cache.get(key)
+    if data is not None:
+        VIEWER_IMAGES.inc(kind=kind, source='cache')
+        return data
+    with metrics.span(f'viewer_{kind}'):
+        data = encode_jpeg(render_page(pdf_content, page_num, width))
+    cache.set(key, data)
+    VIEWER_IMAGES.inc(kind=kind, source='render')
+    return data
+
+
+def thumbnail(pdf_content, doc_hash, page_num):
+    """JPEG thumbnail of one page."""
+    return _cached_render('thumbnail', pdf_content, doc_hash, page_num, THUMBNAIL_WIDTH)
+
+
+def page_image(pdf_content, doc_hash, page_num):
+    """JPEG of one page at full viewer size."""
+    return _cached_render('page', pdf_content, doc_hash, page_num, PAGE_WIDTH)
+
+
+def page_count(pdf_content, doc_hash):
+    return cache.page_count(doc_hash, pdf_content)
@@ -0,0 +1,1021 @@
+"""The document pipeline: extraction, the LLM call and the caches around them.
+
+``run_document_job`` is what the app queues for every upload. It lives here,
+not in the Streamlit script (which runs as ``__main__``), so worker processes
+(JOB_MODE=process) can import it; batch and api_server reuse the same steps.
+"""
+import requests
+import json
+import time
+import re
+import pdfplumber
+import io
+import os
+import threading
+import logging
+
+import context_window
+import job_queue
+import json_stream
+import layout_templates
+import llm_client
+import metrics
+import ocr_pipeline
+import page_dedup
+import prompt_builder
+import result_cache
+import singleflight
+import text_cleaning
+
+# Your existing URL and headers (CHAT_API_URL points the app at another endpoint, e.g. a local stub)
+url = os.environ.get('CHAT_API_URL', "https://client-api-uat01.vfsai.com/chats/")
+headers = {
+    'Content-Type': 'application/json',
+    'x-app-id': '9f5d2237b22effbf96bf513df5cf8b29',
+    'authorization': 'Access 05c718d678a1f1f5c2f2b4b1b1a1ae5dd3331a6b08c594d67b7de6b4d20dd7e3ae3c30bed253a93e2dbc32a9ebfa80e00b903e1ffc9e174dd3a327ce8d0daa56ec40e1332b7b771a6945fb2a519a80a5'
+}
+
+logger = logging.getLogger(__name__)
+
+# Ask the chat endpoint to stream its answer, so passengers and flights show up
+# as they are generated (endpoints without streaming still answer in one piece)
+LLM_STREAM = os.environ.get('LLM_STREAM', '0') == '1'
+
+# Pages with less text than this are treated as scans and sent to OCR
+MIN_PAGE_TEXT_CHARS = 25
+
+# Extraction ladder, cheapest first: PDFium's text layer, then PDFPlumber's
+# tables+text, then OCR. A page moves down the ladder only while its text
+# fails validate_page_text; OCR output is always accepted.
+EXTRACTION_TIERS = [tier.strip() for tier in
+                    os.environ.get('EXTRACTION_TIERS', 'pdfium,pdfplumber,paddleocr').split(',')
+                    if tier.strip()]
+TEXT_LAYER_EXTRACTORS = ('pdfium', 'pdfplumber')
+
+# Process-wide page counters for the per-page hybrid extraction
+EXTRACTION_STATS = {
+    'documents': 0,
+    'documents_with_ocr': 0,
+    'pages': 0,
+    'pages_text_layer': 0,
+    'pages_ocr': 0,
+    'ocr_pages_saved': 0,
+    # Per tier: pages tried, pages it resolved, time spent and failed runs
+    'tiers': {},
+    # Documents by the deepest tier any of their pages needed
+    'resolved_by': {},
+}
+_extraction_stats_lock = threading.Lock()
+
+# Bump whenever a change to extraction or cleaning alters hybrid_process_pdf's output
+# (the render and OCR profiles are part of it, since they change what OCR reads,
+# EXTRACTION_TIERS, since it picks which extractor a page's text comes from,
+# and PAGE_DEDUP, since it changes which page text reaches the prompt)
+PIPELINE_VERSION = (f'extract-v3-{ocr_pipeline.RENDER_PROFILE}-{ocr_pipeline.OCR_PROFILE}'
+                    f'-tiers-{"-".join(EXTRACTION_TIERS)}-dedup-{page_dedup.PAGE_DEDUP}')
+
+PROMPT_TEMPLATE = '''You are an expert in analyzing travel documents and decoding flight information. Extract all relevant information from the provided travel document and return the data in a json format. Follow these guidelines:
+
+1. Travel Number:
+   - The "travel_number" refers to the unique booking identifier.
+   - Valid labels/identifiers (in priority order):
+     1. "Airline PNR" or "PNR:" or "PNR -"
+     2. "Confirmation Number:"
+     3. "Reservation Code:"
+     4. "Check-in Reference:" (when not marked as agency/GDS reference)
+     5. "GDS PNR" (when explicitly marked as ticket PNR, not agency reference)
+
+   - Format Requirements:
+     * Must be between 5 and 7 characters long (inclusive)
+     * Must be a standalone identifier
+     * Can contain letters and numbers
+     * May contain a hyphen (-)
+     * Special Rules for Confirmation Numbers:
+       - When extracting from "Confirmation Number:" label:
+         * Take ONLY the standalone alphanumeric string immediately after the label
+         * Must be exactly 5-6 characters long
+         * Extract ONLY the first complete identifier
+         * Examples:
+           - "Confirmation Number: ABC12D" -> extract "ABC12D"
+           - "Confirmation Number: ABC12D 99" -> extract "ABC12D"
+           - "Confirmation Number: ABC12D99" -> extract "ABC12D"
+       - Specifically for Confirmation Numbers:
+         * DO NOT include any digits or characters that appear after the first complete identifier
+         * Stop extraction at the first complete valid identifier (5-6 characters)
+         * Ignore any trailing numbers or text even if connected
+         * Examples of INCORRECT extraction:
+           - "Confirmation Number: ABC12D99" -> "ABC12D99" (wrong)
+           - "Confirmation Number: ABC12D456" -> "ABC12D456" (wrong)
+         * Examples of CORRECT extraction:
+           - "Confirmation Number: ABC12D99" -> "ABC12D" (correct)
+           - "Confirmation Number: ABC12D456" -> "ABC12D" (correct)
+     * For Check-in References in complex layouts:
+       - Example 1: "Agency Reference: 123456 Check-in Reference: ABC789(XY)" -> extract "ABC789"
+       - Example 2: "Check-in Reference: DEF456(ZZ) / OTHER123" -> extract "DEF456"
+     * When references appear in header-style format:
+       Example:
+       Agency Reference:  Check-in Reference:  Travel Agency:
+       ABC123            XYZ789(DL)           AGENCY NAME
+       -> extract "XYZ789"
+     * Common formats:
+       - After "PNR:" or "PNR -" or "Airline PNR:"
+       - After "Confirmation Number:"
+       - In a clearly labeled PNR field
+       - In a dedicated reference field
+
+   - Identification Rules:
+     * Check document sections for explicit PNR labels first
+     * Look for standalone PNR formats
+     * For Check-in References, ignore any text in parentheses (e.g., from "ABC123(XY)" take only "ABC123")
+     * When multiple identifiers exist:
+       - Airline PNR takes highest priority
+       - Confirmation Number second priority
+       - GDS PNR (when explicitly marked as ticket PNR) third priority
+       - Check-in Reference (when standalone) fourth priority
+       - If multiple references exist, use ONLY the highest priority one
+
+   - **IMPORTANT: NEVER extract:**
+     * ANY number labeled as "Agency Reference:" or "Agency Ref:"
+     * ANY reference that starts with "Agency"
+     * ANY reference from a travel agency section
+     * Booking References longer than 7 characters
+     * Reference numbers containing spaces
+     * E-ticket numbers (usually 10+ digits)
+     * Flight numbers (airline code + numbers)
+     * Order IDs (usually longer than 7 characters)
+     * Cart Information numbers
+     * Any part of a longer string
+     * GDS References when marked as agency reference
+
+   Validation Examples:
+   CORRECT to extract:
+   - Airline PNR formats:
+     * "PNR: ABC123"
+     * "Airline PNR - XYZ45P"
+     * "PNR: KLM789"
+
+   - Confirmation Number formats:
+     * "Confirmation Number: N7K42L"
+     * "Confirmation #: RT567K"
+
+   - Check-in Reference formats:
+     * "Check-in Ref: H8M92P"
+     * "Check-in Reference: ABC123(XY)" -> extract "ABC123"
+     * "Reference: WQ456T" (when not in agency section)
+
+   INCORRECT to extract:
+   - Agency references (never extract these):
+     * "Agency Reference: ABC123"
+     * "Agency Ref: XYZ789"
+     * "GDS Reference: XY789Z" (when in agency section)
+     * Any number after "Agency Reference:"
+
+   - Other invalid formats:
+     * "Booking: REF123456789"
+     * "Reference: BOOK987654321"
+     * "Flight numbers: BA 123"
+     * "E-ticket: 1234567890123"
+     * "Order ID: 34728581279"
+
+   VALIDATION STEPS:
+   1. First scan for explicit "Agency Reference" labels and EXCLUDE these numbers
+   2. Then scan for explicit PNR labels in priority order
+   3. Check each potential number against format requirements
+   4. For Confirmation Numbers:
+      a) First identify the label "Confirmation Number:"
+      b) Extract only the first 5-6 characters after the label
+      c) Stop extraction after getting valid identifier
+      d) Ignore any trailing numbers or text
+   5. For Check-in References:
+      a) First identify the label "Check-in Reference:"
+      b) Extract the immediately following alphanumeric string
+      c) If it contains parentheses, take only the part before them
+      d) Ignore any text after forward slashes (/)
+   6. Verify it's not in exclusion list
+   7. Confirm it's a complete standalone identifier
+   8. For multiple valid numbers:
+      a) Use Airline PNR if available
+      b) Use Confirmation Number if no Airline PNR
+      c) Use GDS PNR if clearly marked as ticket PNR
+      d) Use Check-in Reference only if standalone and not agency-related
+
+   Note: Always prioritize explicitly labeled identifiers over inferred ones. If in doubt, prefer not to extract rather than extract incorrectly.
+
+2. Flight Name:
+   - flight_name must ALWAYS include both airline name and flight number
+   - Format as "AIRLINE NAME XX NNN" where:
+     * AIRLINE NAME is the complete carrier name (e.g., "China Eastern Airlines", "Emirates")
+     * XX is the airline code (e.g., "MU", "EK")
+     * NNN is the flight number
+   - Always extract the full airline name when available in the document
+   - Common airline codes and names:
+     * MU = China Eastern Airlines
+     * EK = Emirates
+     * CZ = China Southern Airlines
+     * CA = Air China
+     * QR = Qatar Airways
+   - Examples of correct flight names:
+     * "China Eastern Airlines MU 245"
+     * "Emirates EK 302"
+     * "Qatar Airways QR 545"
+   - Do NOT abbreviate airline names
+   - Do NOT omit airline name from the flight_name field
+
+# Modify the Example Cases to include full airline names:
+   Case 1 - Standard Format:
+   ```
+   British Airways BA 123
+   LONDON (LHR) Terminal 3
+   10:15 Mon
+
+   PARIS (CDG) Terminal 2B
+   13:30 Mon
+   ```
+   → Flight name: British Airways BA 123
+   → Origin: LHR (10:15 is earlier)
+   → Destination: CDG (13:30 is later)
+
+# Update the Expected JSON Format example:
+Expected JSON Format:
+{
+    "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+    "flights": [
+        {
+            "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+            "flight_origin": "XXX",
+            "flight_destination": "YYY",
+            "travel_number": "XXXXXX",
+            "date_of_travel": "DD MMM YYYY HH:mm - DD MMM YYYY HH:mm",
+            "flight_name": "FULL AIRLINE NAME XX NNN",  # e.g., "China Eastern Airlines MU 245"
+            "notes": "via ZZZ"
+        }
+    ]
+}
+
+# Add to VALIDATION CHECKLIST:
+1. For Each Segment:
+   □ Identified complete flight name (airline name + code + number)
+   □ Verified airline name is included in flight_name field
+   □ Found exactly two timestamps
+   ...
+
+# Add to Common Errors to Avoid:
+2. Common Errors to Avoid:
+   □ Don't omit airline name from flight_name
+   □ Don't abbreviate airline names
+   □ Don't use only flight code and number
+
+
+ 3. Flight Segments and Directions:
+   - A flight segment is defined by a unique flight number
+   - CRITICAL: Follow these steps IN ORDER for EVERY segment:
+     1. Find the flight number
+     2. Locate ALL timestamps in that segment
+     3. Match each timestamp with its associated city/airport
+     4. EARLIER timestamp's city = ORIGIN (Departure)
+     5. LATER timestamp's city = DESTINATION (Arrival)
+
+   IMPORTANT RULES:
+   * Direction is determined ONLY by timestamps, not text order
+   * Ignore airline routes or typical flight patterns
+   * Each segment must be processed independently
+   * Text order of cities is irrelevant
+   * Only timestamp association determines origin/destination
+
+   Edge Cases and Examples:
+
+   Case 1 - Standard Format:
+   ```
+   FL 123
+   LONDON (LHR) Terminal 3
+   10:15 Mon
+
+   PARIS (CDG) Terminal 2B
+   13:30 Mon
+   ```
+   → Origin: LHR (10:15 is earlier)
+   → Destination: CDG (13:30 is later)
+
+   Case 2 - Reversed Text Order:
+   ```
+   FL 456
+   DUBAI (DXB)
+   Arrives: 05:30 Wed
+
+   SINGAPORE (SIN)
+   Departs: 22:45 Tue
+   ```
+   → Origin: SIN (22:45 is earlier)
+   → Destination: DXB (05:30 is later)
+   Note: Text order is DXB→SIN but timestamps show SIN→DXB
+
+   Case 3 - Overnight Flight:
+   ```
+   FL 789
+   TOKYO (HND)
+   23:50 Thu
+
+   SEOUL (ICN)
+   01:30 Fri +1
+   ```
+   → Origin: HND (23:50 is earlier)
+   → Destination: ICN (01:30 next day is later)
+
+   Case 4 - Mixed Format with Connection:
+   ```
+   FL 234
+   Departure: DELHI (DEL) 08:55
+   Via: MUMBAI (BOM)
+   Arrival: 10:45 | Departure: 11:30
+   Final: BANGKOK (BKK) 16:20
+   ```
+   → Should be processed as one segment
+   → Origin: DEL (08:55 is first time)
+   → Destination: BKK (16:20 is final time)
+   → Note: Include "via BOM" in notes
+
+   Case 5 - Unusual Format:
+   ```
+   FL 567 from NEW YORK (JFK)
+   Time of departure: 19:15
+   Operating carrier info...
+   Destination information:
+   MIAMI (MIA) scheduled arrival: 22:30
+   ```
+   → Origin: JFK (19:15 is earlier)
+   → Destination: MIA (22:30 is later)
+
+   Case 6 - Reverse Route with Different Dates:
+   ```
+   FL 890
+   FRANKFURT (FRA) Terminal 1
+   Wed, 25 Nov 21:15
+
+   SINGAPORE (SIN) Terminal 3
+   Thu, 26 Nov 05:40 +1
+   ```
+   → Origin: FRA (21:15 is earlier)
+   → Destination: SIN (05:40 next day is later)
+
+   Case 7 - Complex Multi-City Format:
+   ```
+   Journey Segment: FL 111
+   Arrival City: BANGKOK (BKK)
+   Arrival Time: 18:55
+   Departure Point: DUBAI (DXB)
+   Departure Time: 14:35
+   ```
+   → Origin: DXB (14:35 is earlier)
+   → Destination: BKK (18:55 is later)
+   Note: Despite "Arrival City" being listed first
+
+VALIDATION CHECKLIST:
+1. For Each Segment:
+   □ Identified flight number
+   □ Found exactly two timestamps
+   □ Matched each timestamp with correct city
+   □ Confirmed earlier time = origin
+   □ Confirmed later time = destination
+   □ Checked for date changes (+1)
+   □ Verified chronological sequence
+
+2. Common Errors to Avoid:
+   □ Don't assume first city listed is origin
+   □ Don't assume second city listed is destination
+   □ Don't rely on words like "from" or "to"
+   □ Don't use airline route patterns
+   □ Don't assume connection cities are destinations
+
+3. Quality Checks:
+   □ Every origin has a departure time
+   □ Every destination has an arrival time
+   □ All times follow chronological order
+   □ Date changes are properly noted
+   □ Layovers are noted but don't create new segments
+
+3. Origins and Destinations:
+  - For each flight segment:
+    * Read the city/airport codes in PAIRS (departure and arrival)
+    * Each pair represents one segment of the journey
+  - Route Continuity Rules:
+    * Outbound segments should connect logically
+    * Return segments may start from a different city than final outbound destination
+    * Check connecting times between segments
+  - Multiple-Leg Journeys:
+    * Verify if cities appear as both arrival and departure points
+    * Connect segments based on chronological order and flight numbers
+    * Pay attention to dates to distinguish outbound vs return segments
+
+    NOTE:
+    - Different flight numbers mean different segments.
+    - Return journey may follow a different route than outbound.
+    - Connecting cities will appear twice: once as arrival, once as departure.
+    - "+1 Day(s)" indicates overnight flight, not direction change.
+
+
+4. Dates:
+   - Date format must be "DD MMM YYYY HH:mm - DD MMM YYYY HH:mm"
+   - Include both departure and arrival times
+   - For multi-day flights, show both dates with times
+   - For flights with layovers, show initial departure and final arrival times
+
+5. Passengers:
+   - Names must be in UPPERCASE with proper spacing
+   - Format as "LASTNAME FIRSTNAME MIDDLENAME" if available
+   - Remove salutations (Mr, Mrs, etc.)
+   - If multiple tickets show identical itineraries for different passengers:
+     * List all passengers under each flight segment
+     * Combine identical flights for multiple passengers into single segments
+
+NOTES:
+- Different flight numbers mean different segments
+- Return journey may follow a different route than outbound
+- A gap between arrival and departure cities in consecutive flights is valid
+- "+1 Day(s)" indicates overnight flight, not direction change
+- Focus on extracting segments exactly as shown, without assumptions about continuity
+- Use dates and times as primary way to sequence flights
+
+Expected JSON Format:
+{
+    "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+    "flights": [
+        {
+            "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+            "flight_origin": "XXX",
+            "flight_destination": "YYY",
+            "travel_number": "XXXXXX",
+            "date_of_travel": "DD MMM YYYY HH:mm - DD MMM YYYY HH:mm",
+            "flight_name": "Airline XX NNN",
+            "notes": "via ZZZ" // for flights with layovers
+        }
+    ]
+}
+
+Text to analyze: '''
+
+# PROMPT_MODE=legacy sends PROMPT_TEMPLATE as-is; the default sends the
+# de-duplicated, minified prompt from prompt_builder
+PROMPT_BUILDER = prompt_builder.PromptBuilder(PROMPT_TEMPLATE)
+
+# Cached answers are tied to the exact prompt and pipeline that produced them
+PROMPT_VERSION = PROMPT_BUILDER.version
+RESULTS_VERSION = f"{PIPELINE_VERSION}-{PROMPT_VERSION}-{context_window.CONFIG_VERSION}"
+
+# Documents being processed right now, keyed by content hash and RESULTS_VERSION
+document_flights = singleflight.SingleFlight('document')
+
+def convert_pdf_to_images(pdf_content):
+    """Convert PDF to images using pypdfium2."""
+    try:
+        return [image for _, image in ocr_pipeline.iter_pdf_images(pdf_content)]
+    except Exception:
+        logger.exception("Error converting PDF to images")
+        return None
+
+def ocr_pages(pdf_content, pages=None):
+    """Yield ``(page_num, page_text)`` for the given pages (all pages by default)."""
+    if ocr_pipeline.PARALLEL_OCR_WORKERS > 1:
+        # Opt-in: spread pages over worker processes, results come back in page order
+        return ocr_pipeline.ocr_pages_parallel(pdf_content, pages=pages)
+    # Pages are rendered and OCR'd as a stream, so only a page or two is in memory
+    return ocr_pipeline.iter_ocr_pages(pdf_content, pages=pages)
+
+def process_with_paddleocr(pdf_content):
+    """Process PDF using PaddleOCR with pdfium conversion."""
+    try:
+        extracted_text = []
+
+        for page_num, page_content in ocr_pages(pdf_content):
+            if page_content.strip():
+                extracted_text.append(page_content)
+
+        return '\n\n'.join(extracted_text)
+
+    except Exception:
+        logger.exception("Error in OCR processing")
+        return None
+
+def validate_extracted_text(text):
+    """Validate if the extracted text contains enough meaningful content."""
+    if not text:
+        return False
+
+    # Check minimum length
+    if len(text.strip()) < 100:
+        return False
+
+    # Check for key flight document indicators
+    key_terms = ['flight', 'passenger', 'date', 'departure', 'arrival',
+                 'pnr', 'booking', 'ticket', 'airline']
+    found_terms = sum(1 for term in key_terms if term.lower() in text.lower())
+    if found_terms < 3:
+        return False
+
+    # Check text quality
+    readable_chars = sum(c.isalnum() or c.isspace() for c in text)
+    if readable_chars / len(text) < 0.65:  # Slightly relaxed threshold
+        return False
+
+    return True
+
+
+def validate_page_text(text):
+    """Check whether a single page's text layer is usable without OCR."""
+    if not text or len(text.strip()) < MIN_PAGE_TEXT_CHARS:
+        return False
+
+    # Same quality bar as the whole document, without the key-term check
+    # (a valid page of fare rules needn't mention flights)
+    readable_chars = sum(c.isalnum() or c.isspace() for c in text)
+    return readable_chars / len(text) >= 0.65
+
+
+def extract_pdfium_pages(file_content, pages=None):
+    """Extract each page's text layer with PDFium; yields ``(page_num, text)``."""
+    return ocr_pipeline.iter_pdf_text(file_content, pages)
+
+
+def extract_text_layer_pages(file_content, pages=None):
+    """Extract each page's text layer (tables first, then text) with PDFPlumber."""
+    with io.BytesIO(file_content) as pdf_file:
+        with pdfplumber.open(pdf_file) as pdf:
+            page_numbers = range(len(pdf.pages)) if pages is None else pages
+            for page_num in page_numbers:
+                page = pdf.pages[page_num]
+                page_text = ""
+                tables = page.extract_tables()
+                if tables:
+                    for table in tables:
+                        page_text += "\n".join([" ".join(filter(None, row))
+                                                for row in table]) + "\n\n"
+
+                text = page.extract_text()
+                if text:
+                    page_text += text + "\n\n"
+
+                yield page_num, page_text
+
+
+def extract_ocr_pages(file_content, pages=None):
+    """OCR the given pages; yields ``(page_num, text)``."""
+    return ocr_pages(file_content, pages=pages)
+
+
+TIER_EXTRACTORS = {
+    'pdfium': extract_pdfium_pages,
+    'pdfplumber': extract_text_layer_pages,
+    'paddleocr': extract_ocr_pages,
+}
+
+
+def run_extraction_tier(tier, file_content, pages, page_numbers):
+    """Run one tier over ``page_numbers``, filling in the pages whose text it can vouch for."""
+    start = time.perf_counter()
+    resolved = 0
+    failed = False
+    try:
+        with metrics.span(f'tier_{tier}'):
+            job_queue.report_progress(tier, 0, len(page_numbers))
+            for done, (page_num, page_text) in enumerate(
+                    TIER_EXTRACTORS[tier](file_content, page_numbers), 1):
+                # Stops between pages when the user cancels the job
+                job_queue.check_cancelled()
+                job_queue.report_progress(tier, done, len(page_numbers))
+                if tier == 'paddleocr' or validate_page_text(page_text):
+                    pages[page_num]['text'] = page_text
+                    pages[page_num]['extractor'] = tier
+                    if tier == 'paddleocr':
+                        pages[page_num]['ocr_profile'] = ocr_pipeline.get_ocr_profile()
+                    resolved += 1
+    except Exception:
+        logger.exception("Error in %s extraction", tier)
+        failed = True
+
+    with _extraction_stats_lock:
+        entry = EXTRACTION_STATS['tiers'].setdefault(
+            tier, {'runs': 0, 'pages': 0, 'resolved': 0, 'seconds': 0.0, 'errors': 0})
+        entry['runs'] += 1
+        entry['pages'] += len(page_numbers)
+        entry['resolved'] += resolved
+        entry['seconds'] += time.perf_counter() - start
+        entry['errors'] += int(failed)
+
+
+def hybrid_extract_pages(file_content, tiers=None):
+    """Extract text page by page, moving a page down the extraction ladder only while it fails.
+
+    Returns ``(text, pages)`` where ``text`` is the cleaned document text (or None)
+    and ``pages`` records, per page, the extractor that produced it (and the
+    OCR profile, for OCR'd pages). With PAGE_DEDUP=on, pages that repeat an earlier
+    page are cut down to what differs in ``text``, see ``page_dedup.collapse_repeated_pages``.
+    """
+    tiers = EXTRACTION_TIERS if tiers is None else tiers
+    try:
+        page_count = ocr_pipeline.count_pages(file_content)
+    except Exception:
+        logger.exception("Error reading PDF")
+        return None, []
+
+    pages = [{'page': page_num, 'text': '', 'extractor': None, 'ocr_profile': None}
+             for page_num in range(page_count)]
+    for tier in tiers:
+        remaining = [page['page'] for page in pages if page['extractor'] is None]
+        if not remaining:
+            break
+        run_extraction_tier(tier, file_content, pages, remaining)
+
+    # Last resort, as before: a text layer that reads fine page by page can
+    # still be junk (e.g. hidden text under a scan), so OCR the rest too
+    if 'paddleocr' in tiers and not validate_extracted_text(join_page_texts(pages)):
+        text_layer_pages = [page['page'] for page in pages
+                            if page['extractor'] in TEXT_LAYER_EXTRACTORS]
+        if text_layer_pages:
+            run_extraction_tier('paddleocr', file_content, pages, text_layer_pages)
+
+    record_extraction_stats(pages, tiers)
+    metrics.record_pages(pages)
+    metrics.annotate(pages=len(pages))
+
+    text = join_page_texts(pages)
+    if not validate_extracted_text(text):
+        return None, pages
+    if page_dedup.text_enabled():
+        with metrics.span('dedup'):
+            text = '\n\n'.join(page_text for page_text in page_dedup.collapse_repeated_pages(pages)
+                                if page_text)
+    with metrics.span('clean'):
+        return enhanced_clean_and_preprocess_text(text), pages
+
+
+def join_page_texts(pages):
+    """Concatenate page texts in page order, skipping empty pages."""
+    return '\n\n'.join(page['text'].strip() for page in pages if page['text'].strip())
+
+
+def record_extraction_stats(pages, tiers=()):
+    """Count which extractor handled each page, to measure how much OCR is avoided."""
+    ocr_count = sum(1 for page in pages if page['extractor'] == 'paddleocr')
+    used = [tier for tier in tiers if any(page['extractor'] == tier for page in pages)]
+    with _extraction_stats_lock:
+        EXTRACTION_STATS['documents'] += 1
+        EXTRACTION_STATS['pages'] += len(pages)
+        EXTRACTION_STATS['pages_text_layer'] += sum(1 for page in pages
+                                                    if page['extractor'] in TEXT_LAYER_EXTRACTORS)
+        EXTRACTION_STATS['pages_ocr'] += ocr_count
+        if ocr_count:
+            EXTRACTION_STATS['documents_with_ocr'] += 1
+            # The old all-or-nothing fallback OCR'd every page of such documents
+            EXTRACTION_STATS['ocr_pages_saved'] += len(pages) - ocr_count
+        resolved_by = used[-1] if used else 'unresolved'
+        counts = EXTRACTION_STATS['resolved_by']
+        counts[resolved_by] = counts.get(resolved_by, 0) + 1
+
+
+def hybrid_process_pdf(file_content):
+    """Hybrid PDF processing using PDFPlumber and PaddleOCR with pdfium."""
+    try:
+        text, _ = hybrid_extract_pages(file_content)
+        return text
+    except Exception:
+        logger.exception("Error in hybrid PDF processing")
+        return None
+
+
+def extract_document_text(file_content, doc_hash=None):
+    """hybrid_process_pdf, with the cleaned text cached by document content."""
+    cache = result_cache.get_cache()
+    doc_hash = doc_hash or result_cache.document_hash(file_content)
+
+    extracted_text = cache.get('text', doc_hash, PIPELINE_VERSION)
+    metrics.annotate(text_cached=extracted_text is not None)
+    if extracted_text is None:
+        extracted_text = hybrid_process_pdf(file_content)
+        if extracted_text:
+            cache.set('text', doc_hash, extracted_text, PIPELINE_VERSION)
+    return extracted_text
+
+
+def enhanced_clean_and_preprocess_text(text):
+    """Enhanced text cleaning with better formatting preservation."""
+    # The rules live in text_cleaning.CLEANING_RULES, compiled once and profiled per rule
+    return text_cleaning.clean_text(text)
+
+
+def parse_flight_json(json_output):
+    """Parse the LLM answer into a dict, tolerating markdown fences and surrounding text.
+
+    Raises ValueError with a user-facing message when no JSON can be recovered.
+    """
+    # First try to parse the input directly as JSON
+    try:
+        return json.loads(json_output)
+    except json.JSONDecodeError:
+        pass
+
+    # Clean the output of any markdown formatting
+    clean_json = json_output.replace('```json', '').replace('```', '').strip()
+    try:
+        return json.loads(clean_json)
+    except json.JSONDecodeError:
+        pass
+
+    # If still fails, try to extract JSON from markdown format
+    json_match = re.search(r'{.*}', clean_json, re.DOTALL)
+    if not json_match:
+        raise ValueError(f"Error: Could not find valid JSON data in the output\nOriginal output: {json_output}")
+    try:
+        return json.loads(json_match.group(0))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Error parsing JSON: {str(e)}\nOriginal JSON output: {json_output}")
+
+
+def passenger_list(data):
+    passenger_names = data.get('passenger_names', [])
+    if isinstance(passenger_names, str):
+        passenger_names = [passenger_names]
+    return passenger_names
+
+
+def format_passenger_header(passenger_names):
+    return [
+        f"Number of Passengers: {len(passenger_names)}",
+        f"Passengers: {','.join(passenger_names)}",
+        ""
+    ]
+
+
+def format_flight(idx, flight, passenger_names):
+    """One flight's section; flights without their own passengers list the document's."""
+    flight_passengers = flight.get('passenger_names', [])
+    if not flight_passengers:
+        flight_passengers = passenger_names
+
+    if isinstance(flight_passengers, str):
+        flight_passengers = [flight_passengers]
+
+    flight_passengers_str = ','.join(flight_passengers)
+
+    formatted_flight = [
+        f"Flight {idx}:",
+        f"- Passengers: {flight_passengers_str}",
+        f"- Flight origin: {flight['flight_origin']}",
+        f"- Flight destination: {flight['flight_destination']}",
+        f"- Travel number/PNR: {flight['travel_number']}",
+        f"- Date of travel: {flight['date_of_travel']}",
+        f"- Flight name: {flight['flight_name']}"
+    ]
+
+    if flight.get('notes'):
+        if flight['notes'].strip():
+            formatted_flight.append(f"- Notes: {flight['notes']}")
+
+    return "\n".join(formatted_flight)
+
+
+def format_flight_data(data):
+    """Format parsed flight data for display, with passenger count."""
+    passenger_names = passenger_list(data)
+    header = format_passenger_header(passenger_names)
+    formatted_flights = [format_flight(idx, flight, passenger_names)
+                         for idx, flight in enumerate(data['flights'], 1)]
+
+    all_sections = header + formatted_flights
+    return "\n\n".join(all_sections)
+
+
+def format_partial_flight_data(partial):
+    """Format an answer that is still streaming: the passengers once known, then finished flights."""
+    passenger_names = passenger_list(partial)
+    sections = format_passenger_header(passenger_names) if 'passenger_names' in partial else []
+    for idx, flight in enumerate(partial.get('flights', []), 1):
+        try:
+            sections.append(format_flight(idx, flight, passenger_names))
+        except (KeyError, TypeError, AttributeError):
+            # Incomplete entry; the full answer decides how it is shown
+            continue
+    return "\n\n".join(sections)
+
+
+def format_for_frontend(json_output):
+    """Format JSON output for display with passenger count and improved error handling."""
+    try:
+        with metrics.span('format'):
+            try:
+                data = parse_flight_json(json_output)
+            except ValueError as e:
+                return str(e)
+
+            return format_flight_data(data)
+
+    except Exception as e:
+        logger.warning("Error formatting output: %s", e)
+        return f"Error formatting output: {str(e)}\nOriginal JSON output: {json_output}"
+
+
+def remember_flight_data(doc_hash, json_output):
+    """Cache the parsed LLM answer, but only if it is complete enough to display.
+
+    Returns the parsed answer, or None if it wasn't cached.
+    """
+    try:
+        flight_data = parse_flight_json(json_output)
+        format_flight_data(flight_data)
+    except Exception:
+        return None
+    result_cache.get_cache().set('flights', doc_hash, flight_data, RESULTS_VERSION)
+    return flight_data
+
+
+def match_layout_template(file_content):
+    """Read the document's text-layer layout and look it up; returns ``(layout, match)``.
+
+    Never fails the document: on an error the lookup counts as a miss.
+    """
+    if layout_templates.MODE == 'off':
+        return None, None
+    layout = None
+    try:
+        store = layout_templates.get_store()
+        # Templates learned from another prompt's answers would disagree with this one's
+        store.ensure_version(PROMPT_VERSION)
+        with metrics.span('template'):
+            layout = layout_templates.read_layout(file_content)
+            return layout, store.match(layout)
+    except Exception:
+        logger.exception("Error looking up layout template")
+        return layout, None
+
+
+def learn_layout_template(layout, flight_data, matched):
+    """Hand a validated LLM answer to the template store; never fails the document."""
+    if layout is None or flight_data is None:
+        return
+    try:
+        layout_templates.get_store().observe(layout, flight_data, matched)
+    except Exception:
+        logger.exception("Error learning layout template")
+
+
+def query_chat_endpoint(extracted_text, prompt_stats=None, stream=False):
+    """POST the prompt plus document text to the chat endpoint.
+
+    If ``prompt_stats`` is a dict it is filled with the prompt vs. document
+    size of this request. With ``stream=True`` the answer is requested as a
+    stream and left unread; pass the response to ``stream_answer``.
+    """
+    data = build_chat_request(extracted_text, prompt_stats)
+    # Pooled keep-alive session with timeouts and retries on 429/5xx
+    with metrics.span('llm_post'):
+        return llm_client.get_client(url, headers).post(data, stream=stream)
+
+
+def build_chat_request(extracted_text, prompt_stats=None):
+    """The chat endpoint's request body for ``extracted_text``; see ``query_chat_endpoint``."""
+    # Long bundles: keep only the spans around PNRs, flights, airports, times and names
+    with metrics.span('context_window'):
+        document_text, window_stats = context_window.select_context(extracted_text)
+
+    with metrics.span('prompt_build'):
+        data, stats = PROMPT_BUILDER.build(document_text)
+    if prompt_stats is not None:
+        prompt_stats.update(stats)
+        prompt_stats['context'] = window_stats
+    metrics.annotate(prompt_tokens=stats['prompt_tokens'] + stats['document_tokens'])
+    return data
+
+
+def stream_answer(response, on_partial=None):
+    """Read a streamed answer; returns its full text.
+
+    ``on_partial`` is called with ``{'passenger_names': [...], 'flights': [...]}``
+    (passenger_names once known) each time the passenger list or another
+    flight closes in the stream.
+    """
+    parser = json_stream.IncrementalJSONParser(
+        [('passenger_names',), ('flights', json_stream.ANY)])
+    partial = {'flights': []}
+    pieces = []
+    start = time.perf_counter()
+    with metrics.span('llm_stream'):
+        for piece in llm_client.get_client(url, headers).iter_answer(response):
+            pieces.append(piece)
+            completed = parser.feed(piece)
+            if not completed:
+                continue
+            if len(partial) == 1 and not partial['flights']:
+                metrics.annotate(llm_first_item_seconds=time.perf_counter() - start)
+            for path, value in completed:
+                if path == ('passenger_names',):
+                    partial['passenger_names'] = value
+                else:
+                    partial['flights'].append(value)
+            if on_partial is not None:
+                # A copy: the caller may hold on to it while more flights arrive
+                on_partial(dict(partial, flights=list(partial['flights'])))
+    return ''.join(pieces)
+
+
+def answer_from_response(response):
+    """Pull the model's answer text out of a chat endpoint response."""
+    json_response = json.loads(response.text)
+    return json_response["messages"][0]["answer"]
+
+
+def process_document(file_content):
+    """Extract and query one uploaded document.
+
+    Returns ``{'outcome', 'output'}`` on success (``output`` is the formatted
+    flight information) or ``{'outcome', 'error'}`` with a message for the user.
+    """
+    doc_hash = result_cache.document_hash(file_content)
+
+    # Two sessions opening the same PDF, or a rerun while its job runs, share one
+    # extraction and one LLM call; the later caller waits for the first
+    result = document_flights.do((doc_hash, RESULTS_VERSION), run_document_pipeline,
+                                 file_content, doc_hash, wait_check=wait_for_same_document)
+    # Waiters have no spans of their own; record what they got
+    metrics.annotate(outcome=result['outcome'])
+    return dict(result)
+
+
+def wait_for_same_document():
+    """Runs while this job waits on another job's identical document; cancelling still works."""
+    job_queue.report_progress('coalesced')
+    job_queue.check_cancelled()
+
+
+def run_document_pipeline(file_content, doc_hash):
+    """The work behind ``process_document``, done once per concurrent document."""
+    cache = result_cache.get_cache()
+    with metrics.span('cache_lookup'):
+        flight_data = cache.get('flights', doc_hash, RESULTS_VERSION)
+    if flight_data is not None:
+        metrics.annotate(outcome='cached')
+        return {'outcome': 'cached', 'output': format_flight_data(flight_data)}
+
+    # A known itinerary layout is read directly, without OCR or the LLM
+    layout, matched = match_layout_template(file_content)
+    if matched is not None and layout_templates.should_serve():
+        template_id, flight_data = matched
+        try:
+            formatted_output = format_flight_data(flight_data)
+        except Exception:
+            logger.exception("Layout template %s gave an unusable answer", template_id)
+        else:
+            cache.set('flights', doc_hash, flight_data, RESULTS_VERSION)
+            metrics.annotate(outcome='template', template=template_id)
+            return {'outcome': 'template', 'output': formatted_output}
+
+    with metrics.span('extract'):
+        extracted_text = extract_document_text(file_content, doc_hash)
+
+    if not extracted_text:
+        metrics.annotate(outcome='no_text')
+        return {'outcome': 'no_text', 'error': "Could not extract information from document"}
+
+    job_queue.check_cancelled()
+    job_queue.report_progress('llm')
+    prompt_stats = {}
+    try:
+        response = query_chat_endpoint(extracted_text, prompt_stats, stream=LLM_STREAM)
+    except requests.RequestException as e:
+        # Timed out or unreachable even after retries
+        logger.error("Error calling chat endpoint: %s", e)
+        response = None
+
+    if 'context' in prompt_stats:
+        # How much of the document the context window left out, as batch records it
+        metrics.annotate(context=prompt_stats['context'])
+    if response is None or response.status_code not in [200, 201]:
+        metrics.annotate(outcome='llm_error')
+        return {'outcome': 'llm_error', 'error': "Unable to process document"}
+
+    try:
+        if LLM_STREAM:
+            # Passengers and finished flights reach the page while the rest is generated
+            json_output = stream_answer(response, job_queue.report_partial)
+        else:
+            json_output = answer_from_response(response)
+        formatted_output = format_for_frontend(json_output)
+        flight_data = remember_flight_data(doc_hash, json_output)
+    except Exception:
+        logger.exception("Error processing response")
+        metrics.annotate(outcome='response_error')
+        return {'outcome': 'response_error', 'error': "Error processing response"}
+
+    learn_layout_template(layout, flight_data, matched)
+    metrics.annotate(outcome='ok')
+    return {'outcome': 'ok', 'output': formatted_output}
+
+
+def run_document_job(file_content, name):
+    """Job body: process one document under its own trace; the result is JSON-serializable."""
+    with metrics.trace(name, bytes=len(file_content)) as doc_trace:
+        try:
+            result = process_document(file_content)
+        except job_queue.JobCancelled:
+            doc_trace.annotate(outcome='cancelled')
+            raise
+    result['trace'] = doc_trace.summary()
+    return result
+
@@ -0,0 +1,300 @@
+"""Builds the extraction prompt from structured sections.
+
+The original ``PROMPT_TEMPLATE`` in pipeline.py grew by appending patches, so the
+JSON format, the validation checklist and the first direction example each
+appear twice. The sections below carry every rule exactly once; ``minify``
+then drops blank lines and halves indentation, which shrinks the static part
+of each request without changing the instructions.
+"""
+import hashlib
+import os
+import re
+
+INTRO = '''You are an expert in analyzing travel documents and decoding flight information. Extract all relevant information from the provided travel document and return the data in a json format. Follow these guidelines:'''
+
+TRAVEL_NUMBER = '''1. Travel Number:
+   - The "travel_number" refers to the unique booking identifier.
+   - Valid labels/identifiers (in priority order):
+     1. "Airline PNR" or "PNR:" or "PNR -"
+     2. "Confirmation Number:"
+     3. "Reservation Code:"
+     4. "Check-in Reference:" (when not marked as agency/GDS reference)
+     5. "GDS PNR" (when explicitly marked as ticket PNR, not agency reference)
+   - Format Requirements:
+     * Must be between 5 and 7 characters long (inclusive)
+     * Must be a standalone identifier
+     * Can contain letters and numbers
+     * May contain a hyphen (-)
+     * Confirmation Numbers:
+       - Take ONLY the standalone alphanumeric string immediately after the label, exactly 5-6 characters long
+       - Stop at the first complete identifier; ignore any trailing digits or text even if connected
+       - "Confirmation Number: ABC12D" -> "ABC12D"
+       - "Confirmation Number: ABC12D 99" -> "ABC12D"
+       - "Confirmation Number: ABC12D99" -> "ABC12D" (NOT "ABC12D99")
+       - "Confirmation Number: ABC12D456" -> "ABC12D" (NOT "ABC12D456")
+     * Check-in References in complex layouts:
+       - "Agency Reference: 123456 Check-in Reference: ABC789(XY)" -> "ABC789"
+       - "Check-in Reference: DEF456(ZZ) / OTHER123" -> "DEF456"
+     * Header-style references:
+       Agency Reference:  Check-in Reference:  Travel Agency:
+       ABC123            XYZ789(DL)           AGENCY NAME
+       -> extract "XYZ789"
+   - Identification Rules:
+     * Check document sections for explicit PNR labels first, then look for standalone PNR formats
+     * For Check-in References, ignore any text in parentheses (from "ABC123(XY)" take only "ABC123") and after forward slashes (/)
+     * When multiple identifiers exist, use ONLY the highest priority one:
+       Airline PNR > Confirmation Number > GDS PNR (explicitly marked as ticket PNR) > Check-in Reference (standalone, not agency-related)
+   - NEVER extract:
+     * ANY number labeled "Agency Reference:" or "Agency Ref:", any reference starting with "Agency" or from a travel agency section
+     * GDS References when marked as agency reference (e.g. "GDS Reference: XY789Z" in an agency section)
+     * Booking References longer than 7 characters (e.g. "Booking: REF123456789", "Reference: BOOK987654321")
+     * Reference numbers containing spaces
+     * E-ticket numbers (usually 10+ digits, e.g. "E-ticket: 1234567890123")
+     * Flight numbers (airline code + numbers, e.g. "BA 123")
+     * Order IDs (usually longer than 7 characters, e.g. "Order ID: 34728581279")
+     * Cart Information numbers
+     * Any part of a longer string
+   - CORRECT to extract: "PNR: ABC123", "Airline PNR - XYZ45P", "PNR: KLM789", "Confirmation Number: N7K42L", "Confirmation #: RT567K", "Check-in Ref: H8M92P", "Check-in Reference: ABC123(XY)" -> "ABC123", "Reference: WQ456T" (when not in agency section)
+   - Validation steps:
+     1. First scan for explicit "Agency Reference" labels and EXCLUDE these numbers
+     2. Then scan for explicit PNR labels in priority order
+     3. Check each candidate against the format requirements and the exclusion list
+     4. Confirm it's a complete standalone identifier
+   Note: Always prioritize explicitly labeled identifiers over inferred ones. If in doubt, prefer not to extract rather than extract incorrectly.'''
+
+FLIGHT_NAME = '''2. Flight Name:
+   - flight_name must ALWAYS include both airline name and flight number, formatted "AIRLINE NAME XX NNN":
+     * AIRLINE NAME is the complete carrier name (e.g., "China Eastern Airlines", "Emirates")
+     * XX is the airline code (e.g., "MU", "EK"), NNN is the flight number
+   - Always extract the full airline name when available in the document
+   - Common airline codes: MU = China Eastern Airlines, EK = Emirates, CZ = China Southern Airlines, CA = Air China, QR = Qatar Airways
+   - Examples: "China Eastern Airlines MU 245", "Emirates EK 302", "Qatar Airways QR 545"
+   - Do NOT abbreviate airline names, omit the airline name, or use only flight code and number'''
+
+SEGMENTS = '''3. Flight Segments and Directions:
+   - A flight segment is defined by a unique flight number
+   - CRITICAL: Follow these steps IN ORDER for EVERY segment:
+     1. Find the flight number
+     2. Locate ALL timestamps in that segment
+     3. Match each timestamp with its associated city/airport
+     4. EARLIER timestamp's city = ORIGIN (Departure)
+     5. LATER timestamp's city = DESTINATION (Arrival)
+   IMPORTANT RULES:
+   * Direction is determined ONLY by timestamps, not text order
+   * Ignore airline routes or typical flight patterns
+   * Each segment must be processed independently
+   Edge Cases and Examples:
+   Case 1 - Standard Format:
+   ```
+   British Airways BA 123
+   LONDON (LHR) Terminal 3
+   10:15 Mon
+   PARIS (CDG) Terminal 2B
+   13:30 Mon
+   ```
+   -> Flight name: British Airways BA 123, Origin: LHR (10:15 is earlier), Destination: CDG (13:30 is later)
+   Case 2 - Reversed Text Order:
+   ```
+   FL 456
+   DUBAI (DXB)
+   Arrives: 05:30 Wed
+   SINGAPORE (SIN)
+   Departs: 22:45 Tue
+   ```
+   -> Origin: SIN (22:45 is earlier), Destination: DXB (05:30 is later). Text order is DXB->SIN but timestamps show SIN->DXB
+   Case 3 - Overnight Flight:
+   ```
+   FL 789
+   TOKYO (HND)
+   23:50 Thu
+   SEOUL (ICN)
+   01:30 Fri +1
+   ```
+   -> Origin: HND (23:50 is earlier), Destination: ICN (01:30 next day is later)
+   Case 4 - Mixed Format with Connection:
+   ```
+   FL 234
+   Departure: DELHI (DEL) 08:55
+   Via: MUMBAI (BOM)
+   Arrival: 10:45 | Departure: 11:30
+   Final: BANGKOK (BKK) 16:20
+   ```
+   -> One segment. Origin: DEL (08:55 is first time), Destination: BKK (16:20 is final time), notes: "via BOM"
+   Case 5 - Unusual Format:
+   ```
+   FL 567 from NEW YORK (JFK)
+   Time of departure: 19:15
+   Operating carrier info...
+   Destination information:
+   MIAMI (MIA) scheduled arrival: 22:30
+   ```
+   -> Origin: JFK (19:15 is earlier), Destination: MIA (22:30 is later)
+   Case 6 - Reverse Route with Different Dates:
+   ```
+   FL 890
+   FRANKFURT (FRA) Terminal 1
+   Wed, 25 Nov 21:15
+   SINGAPORE (SIN) Terminal 3
+   Thu, 26 Nov 05:40 +1
+   ```
+   -> Origin: FRA (21:15 is earlier), Destination: SIN (05:40 next day is later)
+   Case 7 - Complex Multi-City Format:
+   ```
+   Journey Segment: FL 111
+   Arrival City: BANGKOK (BKK)
+   Arrival Time: 18:55
+   Departure Point: DUBAI (DXB)
+   Departure Time: 14:35
+   ```
+   -> Origin: DXB (14:35 is earlier), Destination: BKK (18:55 is later), despite "Arrival City" being listed first'''
+
+CHECKLIST = '''VALIDATION CHECKLIST:
+1. For Each Segment:
+   □ Identified complete flight name (airline name + code + number)
+   □ Found exactly two timestamps
+   □ Matched each timestamp with correct city
+   □ Confirmed earlier time = origin, later time = destination
+   □ Checked for date changes (+1)
+   □ Verified chronological sequence
+2. Common Errors to Avoid:
+   □ Don't omit or abbreviate airline names in flight_name
+   □ Don't assume the first city listed is origin or the second is destination
+   □ Don't rely on words like "from" or "to"
+   □ Don't use airline route patterns
+   □ Don't assume connection cities are destinations
+3. Quality Checks:
+   □ Every origin has a departure time and every destination an arrival time
+   □ All times follow chronological order and date changes are properly noted
+   □ Layovers are noted but don't create new segments'''
+
+ORIGINS = '''4. Origins and Destinations:
+  - Read the city/airport codes of each segment in PAIRS (departure and arrival)
+  - Route Continuity Rules:
+    * Outbound segments should connect logically; check connecting times between segments
+    * Return journey may start from a different city than the final outbound destination and follow a different route
+    * Connecting cities appear twice: once as arrival, once as departure
+    * A gap between arrival and departure cities in consecutive flights is valid
+  - Connect segments based on chronological order and flight numbers; use dates to distinguish outbound vs return segments
+  - "+1 Day(s)" indicates overnight flight, not direction change
+  - Focus on extracting segments exactly as shown, without assumptions about continuity'''
+
+DATES = '''5. Dates:
+   - Date format must be "DD MMM YYYY HH:mm - DD MMM YYYY HH:mm" with both departure and arrival times
+   - For multi-day flights, show both dates with times
+   - For flights with layovers, show initial departure and final arrival times'''
+
+PASSENGERS = '''6. Passengers:
+   - Names must be in UPPERCASE with proper spacing, formatted "LASTNAME FIRSTNAME MIDDLENAME" if available
+   - Remove salutations (Mr, Mrs, etc.)
+   - If multiple tickets show identical itineraries for different passengers, combine them into single segments listing all passengers'''
+
+JSON_FORMAT = '''Expected JSON Format:
+{
+    "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+    "flights": [
+        {
+            "passenger_names": ["LASTNAME FIRSTNAME MIDDLENAME"],
+            "flight_origin": "XXX",
+            "flight_destination": "YYY",
+            "travel_number": "XXXXXX",
+            "date_of_travel": "DD MMM YYYY HH:mm - DD MMM YYYY HH:mm",
+            "flight_name": "FULL AIRLINE NAME XX NNN",
+            "notes": "via ZZZ"
+        }
+    ]
+}
+"notes" is only for flights with layovers.'''
+
+SECTIONS = [
+    ('intro', INTRO),
+    ('travel_number', TRAVEL_NUMBER),
+    ('flight_name', FLIGHT_NAME),
+    ('segments', SEGMENTS),
+    ('checklist', CHECKLIST),
+    ('origins', ORIGINS),
+    ('dates', DATES),
+    ('passengers', PASSENGERS),
+    ('json_format', JSON_FORMAT),
+]
+
+DOCUMENT_LEAD = 'Text to analyze: '
+
+# legacy: pipeline.PROMPT_TEMPLATE as-is; compact: minified sections inline;
+# prefix: minified sections sent as a separate, versioned system part
+PROMPT_MODES = ('legacy', 'compact', 'prefix')
+DEFAULT_PROMPT_MODE = os.environ.get('PROMPT_MODE', 'compact')
+
+
+def minify(text):
+    """Drop trailing spaces and blank lines, and halve indentation."""
+    lines = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line:
+            continue
+        stripped = line.lstrip(' ')
+        indent = (len(line) - len(stripped)) // 2
+        lines.append(' ' * indent + stripped)
+    return '\n'.join(lines)
+
+
+def build_instructions(sections=SECTIONS):
+    """The static part of the prompt, de-duplicated and minified."""
+    return '\n'.join(minify(text) for _, text in sections)
+
+
+def version_of(text):
+    """Short content hash identifying a prompt revision."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+def estimate_tokens(text):
+    """Rough token count: words, numbers and individual punctuation marks.
+
+    Close enough to a BPE tokenizer for comparing prompt and document sizes,
+    without pulling a tokenizer into the app.
+    """
+    return len(re.findall(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]", text))
+
+
+INSTRUCTIONS = build_instructions()
+INSTRUCTIONS_VERSION = version_of(INSTRUCTIONS)
+
+
+class PromptBuilder:
+    """Turns extracted document text into a chat endpoint request body."""
+
+    def __init__(self, legacy_template, mode=DEFAULT_PROMPT_MODE):
+        if mode not in PROMPT_MODES:
+            raise ValueError(f"Unknown prompt mode {mode!r}, expected one of {PROMPT_MODES}")
+        self.mode = mode
+        self.legacy_template = legacy_template
+        if mode == 'legacy':
+            self.instructions = legacy_template
+        else:
+            self.instructions = INSTRUCTIONS + '\n' + DOCUMENT_LEAD
+        self.version = f"{mode}-{version_of(self.instructions)}"
+        self.instruction_tokens = estimate_tokens(self.instructions)
+
+    def build(self, document_text):
+        """Return ``(payload, stats)`` for one document."""
+        if self.mode == 'prefix':
+            # The static part travels separately under a stable version, so the
+            # endpoint (or a caching proxy in front of it) can reuse it across requests
+            payload = {
+                "system": self.instructions,
+                "prompt_version": self.version,
+                "question": document_text,
+            }
+        else:
+            payload = {"question": self.instructions + document_text}
+
+        stats = {
+            'mode': self.mode,
+            'prompt_version': self.version,
+            'prompt_chars': len(self.instructions),
+            'document_chars': len(document_text),
+            'prompt_tokens': self.instruction_tokens,
+            'document_tokens': estimate_tokens(document_text),
+        }
+        return payload, stats
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join('.cache', 'results.sqlite3'))
+DEFAULT_MEMORY_ITEMS = int(os.environ.get('RESULT_CACHE_MEMORY_ITEMS', '256'))
+DEFAULT_MAX_DISK_BYTES = int(float(os.environ.get('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024)
+DEFAULT_TTL_SECONDS = float(os.environ.get('RESULT_CACHE_TTL_DAYS', '30')) * 24 * 3600
+
+
+def document_hash(content):
+    """Content address of an uploaded document."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def text_version(text):
+    """Short, stable version tag for a piece of configuration such as a prompt."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+class ResultCache:
+    """Two-level cache for pipeline results: an in-memory LRU over an SQLite store.
+
+    Entries live in namespaces (e.g. ``text``, ``flights``) and are keyed by the
+    document hash plus the version of whatever produced them, so a pipeline or
+    prompt change never serves stale results. The disk tier is bounded by total
+    size and evicts least-recently-used entries; both tiers honour a TTL.
+    Entries of other versions are left to that eviction rather than wiped: the
+    app, the batch CLI and the API may share one file with different settings.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_items=DEFAULT_MEMORY_ITEMS,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'invalidations': 0,
+        }
+
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _expired(self, created, now):
+        return self.ttl_seconds and now - created > self.ttl_seconds
+
+    def get(self, namespace, key, version=''):
+        """Return the cached value, or None on a miss."""
+        now = time.time()
+        full_key = (namespace, f"{key}:{version}")
+
+        with self._lock:
+            entry = self._memory.get(full_key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(full_key)
+                    self.stats['memory_hits'] += 1
+                    return value
+                del self._memory[full_key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, created FROM entries WHERE namespace = ? AND key = ?',
+                    full_key).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._db.execute(
+                        'UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?',
+                        (now, *full_key))
+                    value = json.loads(row[0])
+                    self._remember(full_key, row[1], value)
+                    self.stats['disk_hits'] += 1
+                    return value
+
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, namespace, key, value, version=''):
+        """Store a JSON-serializable value in both tiers."""
+        now = time.time()
+        full_key = (namespace, f"{key}:{version}")
+        payload = json.dumps(value)
+
+        with self._lock:
+            self._remember(full_key, now, value)
+            self.stats['writes'] += 1
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries (namespace, key, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (*full_key, payload, len(payload), now, now))
+                self._evict_disk(now)
+
+    def _remember(self, full_key, created, value):
+        self._memory[full_key] = (created, value)
+        self._memory.move_to_end(full_key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def _evict_disk(self, now):
+        """Drop expired entries, then the least recently used until under the size cap."""
+        if self.ttl_seconds:
+            cursor = self._db.execute('DELETE FROM entries WHERE created < ?',
+                                      (now - self.ttl_seconds,))
+            self.stats['disk_evictions'] += cursor.rowcount
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        excess = total - self.max_disk_bytes
+        freed = 0
+        victims = []
+        for namespace, key, size in self._db.execute(
+                'SELECT namespace, key, size FROM entries ORDER BY accessed'):
+            victims.append((namespace, key))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany('DELETE FROM entries WHERE namespace = ? AND key = ?', victims)
+        self.stats['disk_evictions'] += len(victims)
+
+    def invalidate(self, namespace=None):
+        """Forget every entry, or every entry in one namespace."""
+        with self._lock:
+            if namespace is None:
+                self._memory.clear()
+            else:
+                for full_key in [k for k in self._memory if k[0] == namespace]:
+                    del self._memory[full_key]
+
+            if self._db is not None:
+                if namespace is None:
+                    self._db.execute('DELETE FROM entries')
+                else:
+                    self._db.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+            self.stats['invalidations'] += 1
+
+    def snapshot(self):
+        """Hit/miss counters plus current tier sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+            if self._db is not None:
+                count, size = self._db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+                stats['disk_entries'] = count
+                stats['disk_bytes'] = size
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache instance.
+
+    Lives in this module rather than in app.py because Streamlit re-executes the
+    app script on every rerun, which would throw the memory tier away.
+    Setting RESULT_CACHE_PATH to an empty string keeps the cache in memory only.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
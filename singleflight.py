@@ -0,0 +1,141 @@
+"""Coalescing of identical work that is already in progress.
+
+When a call arrives for a key that another caller is already computing, it
+waits for that computation and shares its result instead of starting a
+second one. The first caller is the leader. An exception raised by the
+leader's function is raised in every waiter too.
+
+Cancellation affects only the caller it is aimed at:
+- A waiter that is cancelled (its ``wait_check`` raises) stops waiting, and
+  the leader carries on.
+- If the leader is cancelled, or dies of some other ``BaseException`` such
+  as ``job_queue.JobCancelled``, its waiters were not cancelled. The first
+  of them takes over as the new leader rather than failing.
+
+``SingleFlight`` is for threads and ``AsyncSingleFlight`` for coroutines on
+one event loop. Both only coalesce within a process.
+"""
+import asyncio
+import threading
+
+import metrics
+
+# How often a waiter runs its wait_check while the leader works
+WAIT_POLL_SECONDS = 0.2
+
+SINGLEFLIGHT_CALLS = metrics.registry.counter(
+    'flightdoc_singleflight_calls_total',
+    'Calls per single-flight group, by role: leader (did the work) or coalesced (shared it).')
+SINGLEFLIGHT_TAKEOVERS = metrics.registry.counter(
+    'flightdoc_singleflight_takeovers_total',
+    'Waiters that redid the work because the leader was cancelled.')
+
+
+class _Call:
+    """One in-progress computation and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one ``func`` per key at a time; concurrent callers share its result."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, wait_check=None, **kwargs):
+        """``func(*args, **kwargs)``, or the result of the identical call already running.
+
+        ``wait_check`` is called every ``WAIT_POLL_SECONDS`` while waiting, and
+        may raise to stop waiting (e.g. ``job_queue.check_cancelled``).
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+            if leader:
+                SINGLEFLIGHT_CALLS.inc(group=self.name, role='leader')
+                return self._lead(key, call, func, args, kwargs)
+
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role='coalesced')
+            try:
+                while not call.done.wait(WAIT_POLL_SECONDS):
+                    if wait_check is not None:
+                        wait_check()
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+            if call.abandoned:
+                SINGLEFLIGHT_TAKEOVERS.inc(group=self.name)
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def _lead(self, key, call, func, args, kwargs):
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """``{key: waiters}`` for the calls running now."""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines: one task per key, awaited by every caller.
+
+    The work runs as its own task. A caller that is cancelled (e.g. its
+    client disconnected) stops waiting without cancelling the work the others
+    are waiting for. If the task itself is cancelled, every waiter gets
+    ``CancelledError``.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        """``await func(*args, **kwargs)``, or the result of the identical call already running."""
+        task = self._tasks.get(key)
+        if task is None:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role='leader')
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+        else:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role='coalesced')
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every waiter has gone away
+            task.exception()
+
+    def in_flight(self):
+        return list(self._tasks)